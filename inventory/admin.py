@@ -1,8 +1,10 @@
 # inventory/admin.py
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.forms import ValidationError
-from .models import Category, Supplier, Product, Transaction, Receipt, ReceiptItem, Invoice, InvoiceItem
+from .models import Category, Supplier, Product, Transaction, Receipt, ReceiptItem, Invoice, InvoiceItem, DailySummary, StockTake
+from .forms import StockCheckedLineFormSet
+from .services import post_receipt_items, post_invoice_items, repost_items, void_document
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -38,37 +40,71 @@ class TransactionAdmin(admin.ModelAdmin):
 
 # --- Inline Admins for Receipt and Invoice Items ---
 
-class ReceiptItemInline(admin.TabularInline):
-    model = ReceiptItem
+class DocumentItemInline(admin.TabularInline):
+    """Lines of a void document are kept for the record only: they cannot be added, edited or removed."""
+    formset = StockCheckedLineFormSet # Shortfalls are form errors, found before anything is saved
     extra = 1 # Number of empty forms to display
     autocomplete_fields = ['product'] # Requires search_fields in ProductAdmin
 
-class InvoiceItemInline(admin.TabularInline):
+    def has_add_permission(self, request, obj=None):
+        return (obj is None or obj.status != 'void') and super().has_add_permission(request, obj)
+
+    def has_change_permission(self, request, obj=None):
+        return (obj is None or obj.status != 'void') and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return (obj is None or obj.status != 'void') and super().has_delete_permission(request, obj)
+
+class ReceiptItemInline(DocumentItemInline):
+    model = ReceiptItem
+
+class InvoiceItemInline(DocumentItemInline):
     model = InvoiceItem
-    extra = 1
-    autocomplete_fields = ['product']
+
+
+class DocumentAdmin(admin.ModelAdmin):
+    """
+    Invoices and receipts are voided, never deleted, so their stock is reversed and the
+    record kept (see services.void_document). A void document is read-only.
+    """
+    actions = ['void_selected']
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return (obj is None or obj.status != 'void') and super().has_change_permission(request, obj)
+
+    @admin.action(description="Void selected documents (reverses their stock)")
+    def void_selected(self, request, queryset):
+        voided = 0
+        for document in queryset.filter(status='posted').order_by('pk'):
+            try:
+                void_document(document, user=request.user)
+                voided += 1
+            except ValidationError as e:
+                for message in e.messages:
+                    self.message_user(request, f"{document}: {message}", level=messages.ERROR)
+        if voided:
+            self.message_user(request, f"Voided {voided} document(s).")
 
 @admin.register(Receipt)
-class ReceiptAdmin(admin.ModelAdmin):
-    list_display = ('receipt_number', 'supplier', 'purchase_date', 'total_amount', 'created_by', 'created_at')
-    list_filter = ('purchase_date', 'supplier', 'created_by')
+class ReceiptAdmin(DocumentAdmin):
+    list_display = ('receipt_number', 'supplier', 'purchase_date', 'total_amount', 'status', 'created_by', 'created_at')
+    list_filter = ('status', 'purchase_date', 'supplier', 'created_by')
     search_fields = ('receipt_number', 'supplier__name', 'notes')
     inlines = [ReceiptItemInline]
-    readonly_fields = ('total_amount', 'created_at', 'updated_at') # Calculated fields
+    readonly_fields = ('total_amount', 'created_at', 'updated_at', # Calculated fields
+                       'status', 'voided_at', 'voided_by') # Set by voiding, which also reverses the stock
     autocomplete_fields = ['supplier'] # Requires search_fields in SupplierAdmin
 
     def save_formset(self, request, form, formset, change):
-        """Recalculate total after saving inline formset."""
-        instances = formset.save(commit=False)
-        for instance in instances:
-            # Ensure association with the main object if needed,
-            # and link created_by if applicable to line items.
-            instance.save()
-        formset.save_m2m()
-        # Recalculate the total after all items are saved
-        if form.instance.pk:
-            form.instance.calculate_total()
-            form.instance.save() # Save the main object again with updated total
+        """Post a new receipt's items in one batch; edits post only the net change per product."""
+        if change:
+            repost_items(form.instance, formset, user=request.user)
+        else:
+            # New lines: bulk insert, grouped stock update and a single total calculation
+            post_receipt_items(form.instance, formset.save(commit=False))
 
     def save_model(self, request, obj, form, change):
         """Assign the current user when creating a receipt."""
@@ -80,41 +116,30 @@ class ReceiptAdmin(admin.ModelAdmin):
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ('invoice_number', 'customer_name', 'sale_date', 'total_amount', 'created_by', 'created_at')
-    list_filter = ('sale_date', 'created_by')
+class InvoiceAdmin(DocumentAdmin):
+    list_display = ('invoice_number', 'customer_name', 'sale_date', 'total_amount', 'status', 'created_by', 'created_at')
+    list_filter = ('status', 'sale_date', 'created_by')
     search_fields = ('invoice_number', 'customer_name', 'notes')
     inlines = [InvoiceItemInline]
-    readonly_fields = ('sub_total', 'tax_amount', 'discount_amount', 'total_amount', 'created_at', 'updated_at')
+    readonly_fields = ('sub_total', 'tax_amount', 'discount_amount', 'total_amount', 'created_at', 'updated_at',
+                       'status', 'voided_at', 'voided_by')
     fieldsets = (
         (None, {'fields': ('invoice_number', 'customer_name', 'sale_date', 'due_date', 'notes')}),
         ('Pricing', {'fields': ('tax_rate', 'discount_rate')}),
         ('Totals', {'fields': ('sub_total', 'discount_amount', 'tax_amount', 'total_amount')}),
+        ('Status', {'fields': ('status', 'voided_at', 'voided_by')}),
     )
 
     def save_formset(self, request, form, formset, change):
-        """Recalculate total after saving inline formset."""
-        instances = formset.save(commit=False)
-        # Need to perform stock validation here before saving items if done via admin
-        try:
-            for instance in instances:
-                # Validate stock before saving each item if it's new
-                 if not instance.pk and instance.product.quantity < instance.quantity:
-                     # Raise validation error to prevent saving
-                     # This basic check might not cover updates correctly in admin inlines
-                     # A more robust solution might involve signals or custom formset validation
-                     raise ValidationError(f"Insufficient stock for {instance.product.name}. Available: {instance.product.quantity}")
-                 instance.save()
-            formset.save_m2m()
-            # Recalculate totals after all items are saved
-            if form.instance.pk:
-                 form.instance.calculate_totals()
-                 form.instance.save() # Save the main object again
-        except ValidationError as e:
-            # Propagate the error to the admin interface
-             self.message_user(request, str(e), level='ERROR')
-             # Need to prevent saving if validation fails. How to cleanly do this in save_formset?
-             # This might require overriding the formset's clean method.
+        """
+        Post a new invoice's items in one batch; edits post only the net change per product.
+        Stock was checked by the formset; a shortfall from a concurrent sale raises
+        InsufficientStock, which rolls back the whole admin save.
+        """
+        if change:
+            repost_items(form.instance, formset, user=request.user)
+        else:
+            post_invoice_items(form.instance, formset.save(commit=False))
 
     def save_model(self, request, obj, form, change):
         """Assign the current user when creating an invoice."""
@@ -122,4 +147,23 @@ class InvoiceAdmin(admin.ModelAdmin):
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
         # Initial total calculation
-        obj.calculate_totals()
\ No newline at end of file
+        obj.calculate_totals()
+
+
+@admin.register(DailySummary)
+class DailySummaryAdmin(admin.ModelAdmin):
+    list_display = ('date', 'sales_total', 'invoice_count', 'purchase_total', 'receipt_count', 'updated_at')
+    date_hierarchy = 'date'
+    # Maintained from invoices and receipts; rebuild with `manage.py rebuild_daily_summary`
+    readonly_fields = [f.name for f in DailySummary._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StockTake)
+class StockTakeAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'created_by', 'created_at', 'committed_at')
+    list_filter = ('status',)
+    # Counts are recorded and committed from the Stock-takes pages (see stocktake.py)
+    readonly_fields = ('status', 'created_by', 'committed_at')
@@ -0,0 +1,396 @@
+# inventory/api.py
+"""
+JSON API for the storefront and POS. The read endpoints cover products, stock levels,
+categories and suppliers. Rows are serialized from values() dicts, never model
+instances. Lists are keyset-paginated on (updated_at, id). Every response carries an ETag
+and Last-Modified derived from updated_at, so a poll that finds nothing new is answered
+304 after one aggregate query. The POS checkout posts a whole cart in one transaction.
+"""
+
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .models import Product, Category, Supplier
+from .pagination import encode_cursor, decode_cursor, keyset_condition
+from .services import checkout, InsufficientStock
+from . import search
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_SKUS = 10000 # Per availability request
+MAX_CART_LINES = 500
+AUTOCOMPLETE_PAGE_SIZE = 20
+AUTOCOMPLETE_ORDERING = ('name', 'id')
+SKU_CHUNK_SIZE = 500 # SKUs per sku__in query, well under SQLite's bound-parameter limit
+ORDERING = ('updated_at', 'id') # Oldest change first, so a poller can follow the feed
+
+# name -> model, {output field: lookup}, default fields, {filter parameter: lookup}
+RESOURCES = {
+    'products': {
+        'model': Product,
+        'fields': {
+            'id': 'id', 'sku': 'sku', 'name': 'name', 'description': 'description',
+            'category': 'category_id', 'category_name': 'category__name',
+            'supplier': 'supplier_id', 'supplier_name': 'supplier__name',
+            'quantity': 'quantity', 'unit_price': 'unit_price', 'selling_price': 'selling_price',
+            'reorder_level': 'reorder_level', 'is_low_stock': 'is_low_stock',
+            'created_at': 'created_at', 'updated_at': 'updated_at',
+        },
+        'default': ['id', 'sku', 'name', 'category', 'supplier', 'quantity', 'selling_price', 'is_low_stock', 'updated_at'],
+        'filters': {'category': 'category_id', 'supplier': 'supplier_id', 'sku': 'sku', 'low_stock': 'is_low_stock'},
+    },
+    'stock': {
+        'model': Product,
+        'fields': {
+            'id': 'id', 'sku': 'sku', 'quantity': 'quantity', 'reorder_level': 'reorder_level',
+            'is_low_stock': 'is_low_stock', 'updated_at': 'updated_at',
+        },
+        'default': ['id', 'sku', 'quantity', 'is_low_stock', 'updated_at'],
+        'filters': {'category': 'category_id', 'supplier': 'supplier_id', 'low_stock': 'is_low_stock'},
+    },
+    'categories': {
+        'model': Category,
+        'fields': {'id': 'id', 'name': 'name', 'description': 'description', 'updated_at': 'updated_at'},
+        'default': ['id', 'name', 'description', 'updated_at'],
+        'filters': {},
+    },
+    'suppliers': {
+        'model': Supplier,
+        'fields': {
+            'id': 'id', 'name': 'name', 'contact_person': 'contact_person', 'email': 'email',
+            'phone': 'phone', 'address': 'address', 'updated_at': 'updated_at',
+        },
+        'default': ['id', 'name', 'contact_person', 'email', 'phone', 'updated_at'],
+        'filters': {},
+    },
+}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': "Authentication required."}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
+def api_staff_required(view):
+    """api_login_required for staff-only actions; other users get 403 JSON."""
+    @wraps(view)
+    @api_login_required
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_staff:
+            return JsonResponse({'detail': "You do not have permission to do this."}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
+def _fields(request, resource):
+    """Output fields from ?fields=a,b (default: the resource's default set)."""
+    requested = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    unknown = [name for name in requested if name not in resource['fields']]
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(resource['fields'])}.")
+    return requested or resource['default']
+
+
+def _filtered(request, resource):
+    """The resource's queryset narrowed by the filter parameters (without the page cursor)."""
+    queryset = resource['model'].objects.all()
+    for param, lookup in resource['filters'].items():
+        value = request.GET.get(param)
+        if value in (None, ''):
+            continue
+        if lookup == 'is_low_stock':
+            value = value.lower() in ('1', 'true', 'yes')
+        elif lookup.endswith('_id') and not value.isdigit():
+            raise BadRequest(f"{param} must be an id.")
+        queryset = queryset.filter(**{lookup: value})
+    since = request.GET.get('updated_since')
+    if since:
+        moment = parse_datetime(since)
+        if moment is None:
+            raise BadRequest("updated_since must be an ISO 8601 date and time.")
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        queryset = queryset.filter(updated_at__gt=moment)
+    return queryset
+
+
+def _rows(queryset, resource, fields):
+    """values() rows for the output fields, plus the pagination keys."""
+    lookups = [resource['fields'][name] for name in fields]
+    return queryset.values(*dict.fromkeys(lookups + list(ORDERING)))
+
+
+def _output(row, resource, fields):
+    return {name: row[resource['fields'][name]] for name in fields}
+
+
+def _list_version(request, name):
+    """
+    {'etag', 'last_modified'} for a filtered list: its newest updated_at and its row count
+    (so deletions change it too), read once per request. None for an invalid request.
+    """
+    cache = request.__dict__.setdefault('_api_versions', {})
+    if name not in cache:
+        resource = RESOURCES[name]
+        try:
+            version = _filtered(request, resource).aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+            fields = _fields(request, resource)
+        except BadRequest:
+            cache[name] = None
+        else:
+            query = '&'.join(f"{key}={value}" for key, value in sorted(request.GET.items()))
+            digest = hashlib.sha1(f"{name}|{query}|{fields}|{version['last_modified']}|{version['count']}".encode())
+            cache[name] = {'etag': digest.hexdigest(), 'last_modified': version['last_modified']}
+    return cache[name]
+
+
+def _page_size(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be a number.")
+
+
+def _respond(data):
+    response = JsonResponse(data, encoder=DjangoJSONEncoder)
+    # Pollers keep the response but must revalidate it (cheap 304) every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@require_GET
+@api_login_required
+@condition(
+    etag_func=lambda request, name: (_list_version(request, name) or {}).get('etag'),
+    last_modified_func=lambda request, name: (_list_version(request, name) or {}).get('last_modified'),
+)
+def resource_list(request, name):
+    """
+    GET /api/<name>/?fields=&category=&supplier=&low_stock=&updated_since=&limit=&cursor=
+    Returns {"results": [...], "next": url or null}, oldest change first.
+    """
+    resource = RESOURCES[name]
+    try:
+        fields = _fields(request, resource)
+        queryset = _filtered(request, resource)
+        limit = _page_size(request)
+    except BadRequest as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+
+    salt = f"api:{name}"
+    token = request.GET.get('cursor')
+    if token:
+        cursor = decode_cursor(resource['model'], ORDERING, token, salt)
+        if cursor is None:
+            return JsonResponse({'detail': "Invalid or expired cursor."}, status=400)
+        queryset = queryset.filter(keyset_condition(ORDERING, cursor[0]))
+    rows = list(_rows(queryset.order_by(*ORDERING), resource, fields)[:limit + 1])
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor([rows[-1][key] for key in ORDERING], 'n', salt)
+        next_url = f"{request.path}?{params.urlencode()}"
+    results = [_output(row, resource, fields) for row in rows]
+    return _respond({'results': results, 'next': next_url})
+
+
+def _product_version(request, pk):
+    cache = request.__dict__.setdefault('_api_versions', {})
+    if ('product', pk) not in cache:
+        updated_at = Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        cache[('product', pk)] = updated_at
+    return cache[('product', pk)]
+
+
+@require_GET
+@api_login_required
+@condition(
+    etag_func=lambda request, pk: (
+        hashlib.sha1(f"{pk}|{request.GET.get('fields', '')}|{_product_version(request, pk)}".encode()).hexdigest()
+        if _product_version(request, pk) else None
+    ),
+    last_modified_func=lambda request, pk: _product_version(request, pk),
+)
+def product_detail(request, pk):
+    """GET /api/products/<pk>/?fields=..."""
+    resource = RESOURCES['products']
+    try:
+        fields = _fields(request, resource)
+    except BadRequest as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    row = _rows(Product.objects.filter(pk=pk), resource, fields).first()
+    if row is None:
+        return JsonResponse({'detail': "Not found."}, status=404)
+    return _respond(_output(row, resource, fields))
+
+
+@require_GET
+@api_login_required
+def product_autocomplete(request):
+    """
+    GET /api/products/autocomplete/?q=&cursor= for the product pickers. Returns products
+    matching q (prefix search on name, SKU, ...) in name order, 20 at a time, as
+    {"results": [{"id", "text", "sku", "quantity"}], "pagination": {"more", "next"}}.
+    """
+    queryset = Product.objects.all()
+    query = request.GET.get('q', '').strip()
+    if query:
+        queryset = search.search_products(queryset, query)
+    salt = 'api:autocomplete'
+    token = request.GET.get('cursor')
+    if token:
+        cursor = decode_cursor(Product, AUTOCOMPLETE_ORDERING, token, salt)
+        if cursor is None:
+            return JsonResponse({'detail': "Invalid or expired cursor."}, status=400)
+        queryset = queryset.filter(keyset_condition(AUTOCOMPLETE_ORDERING, cursor[0]))
+    rows = list(queryset.order_by(*AUTOCOMPLETE_ORDERING).values('id', 'name', 'sku', 'quantity')[:AUTOCOMPLETE_PAGE_SIZE + 1])
+
+    next_url = None
+    if len(rows) > AUTOCOMPLETE_PAGE_SIZE:
+        rows = rows[:AUTOCOMPLETE_PAGE_SIZE]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor([rows[-1][key] for key in AUTOCOMPLETE_ORDERING], 'n', salt)
+        next_url = f"{request.path}?{params.urlencode()}"
+    return _respond({
+        'results': [{
+            'id': row['id'], 'text': f"{row['name']} ({row['sku'] or 'No SKU'})", # As Product.__str__
+            'sku': row['sku'], 'quantity': row['quantity'],
+        } for row in rows],
+        'pagination': {'more': next_url is not None, 'next': next_url},
+    })
+
+
+def _availability_chunks(skus):
+    """
+    JSON text of {"results": [...], "missing": [...]} in pieces, one per chunk of SKUs, so
+    the response starts before the last chunk is read and never holds every row at once.
+    """
+    encoder = DjangoJSONEncoder()
+    missing = []
+    yield '{"results": ['
+    first = True
+    for start in range(0, len(skus), SKU_CHUNK_SIZE):
+        chunk = skus[start:start + SKU_CHUNK_SIZE]
+        # One query per chunk, answered from the unique index on sku
+        found = {row['sku']: row for row in Product.objects.filter(sku__in=chunk).values(
+            'sku', 'quantity', 'is_low_stock', 'selling_price')}
+        rows = []
+        for sku in chunk:
+            if sku in found:
+                rows.append(encoder.encode(found[sku]))
+            else:
+                missing.append(sku)
+        if rows:
+            yield (', ' if not first else '') + ', '.join(rows)
+            first = False
+    yield '], "missing": ' + encoder.encode(missing) + '}'
+
+
+@csrf_exempt # Reads only; POST is for the size of the SKU list, not a change of state
+@require_POST
+@api_login_required
+def stock_availability(request):
+    """
+    POST /api/stock/availability/ with {"skus": ["A-1", ...]} (up to MAX_SKUS). Streams
+    {"results": [{"sku", "quantity", "is_low_stock", "selling_price"}, ...], "missing": [...]}
+    in the order the SKUs were sent. Unknown SKUs are listed under "missing".
+    """
+    try:
+        skus = json.loads(request.body)['skus']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'detail': 'Send a JSON object like {"skus": ["A-1", "B-2"]}.'}, status=400)
+    if not isinstance(skus, list) or not all(isinstance(sku, str) for sku in skus):
+        return JsonResponse({'detail': "skus must be a list of strings."}, status=400)
+    skus = list(dict.fromkeys(sku.strip() for sku in skus)) # Each SKU once, in request order
+    if len(skus) > MAX_SKUS:
+        return JsonResponse({'detail': f"At most {MAX_SKUS} SKUs per request; send {len(skus)} in several."}, status=400)
+
+    response = StreamingHttpResponse(_availability_chunks(skus), content_type='application/json')
+    patch_cache_control(response, private=True, no_store=True) # Live stock; never reuse it
+    return response
+
+
+def _cart(data):
+    """[(sku, quantity)] from {"items": [{"sku": "A-1", "quantity": 2}, ...]}."""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BadRequest('Send {"items": [{"sku": "A-1", "quantity": 1}, ...]}.')
+    if len(items) > MAX_CART_LINES:
+        raise BadRequest(f"At most {MAX_CART_LINES} lines per cart.")
+    cart = []
+    for number, item in enumerate(items, 1):
+        sku = item.get('sku') if isinstance(item, dict) else None
+        quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+        if not isinstance(sku, str) or not sku.strip():
+            raise BadRequest(f"Line {number}: sku is required.")
+        if type(quantity) is not int or quantity < 1:
+            raise BadRequest(f"Line {number}: quantity must be a whole number of at least 1.")
+        cart.append((sku.strip(), quantity))
+    return cart
+
+
+@require_POST
+@api_staff_required
+def pos_checkout(request):
+    """
+    POST /api/pos/checkout/ with {"items": [{"sku", "quantity"}], "customer_name",
+    "tax_rate", "discount_rate"} (all but items optional). Creates and posts the invoice
+    in one transaction and answers 201 with its totals. A short product answers 409 with
+    the shortfalls, and nothing is saved.
+    """
+    try:
+        data = json.loads(request.body)
+        cart = _cart(data)
+        rates = {name: Decimal(str(data.get(name) or 0)) for name in ('tax_rate', 'discount_rate')}
+        if any(not 0 <= rate <= 100 for rate in rates.values()):
+            raise BadRequest("tax_rate and discount_rate are percentages between 0 and 100.")
+    except BadRequest as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    except ValueError:
+        return JsonResponse({'detail': "Send a JSON object."}, status=400)
+    except InvalidOperation:
+        return JsonResponse({'detail': "tax_rate and discount_rate must be numbers."}, status=400)
+
+    try:
+        invoice, lines = checkout(cart, user=request.user, customer_name=data.get('customer_name') or None, **rates)
+    except InsufficientStock as e:
+        return JsonResponse({'detail': "Not enough stock.", 'shortfalls': e.shortfalls}, status=409)
+    except ValidationError as e:
+        return JsonResponse({'detail': ' '.join(e.messages)}, status=400)
+
+    return JsonResponse({
+        'invoice': invoice.pk,
+        'invoice_number': invoice.invoice_number,
+        'url': invoice.get_absolute_url(),
+        'lines': [{
+            'sku': line.product.sku, 'quantity': line.quantity, 'unit_price': line.unit_price,
+            'line_total': line.quantity * line.unit_price,
+        } for line in lines],
+        'sub_total': invoice.sub_total,
+        'discount_amount': invoice.discount_amount,
+        'tax_amount': invoice.tax_amount,
+        'total_amount': invoice.total_amount,
+    }, encoder=DjangoJSONEncoder, status=201)
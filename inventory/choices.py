@@ -0,0 +1,32 @@
+# inventory/choices.py
+"""
+Cached (id, name) choice lists for the category and supplier pickers. Filter forms read them
+from the cache instead of querying the table on every render. Saves and deletes drop the
+cached list (see signals.py), and so do imports, which bypass signals.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+
+KEY_PREFIX = 'inventory:choices:'
+
+
+def _key(model):
+    return f"{KEY_PREFIX}{model._meta.label_lower}"
+
+
+def name_choices(model):
+    """[(pk, name)] for every row of `model`, ordered by name."""
+    key = _key(model)
+    values = cache.get(key)
+    if values is None:
+        values = list(model.objects.order_by('name').values_list('pk', 'name'))
+        # Upper bound on staleness when another process (with its own cache) made the change
+        cache.set(key, values, timeout=getattr(settings, 'CHOICES_CACHE_TTL', 300))
+    return values
+
+
+def invalidate(*models):
+    """Drops the cached lists once the current transaction commits."""
+    db_transaction.on_commit(lambda: cache.delete_many([_key(model) for model in models]))
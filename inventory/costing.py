@@ -0,0 +1,258 @@
+# inventory/costing.py
+
+import re
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+from django.utils import timezone
+
+from .models import Product, CostLayer, Transaction, ReceiptItem
+
+# Which valuation is stored as the realized cost on sale lines (InvoiceItem.cogs):
+# 'fifo' (cost layers) or 'average' (moving weighted average). Both are always maintained.
+COST_METHOD = getattr(settings, 'INVENTORY_COST_METHOD', 'fifo')
+
+# Open layers fetched per query while consuming; a sale only reads the layers it touches.
+LAYER_FETCH_SIZE = 20
+BATCH_SIZE = 500
+CENT = Decimal('0.01')
+UNIT_COST = Decimal('0.0001')
+# Ledger rows written by receipts and invoices reference their document in the notes; document
+# numbers are free text (spaces included), so the number is the rest of the note
+DOCUMENT_NOTE = re.compile(r"via (Receipt|Invoice) (.+)$")
+
+
+class Movement:
+    """Units of one product leaving stock without a sale line (shrinkage, edits), shaped like a line for costing."""
+    __slots__ = ('product_id', 'quantity')
+
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+
+
+def add_layers(receipt_items, received_at=None):
+    """Creates one cost layer per saved ReceiptItem, costed at the receipt's unit price."""
+    received_at = received_at or timezone.now()
+    return CostLayer.objects.bulk_create([
+        CostLayer(
+            product_id=item.product_id,
+            receipt_item=item,
+            received_at=received_at,
+            unit_cost=item.unit_price,
+            quantity_received=item.quantity,
+            quantity_remaining=item.quantity,
+        ) for item in receipt_items if item.quantity
+    ], batch_size=BATCH_SIZE)
+
+
+def add_layer(product_id, quantity, unit_cost, received_at=None):
+    """Creates a single cost layer not tied to a receipt (e.g. returned or counted stock)."""
+    if quantity <= 0:
+        return None
+    return CostLayer.objects.create(
+        product_id=product_id, received_at=received_at or timezone.now(), unit_cost=unit_cost,
+        quantity_received=quantity, quantity_remaining=quantity,
+    )
+
+
+def _open_layers(product_id):
+    """Yields a product's open layers oldest first, locking them, a few rows per query."""
+    queryset = CostLayer.objects.select_for_update().filter(
+        product_id=product_id, quantity_remaining__gt=0
+    ).order_by('received_at', 'id')
+    page = queryset
+    while True:
+        layers = list(page[:LAYER_FETCH_SIZE])
+        yield from layers
+        if len(layers) < LAYER_FETCH_SIZE:
+            return
+        # Keyset on (received_at, id) after the last layer: layers emptied by the caller in the
+        # meantime cannot shift the next page, and no rows are skipped over by an OFFSET
+        last = layers[-1]
+        page = queryset.filter(Q(received_at__gt=last.received_at) | Q(received_at=last.received_at, id__gt=last.id))
+
+
+def consume_layers(invoice_items):
+    """
+    Consumes cost layers FIFO for saved InvoiceItems and returns each line's realized cost,
+    in the order of `invoice_items`. Work is proportional to the number of layers touched.
+    Units not covered by any layer (stock that predates cost tracking) are costed at the
+    product's current unit_price.
+    """
+    lines_by_product = defaultdict(list)
+    for item in invoice_items:
+        lines_by_product[item.product_id].append(item)
+
+    touched_layers = []
+    fallback_cost = {}
+    costs = {}
+    for product_id in sorted(lines_by_product): # Same lock order as stock decrements
+        layers = _open_layers(product_id)
+        layer = None
+        for item in lines_by_product[product_id]:
+            needed, cost = item.quantity, 0
+            while needed:
+                if layer is None or layer.quantity_remaining == 0:
+                    layer = next(layers, None)
+                    if layer is None:
+                        break
+                    touched_layers.append(layer)
+                taken = min(needed, layer.quantity_remaining)
+                layer.quantity_remaining -= taken
+                cost += taken * layer.unit_cost
+                needed -= taken
+            if needed:
+                if product_id not in fallback_cost:
+                    fallback_cost[product_id] = Product.objects.values_list('unit_price', flat=True).get(pk=product_id)
+                cost += needed * fallback_cost[product_id]
+            costs[item] = cost
+
+    CostLayer.objects.bulk_update(touched_layers, ['quantity_remaining'], batch_size=BATCH_SIZE)
+    return [costs[item] for item in invoice_items]
+
+
+def _locked_products(product_ids):
+    """Loads the valuation fields of products in primary-key order, locking their rows."""
+    return Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').only(
+        'quantity', 'unit_price', 'average_cost', 'stock_value'
+    )
+
+
+def receive_at_average(receipt_items):
+    """
+    Adds received value to Product.stock_value and re-derives the moving average cost:
+    average_cost = stock_value / quantity. O(1) per product; stock quantities must already
+    include the received units.
+    """
+    received = defaultdict(Decimal)
+    for item in receipt_items:
+        received[item.product_id] += item.quantity * item.unit_price
+    revalue_at_average(received)
+
+
+def revalue_at_average(value_changes):
+    """
+    Adds {product_id: value change} to Product.stock_value (never below 0) and re-derives the
+    moving average cost from it, as receipts do. Stock quantities must already include the
+    change; a product left without stock keeps its average and no value.
+    """
+    products = list(_locked_products(value_changes))
+    for product in products:
+        if product.quantity:
+            product.stock_value = max(product.stock_value + value_changes[product.pk], Decimal('0'))
+            product.average_cost = (product.stock_value / product.quantity).quantize(UNIT_COST)
+        else:
+            product.stock_value = Decimal('0')
+    Product.objects.bulk_update(products, ['stock_value', 'average_cost'], batch_size=BATCH_SIZE)
+
+
+def issue_at_average(invoice_items):
+    """
+    Removes sold units from Product.stock_value at the current average cost (which does not
+    change) and returns each line's cost at sale, in the order of `invoice_items`. O(1) per
+    line; stock quantities must already exclude the sold units.
+    """
+    products = {product.pk: product for product in _locked_products({item.product_id for item in invoice_items})}
+    costs = []
+    for item in invoice_items:
+        product = products[item.product_id]
+        cost = (item.quantity * (product.average_cost or product.unit_price)).quantize(CENT)
+        product.stock_value = max(product.stock_value - cost, Decimal('0'))
+        costs.append(cost)
+    for product in products.values():
+        if product.quantity == 0:
+            product.stock_value = Decimal('0') # Drop rounding residue once the shelf is empty
+    Product.objects.bulk_update(products.values(), ['stock_value'], batch_size=BATCH_SIZE)
+    return costs
+
+
+class AverageReplay:
+    """
+    Recomputes each product's moving average cost and stock value from the Transaction ledger,
+    fed (product_id, transaction_type, quantity, notes, receipt_id) rows in posting order, a
+    chunk at a time. `state` holds [stock, value, average] per product.
+    """
+
+    def __init__(self):
+        # Stock entered with the product (not in the ledger) is the opening balance, valued at unit_price
+        net = dict(Transaction.objects.order_by().values('product_id').annotate(net=Sum(Case(
+            When(transaction_type='OUT', then=-F('quantity')), default=F('quantity'), output_field=IntegerField(),
+        ))).values_list('product_id', 'net'))
+        self.opening, self.state, self.unit_prices = {}, {}, {}
+        for pk, quantity, unit_price in Product.objects.values_list('pk', 'quantity', 'unit_price').iterator():
+            opening = max(quantity - net.get(pk, 0), 0)
+            self.opening[pk] = opening
+            self.state[pk] = [opening, opening * unit_price, unit_price if opening else Decimal('0')]
+            self.unit_prices[pk] = unit_price
+        self.lines_used = defaultdict(int) # (receipt number, product_id) -> receipt lines already matched
+
+    def unit_cost(self, product_id):
+        """The unit cost stock is valued at right now, as Product.current_unit_cost()."""
+        return self.state[product_id][2] or self.unit_prices[product_id]
+
+    def replay(self, rows):
+        """
+        Applies one chunk of ledger rows with the same rules as posting: receipts add their
+        line value and re-derive the average, edits and voids of receipts move the value at
+        the receipt's price for the product, every other movement is valued at the average.
+        Returns the unit cost each row's product was valued at just before the row.
+        """
+        if not rows:
+            return []
+        receipt_numbers = set()
+        for _, transaction_type, _, notes, _ in rows:
+            match = DOCUMENT_NOTE.search(notes or '')
+            if transaction_type == 'IN' and match and match.group(1) == 'Receipt':
+                receipt_numbers.add(match.group(2))
+        receipt_prices = defaultdict(deque)
+        for number, product_id, unit_price in ReceiptItem.objects.filter(
+            receipt__receipt_number__in=receipt_numbers
+        ).order_by('id').values_list('receipt__receipt_number', 'product_id', 'unit_price'):
+            receipt_prices[(number, product_id)].append(unit_price)
+        for key, prices in receipt_prices.items():
+            for _ in range(min(self.lines_used[key], len(prices))):
+                prices.popleft() # Matched in an earlier chunk
+        # (receipt id, product_id) -> receipt's price for the product, for its edit and void rows
+        document_prices = {
+            (receipt_id, product_id): value / quantity
+            for receipt_id, product_id, quantity, value in ReceiptItem.objects.filter(
+                receipt_id__in={row[4] for row in rows if row[4] and not DOCUMENT_NOTE.search(row[3] or '')},
+            ).order_by().values('receipt_id', 'product_id').annotate(
+                total_quantity=Sum('quantity'), total_value=Sum(F('quantity') * F('unit_price')),
+            ).values_list('receipt_id', 'product_id', 'total_quantity', 'total_value')
+            if quantity
+        }
+
+        unit_costs = []
+        for product_id, transaction_type, quantity, notes, receipt_id in rows:
+            state = self.state.get(product_id)
+            if state is None:
+                unit_costs.append(None)
+                continue
+            stock, value, average = state
+            unit_cost = self.unit_cost(product_id)
+            unit_costs.append(unit_cost)
+            match = DOCUMENT_NOTE.search(notes or '')
+            key = (match.group(2), product_id) if match else None
+            if transaction_type == 'IN' and key and receipt_prices[key]:
+                self.lines_used[key] += 1
+                stock += quantity
+                value += quantity * receipt_prices[key].popleft()
+                average = (value / stock).quantize(UNIT_COST) if stock else average
+            elif (receipt_id, product_id) in document_prices and not match:
+                stock = max(stock + (quantity if transaction_type == 'IN' else -quantity), 0)
+                value += (quantity if transaction_type == 'IN' else -quantity) * document_prices[(receipt_id, product_id)]
+                value = max(value, Decimal('0')) if stock else Decimal('0')
+                average = (value / stock).quantize(UNIT_COST) if stock else average
+            elif transaction_type == 'OUT':
+                stock = max(stock - quantity, 0)
+                value = max(value - (quantity * unit_cost).quantize(CENT), Decimal('0')) if stock else Decimal('0')
+            else:
+                stock += quantity
+                value += quantity * unit_cost
+                average = unit_cost
+            self.state[product_id] = [stock, value, average]
+        return unit_costs
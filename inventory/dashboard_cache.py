@@ -0,0 +1,112 @@
+# inventory/dashboard_cache.py
+"""
+Cached dashboard figures. Each section is computed once and served from the cache until a
+write that affects it marks it stale (see signals.py and services.py). A stale section is
+recomputed by a single request while concurrent requests keep serving the previous value
+for up to DASHBOARD_CACHE_STALE seconds, so a burst of writes does not turn every
+dashboard load into a recompute.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Product, Supplier, Category, Transaction, DailySummary
+
+KEY_PREFIX = 'inventory:dashboard:'
+
+
+def _counts():
+    return {
+        'total_products': Product.objects.count(),
+        'total_suppliers': Supplier.objects.count(),
+        'total_categories': Category.objects.count(),
+    }
+
+
+def _stock():
+    totals = Product.objects.aggregate(inventory_value=Sum('stock_value'))
+    return {
+        # Counted from the partial low-stock index
+        'low_stock_products': Product.objects.filter(is_low_stock=True).count(),
+        'inventory_value': totals['inventory_value'] or 0,
+    }
+
+
+def _recent_transactions():
+    # Get the 10 most recent transactions
+    return {'recent_transactions': list(Transaction.objects.select_related('product', 'user').order_by('-timestamp')[:10])}
+
+
+def _todays_sales():
+    # Today's sales come from the maintained daily rollup (one row) instead of an aggregate
+    summary = DailySummary.for_date(timezone.now().date())
+    return {'todays_total_sales': summary.sales_total, 'todays_invoice_count': summary.invoice_count}
+
+
+SECTIONS = {
+    'counts': _counts,
+    'stock': _stock,
+    'recent_transactions': _recent_transactions,
+    'todays_sales': _todays_sales,
+}
+
+
+def _key(name):
+    if name == 'todays_sales':
+        return f"{KEY_PREFIX}{name}:{timezone.now().date().isoformat()}" # Rolls over at midnight
+    return f"{KEY_PREFIX}{name}"
+
+
+def _fresh_seconds():
+    # Upper bound on staleness when another process (with its own cache) made the change
+    return getattr(settings, 'DASHBOARD_CACHE_TTL', 60)
+
+
+def _stale_seconds():
+    return getattr(settings, 'DASHBOARD_CACHE_STALE', 10)
+
+
+def get_section(name):
+    """Returns a section's values, recomputing them if missing or stale (stale-while-revalidate)."""
+    key = _key(name)
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        if entry['fresh_until'] > now:
+            return entry['values']
+        if not cache.add(f"{key}:refreshing", 1, timeout=_stale_seconds()):
+            return entry['values'] # Another request is already recomputing this section
+    values = SECTIONS[name]()
+    cache.set(key, {'values': values, 'fresh_until': now + _fresh_seconds()},
+              timeout=_fresh_seconds() + _stale_seconds())
+    cache.delete(f"{key}:refreshing")
+    return values
+
+
+def dashboard_values():
+    values = {}
+    for name in SECTIONS:
+        values.update(get_section(name))
+    return values
+
+
+def _mark_stale(names):
+    for name in names:
+        key = _key(name)
+        entry = cache.get(key)
+        if entry is not None:
+            entry['fresh_until'] = 0
+            cache.set(key, entry, timeout=_stale_seconds())
+
+
+def invalidate(*names):
+    """
+    Marks dashboard sections stale once the current transaction commits, so a concurrent
+    dashboard load cannot cache pre-commit values as fresh.
+    """
+    db_transaction.on_commit(lambda: _mark_stale(names))
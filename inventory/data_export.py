@@ -0,0 +1,156 @@
+# inventory/data_export.py
+"""
+Streaming CSV / NDJSON export of the transaction ledger and of invoices, receipts and their
+lines. Rows are read as tuples with values_list().iterator(), formatted and (optionally)
+compressed chunk by chunk, so memory stays constant however many rows are exported.
+"""
+
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Transaction, Invoice, InvoiceItem, Receipt, ReceiptItem
+from .utils import day_range
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# dataset -> (model, date lookup, is the date a datetime, product lookup or None, [(column, lookup)])
+DATASETS = {
+    'transactions': (Transaction, 'timestamp', True, 'product_id', [
+        ('id', 'id'), ('timestamp', 'timestamp'), ('type', 'transaction_type'), ('sku', 'product__sku'),
+        ('product', 'product__name'), ('quantity', 'quantity'), ('user', 'user__username'),
+        ('receipt_number', 'receipt__receipt_number'), ('invoice_number', 'invoice__invoice_number'), ('notes', 'notes'),
+    ]),
+    'invoices': (Invoice, 'sale_date', False, None, [
+        ('id', 'id'), ('invoice_number', 'invoice_number'), ('customer_name', 'customer_name'),
+        ('sale_date', 'sale_date'), ('due_date', 'due_date'), ('sub_total', 'sub_total'), ('tax_rate', 'tax_rate'),
+        ('tax_amount', 'tax_amount'), ('discount_rate', 'discount_rate'), ('discount_amount', 'discount_amount'),
+        ('total_amount', 'total_amount'), ('status', 'status'), ('created_by', 'created_by__username'),
+        ('created_at', 'created_at'),
+    ]),
+    'invoice_items': (InvoiceItem, 'invoice__sale_date', False, 'product_id', [
+        ('id', 'id'), ('invoice_number', 'invoice__invoice_number'), ('sale_date', 'invoice__sale_date'),
+        ('status', 'invoice__status'), ('sku', 'product__sku'), ('product', 'product__name'),
+        ('quantity', 'quantity'), ('unit_price', 'unit_price'), ('cogs', 'cogs'),
+    ]),
+    'receipts': (Receipt, 'purchase_date', False, None, [
+        ('id', 'id'), ('receipt_number', 'receipt_number'), ('supplier', 'supplier__name'),
+        ('purchase_date', 'purchase_date'), ('total_amount', 'total_amount'), ('status', 'status'),
+        ('created_by', 'created_by__username'), ('created_at', 'created_at'),
+    ]),
+    'receipt_items': (ReceiptItem, 'receipt__purchase_date', False, 'product_id', [
+        ('id', 'id'), ('receipt_number', 'receipt__receipt_number'), ('purchase_date', 'receipt__purchase_date'),
+        ('status', 'receipt__status'), ('supplier', 'receipt__supplier__name'), ('sku', 'product__sku'),
+        ('product', 'product__name'), ('quantity', 'quantity'), ('unit_price', 'unit_price'),
+    ]),
+}
+FORMATS = {'csv': ('text/csv', 'csv'), 'ndjson': ('application/x-ndjson', 'ndjson')}
+# Rows fetched from the database per round trip
+CHUNK_SIZE = 2000
+# Rows formatted into one output chunk
+ROWS_PER_CHUNK = 500
+
+
+def columns(dataset):
+    return [column for column, _ in DATASETS[dataset][4]]
+
+
+def rows(dataset, start_date=None, end_date=None, product_id=None):
+    """Yields the dataset's rows as tuples in date order, optionally limited to a date range or product."""
+    model, date_lookup, is_datetime, product_lookup, fields = DATASETS[dataset]
+    queryset = model.objects.all()
+    if is_datetime:
+        # Compare the raw timestamp column so the index is used (see utils.day_range)
+        if start_date:
+            queryset = queryset.filter(**{f'{date_lookup}__gte': day_range(start_date, start_date)[0]})
+        if end_date:
+            queryset = queryset.filter(**{f'{date_lookup}__lt': day_range(end_date, end_date)[1]})
+    else:
+        if start_date:
+            queryset = queryset.filter(**{f'{date_lookup}__gte': start_date})
+        if end_date:
+            queryset = queryset.filter(**{f'{date_lookup}__lte': end_date})
+    if product_id and product_lookup:
+        queryset = queryset.filter(**{product_lookup: product_id})
+    queryset = queryset.order_by(date_lookup, 'pk').values_list(*[lookup for _, lookup in fields])
+    return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+
+class _Echo:
+    """csv.writer target that hands each formatted line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= ROWS_PER_CHUNK:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def csv_chunks(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+
+def ndjson_chunks(header, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield from _batched(encoder.encode(dict(zip(header, row))) + '\n' for row in rows)
+
+
+def stream(dataset, file_format, **filters):
+    """Yields the formatted export (header included for CSV) as text chunks."""
+    header = columns(dataset)
+    formatter = csv_chunks if file_format == 'csv' else ndjson_chunks
+    return formatter(header, rows(dataset, **filters))
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks the best content coding from an Accept-Encoding header, or None for identity."""
+    offered = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.partition(';')
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            offered.add(name.strip().lower())
+    for encoding in available_encodings():
+        if encoding in offered:
+            return encoding
+    return None
+
+
+def encode(chunks, encoding=None):
+    """Encodes text chunks to UTF-8, compressed with gzip or brotli when `encoding` is given."""
+    if encoding is None:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5) # Near gzip -6 speed with a better ratio
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31: gzip container
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk.encode())
+        if data:
+            yield data
+    yield finish()
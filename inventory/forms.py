@@ -1,13 +1,19 @@
 from pyexpat.errors import messages
+from collections import defaultdict
+
 from django import forms
 from django.forms import inlineformset_factory
+from django.forms.models import BaseInlineFormSet, ModelChoiceIterator
 from django.http import HttpResponse
 from django.shortcuts import redirect
 from weasyprint import HTML
 from .models import Category, Supplier, Product, Receipt, ReceiptItem, Invoice, InvoiceItem
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.html import format_html
 import uuid # For generating unique numbers
+from . import choices
 
 class CategoryForm(forms.ModelForm):
     class Meta:
@@ -41,11 +47,181 @@ class ProductForm(forms.ModelForm):
             raise ValidationError("Selling price cannot be less than the unit (cost) price.")
         return selling_price
 
+# --- Pickers that do not list a whole table per form ---
+
+class _CachedNameIterator(ModelChoiceIterator):
+    """Yields (pk, name) from the cached list in choices.py instead of iterating the queryset."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        yield from choices.name_choices(self.queryset.model)
+
+    def __len__(self):
+        return len(choices.name_choices(self.queryset.model)) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(choices.name_choices(self.queryset.model))
+
+
+class CachedNameChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField for categories and suppliers whose options are rendered from the cache."""
+    iterator = _CachedNameIterator
+
+
+class ProductLookup:
+    """
+    The products a formset's lines refer to, loaded in one query the first time a line needs
+    one (to render its selected option or to validate it) and shared by every line.
+    """
+
+    def __init__(self, formset):
+        self.formset = formset
+        self._products = None
+
+    def get(self, pk):
+        if self._products is None:
+            pks = {str(form['product'].value()) for form in self.formset.forms}
+            self._products = Product.objects.in_bulk([int(pk) for pk in pks if pk.isdigit()])
+        return self._products.get(int(pk)) if str(pk).isdigit() else None
+
+
+class ProductAutocompleteSelect(forms.Select):
+    """
+    Product <select> that renders only the selected option, under a search box that fills it
+    from the autocomplete endpoint (script in base.html). The page no longer grows with the
+    catalog, and rendering needs no catalog query.
+    """
+    lookup = None # ProductLookup shared by a formset's lines
+    empty_label = '---------'
+
+    def __init__(self, attrs=None):
+        super().__init__({'class': 'product-autocomplete', **(attrs or {})})
+
+    def _selected(self, value):
+        pks = [pk for pk in value if str(pk).isdigit()]
+        if self.lookup is not None:
+            products = [self.lookup.get(pk) for pk in pks]
+        else:
+            products = Product.objects.filter(pk__in=pks)
+        return [(product.pk, str(product)) for product in products if product is not None]
+
+    def optgroups(self, name, value, attrs=None):
+        self.choices = [('', self.empty_label)] + self._selected(value)
+        return super().optgroups(name, value, attrs)
+
+    def render(self, name, value, attrs=None, renderer=None):
+        search = format_html(
+            '<input type="search" class="form-control form-control-sm mb-1 product-autocomplete-search" '
+            'placeholder="Search by name or SKU..." aria-label="Search products" data-url="{}">',
+            reverse('api-product-autocomplete'),
+        )
+        return search + super().render(name, value, attrs, renderer)
+
+
+class ProductChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField for products picked with ProductAutocompleteSelect."""
+    widget = ProductAutocompleteSelect
+
+    def __init__(self, queryset=None, **kwargs):
+        super().__init__(Product.objects.all() if queryset is None else queryset, **kwargs)
+        self.widget.empty_label = self.empty_label or ''
+        self.lookup = None
+
+    def use_lookup(self, lookup):
+        self.lookup = self.widget.lookup = lookup
+
+    def to_python(self, value):
+        if self.lookup is not None and value not in self.empty_values:
+            product = self.lookup.get(value)
+            if product is not None:
+                return product # Already loaded with the formset's other lines
+        return super().to_python(value)
+
+
+class ProductLineForm(forms.ModelForm):
+    """Base for document line forms whose product is a ProductChoiceField."""
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # The field already loaded the product, so skip the model's per-line "does it exist" query
+        exclude.add('product')
+        return exclude
+
+
+class ProductLineFormSet(BaseInlineFormSet):
+    """
+    Inline formset for document lines. Saved lines are read with their products (one query),
+    and all lines share one ProductLookup, so the query count does not grow with the lines.
+    """
+
+    def __init__(self, *args, queryset=None, **kwargs):
+        self.product_lookup = ProductLookup(self)
+        if queryset is None:
+            queryset = self.model._default_manager.select_related('product')
+        super().__init__(*args, queryset=queryset, **kwargs)
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        form.fields['product'].use_lookup(self.product_lookup)
+
+
+class StockCheckedLineFormSet(BaseInlineFormSet):
+    """
+    Document lines checked against stock for the whole document at once, before anything
+    is saved. Invoice lines take stock; receipt lines bring it in, so lowering or removing
+    them takes it back out.
+    """
+
+    def clean(self):
+        """
+        Sums the stock each product needs across all lines (new lines, changed quantities,
+        lines moved to another product, deleted lines) and checks the totals against the
+        products the lines loaded. Two lines for one product cannot jointly oversell, and
+        every short line is flagged in one pass.
+        """
+        super().clean()
+        sign = 1 if self.model is InvoiceItem else -1 # Stock a line's quantity takes
+        deltas, products, lines = defaultdict(int), {}, defaultdict(list)
+        for form in self.forms:
+            if not form.is_valid() or not form.has_changed():
+                continue
+            if form.instance.pk:
+                # Stock the saved line already took (the instance itself now holds the posted values)
+                deltas[form.initial['product']] -= sign * form.initial['quantity']
+            if self._should_delete_form(form):
+                continue
+            product = form.cleaned_data.get('product')
+            quantity = form.cleaned_data.get('quantity')
+            if product and quantity is not None:
+                deltas[product.pk] += sign * quantity
+                products[product.pk] = product
+                lines[product.pk].append(form)
+        if sign < 0:
+            # Lowered or removed receipt lines take stock back out of products no line loaded
+            products.update(Product.objects.only('name', 'quantity').in_bulk(set(deltas) - set(products)))
+        removed = []
+        for pk, needed in deltas.items():
+            if needed > 0 and needed > products[pk].quantity:
+                message = (f"Not enough stock for {products[pk].name}. "
+                           f"Available: {products[pk].quantity}, Requested in total: {needed}")
+                for form in lines[pk]:
+                    form.add_error('quantity', message)
+                if not lines[pk]: # Only removed lines: nothing left to flag
+                    removed.append(message)
+        if removed:
+            raise ValidationError(removed)
+
+
+class InvoiceLineFormSet(ProductLineFormSet, StockCheckedLineFormSet):
+    """Invoice lines sharing one product lookup, checked against stock for the whole invoice at once."""
+
+
 class ProductFilterForm(forms.Form):
     """Form for filtering products in the list view."""
-    name = forms.CharField(required=False, label="Product Name", widget=forms.TextInput(attrs={'placeholder': 'Search by name...'}))
-    category = forms.ModelChoiceField(queryset=Category.objects.all(), required=False, empty_label="All Categories")
-    supplier = forms.ModelChoiceField(queryset=Supplier.objects.all(), required=False, empty_label="All Suppliers")
+    name = forms.CharField(required=False, label="Search", widget=forms.TextInput(attrs={'placeholder': 'Name, SKU, description, category or supplier...'}))
+    category = CachedNameChoiceField(queryset=Category.objects.all(), required=False, empty_label="All Categories")
+    supplier = CachedNameChoiceField(queryset=Supplier.objects.all(), required=False, empty_label="All Suppliers")
     below_reorder = forms.BooleanField(required=False, label="Below Reorder Level")
 
 # --- Receipt Forms ---
@@ -66,14 +242,14 @@ class ReceiptForm(forms.ModelForm):
         if not self.instance.pk and not self.initial.get('receipt_number'):
              self.initial['receipt_number'] = f"REC-{uuid.uuid4().hex[:8].upper()}" # Example auto-numbering
 
-class ReceiptItemForm(forms.ModelForm):
+class ReceiptItemForm(ProductLineForm):
     class Meta:
         model = ReceiptItem
         fields = ['product', 'quantity', 'unit_price']
+        field_classes = {'product': ProductChoiceField} # Searched, not listed in full
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['product'].queryset = Product.objects.order_by('name') # Order product dropdown
         # Optionally set initial unit price from product cost price
         # This requires passing the product instance or handling in the view/template
         # if 'instance' in kwargs and kwargs['instance'] and kwargs['instance'].product:
@@ -85,6 +261,7 @@ ReceiptItemFormSet = inlineformset_factory(
     Receipt,                  # Parent model
     ReceiptItem,              # Inline model
     form=ReceiptItemForm,     # Form for inline model
+    formset=ProductLineFormSet, # Lines share one product lookup
     extra=1,                  # Number of empty forms
     can_delete=True,          # Allow deletion of items
     can_delete_extra=True     # Allow deletion of newly added (unsaved) extra forms
@@ -113,14 +290,14 @@ class InvoiceForm(forms.ModelForm):
 
 # inventory/forms.py
 
-class InvoiceItemForm(forms.ModelForm):
+class InvoiceItemForm(ProductLineForm):
     class Meta:
         model = InvoiceItem
         fields = ['product', 'quantity', 'unit_price']
+        field_classes = {'product': ProductChoiceField} # Searched, not listed in full
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['product'].queryset = Product.objects.order_by('name')
 
         # --- MODIFIED CHECK ---
         # Only try to access product details if the instance exists,
@@ -132,30 +309,12 @@ class InvoiceItemForm(forms.ModelForm):
                  self.initial['unit_price'] = self.instance.product.selling_price
         # --- END MODIFIED CHECK ---
 
-    def clean_quantity(self):
-        # ... (keep existing clean_quantity method) ...
-        quantity = self.cleaned_data.get('quantity')
-        product = self.cleaned_data.get('product')
-        instance = getattr(self, 'instance', None)
-
-        if product and quantity is not None:
-            current_stock = product.quantity
-            original_quantity = 0
-            if instance and instance.pk:
-                original_quantity = instance.quantity
-
-            quantity_change = quantity - original_quantity
-
-            if quantity_change > current_stock:
-                 raise ValidationError(f"Not enough stock for {product.name}. "
-                                     f"Available: {current_stock}. Requested Change: {quantity_change}")
-        return quantity
-
 # Inline Formset for Invoice Items
 InvoiceItemFormSet = inlineformset_factory(
     Invoice,                  # Parent model
     InvoiceItem,              # Inline model
     form=InvoiceItemForm,     # Form for inline model
+    formset=InvoiceLineFormSet, # Shared product lookup, stock checked per product across lines
     extra=1,                  # Number of empty forms
     can_delete=True,
     can_delete_extra=True
@@ -175,6 +334,59 @@ class DateRangeReportForm(forms.Form):
             raise ValidationError("End date cannot be earlier than start date.")
 
         return cleaned_data
+
+
+class PdfExportForm(DateRangeReportForm):
+    """Date range plus document type and output format for the bulk PDF export."""
+    document_type = forms.ChoiceField(choices=[('invoice', 'Invoices'), ('receipt', 'Receipts')], initial='invoice')
+    output_format = forms.ChoiceField(
+        choices=[('zip', 'ZIP archive (one PDF per document)'), ('pdf', 'Single combined PDF')],
+        initial='zip',
+    )
+
+
+class CatalogImportForm(forms.Form):
+    """CSV upload for the bulk catalog import."""
+    kind = forms.ChoiceField(label="Import", choices=[
+        ('products', 'Products (sku, name, unit_price, selling_price, ...)'),
+        ('suppliers', 'Suppliers (name, contact_person, email, phone, address)'),
+        ('categories', 'Categories (name, description)'),
+    ])
+    csv_file = forms.FileField(label="CSV file", help_text="First row must hold the column names.")
+    dry_run = forms.BooleanField(required=False, label="Check only (save nothing)")
+
+
+class StockCountScanForm(forms.Form):
+    """One scanned (or typed) SKU for a stock-take; each scan adds to the product's count."""
+    sku = forms.CharField(max_length=100, label="SKU", widget=forms.TextInput(attrs={'autofocus': True, 'placeholder': 'Scan or type a SKU'}))
+    quantity = forms.IntegerField(min_value=1, initial=1)
+
+
+class StockCountUploadForm(forms.Form):
+    """CSV of absolute counts (sku, counted_quantity) for a stock-take."""
+    csv_file = forms.FileField(label="Counts CSV", help_text="Columns: sku, counted_quantity. Replaces earlier counts of the same products.")
+
+
+class DataExportForm(forms.Form):
+    """Dataset, format and optional filters for the streaming CSV / NDJSON export."""
+    dataset = forms.ChoiceField(choices=[
+        ('transactions', 'Transaction ledger'), ('invoices', 'Invoices'), ('invoice_items', 'Invoice lines'),
+        ('receipts', 'Receipts'), ('receipt_items', 'Receipt lines'),
+    ])
+    file_format = forms.ChoiceField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON (one JSON object per line)')], initial='csv')
+    start_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}), required=False)
+    end_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}), required=False)
+    product = ProductChoiceField(required=False, help_text="Only for the ledger and line exports")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+
+        if start_date and end_date and end_date < start_date:
+            raise ValidationError("End date cannot be earlier than start date.")
+
+        return cleaned_data
     
 
     # inventory/forms.py
@@ -0,0 +1,233 @@
+# inventory/importer.py
+"""
+Bulk CSV import of categories, suppliers and products. Rows are validated one by one (a bad
+row is reported by line number and skipped, the rest still import) and written in batches
+with bulk_create(update_conflicts=True), keyed by name or SKU, so re-importing a file
+updates the existing rows (a blank cell leaves the stored value alone). Category and supplier names are resolved through in-memory maps,
+and the opening stock of new products is written with them and recorded as one batched
+adjustment in the ledger.
+"""
+
+import csv
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, Value, When, BooleanField
+from django.utils import timezone
+
+from .models import Category, Supplier, Product, Transaction, CostLayer
+from . import choices, dashboard_cache, search
+
+# Rows per INSERT ... ON CONFLICT statement
+BATCH_SIZE = 1000
+
+# kind -> (model, key column, required columns, optional columns)
+IMPORT_KINDS = {
+    'categories': (Category, 'name', ['name'], ['description']),
+    'suppliers': (Supplier, 'name', ['name'], ['contact_person', 'email', 'phone', 'address']),
+    'products': (Product, 'sku', ['sku', 'name', 'unit_price', 'selling_price'],
+                 ['description', 'category', 'supplier', 'reorder_level', 'opening_stock']),
+}
+
+
+class _DryRun(Exception):
+    pass
+
+
+def _clean(model, column, raw):
+    """Validates one cell with the model field's own rules; empty optional cells become the field default."""
+    field = model._meta.get_field(column)
+    if raw == '' and (field.null or field.has_default()):
+        return None if field.null else field.get_default()
+    return field.clean(raw, None)
+
+
+class _Importer:
+
+    def __init__(self, kind, user=None):
+        self.model, self.key, self.required, self.optional = IMPORT_KINDS[kind]
+        self.kind = kind
+        self.user = user
+        self.result = {'created': 0, 'updated': 0, 'opening_stock': 0, 'errors': []}
+        self.seen = set()
+        if kind == 'products':
+            # name -> id for every category and supplier, loaded once instead of per row
+            self.categories = dict(Category.objects.values_list('name', 'id'))
+            self.suppliers = dict(Supplier.objects.values_list('name', 'id'))
+
+    def run(self, lines):
+        reader = csv.DictReader(lines)
+        header = [name.strip() for name in reader.fieldnames or []]
+        reader.fieldnames = header
+        missing = [column for column in self.required if column not in header]
+        if missing:
+            raise ValidationError(f"Missing required column(s): {', '.join(missing)}.")
+        self.columns = [column for column in self.required + self.optional if column in header]
+
+        batch = []
+        for row in reader:
+            parsed = self.parse(reader.line_num, row)
+            if parsed is not None:
+                batch.append(parsed)
+            if len(batch) >= BATCH_SIZE:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+        self.result['errors'].sort() # Parse and write problems, in file order
+        return self.result
+
+    def error(self, line, message):
+        self.result['errors'].append((line, message))
+
+    def parse(self, line, row):
+        """
+        Returns (line, values) for a valid row, or None after recording its errors. Blank
+        optional cells are left out of `values`: a new row gets the field default, an existing
+        one keeps its stored value.
+        """
+        values, problems = {}, []
+        for column in self.columns:
+            raw = (row.get(column) or '').strip()
+            if column in self.required and not raw:
+                problems.append(f"{column}: This field is required.")
+                continue
+            if not raw:
+                continue
+            if column in ('category', 'supplier', 'opening_stock'):
+                values[column] = raw
+                continue
+            try:
+                values[column] = _clean(self.model, column, raw)
+            except ValidationError as e:
+                problems.append(f"{column}: {' '.join(e.messages)}")
+        if self.kind == 'products' and values.get('opening_stock'):
+            try:
+                values['opening_stock'] = int(values['opening_stock'])
+                if values['opening_stock'] < 0:
+                    raise ValueError
+            except ValueError:
+                problems.append("opening_stock: Enter a whole number of units, 0 or more.")
+        key = values.get(self.key)
+        if not problems and key in self.seen:
+            problems.append(f"Duplicate {self.key} {key!r}; only its first row is imported.")
+        if problems:
+            self.error(line, '; '.join(problems))
+            return None
+        self.seen.add(key)
+        return line, values
+
+    def _resolve(self, names, mapping, model):
+        """Adds ids for names not yet in `mapping`, creating the missing rows in one INSERT."""
+        missing = {name for name in names if name and name not in mapping}
+        if missing:
+            model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+            mapping.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def _field_values(self, values, columns):
+        """Model field values of a row for `columns`, with field defaults for its blank cells."""
+        return {column: values[column] if column in values else _clean(self.model, column, '') for column in columns}
+
+    def write(self, batch):
+        keys = [values[self.key] for _, values in batch]
+        existing = set(self.model.objects.filter(**{f'{self.key}__in': keys}).values_list(self.key, flat=True))
+
+        if self.kind != 'products':
+            objects = [self.model(**self._field_values(values, self.columns)) for _, values in batch]
+        else:
+            self._resolve({values.get('category') for _, values in batch}, self.categories, Category)
+            self._resolve({values.get('supplier') for _, values in batch}, self.suppliers, Supplier)
+            objects = []
+            for line, values in batch:
+                product = Product(**self._field_values(values, [
+                    column for column in self.columns if column not in ('category', 'supplier', 'opening_stock')
+                ]))
+                if 'category' in values:
+                    product.category_id = self.categories.get(values['category'])
+                if 'supplier' in values:
+                    product.supplier_id = self.suppliers.get(values['supplier'])
+                # bulk_create skips save(). A new product starts with its opening stock valued at
+                # unit_price, as save() would; on conflict these columns are not updated.
+                opening = 0 if values[self.key] in existing else (values.get('opening_stock') or 0)
+                product.quantity = opening
+                product.average_cost = product.unit_price
+                product.stock_value = opening * product.unit_price
+                product.is_low_stock = opening <= product.reorder_level
+                objects.append(product)
+                if values.get('opening_stock') and values[self.key] in existing:
+                    self.error(line, f"SKU {values[self.key]!r} already exists; its opening stock was not posted.")
+
+        # New rows are inserted whole. Existing rows update only the columns their cells filled,
+        # one INSERT ... ON CONFLICT per set of filled columns, so a blank cell changes nothing.
+        by_fields = defaultdict(list)
+        for (_, values), obj in zip(batch, objects):
+            if values[self.key] in existing:
+                fields = tuple(column for column in self.columns if column in values and column not in (self.key, 'opening_stock'))
+            else:
+                fields = tuple(column for column in self.columns if column not in (self.key, 'opening_stock'))
+            by_fields[fields].append(obj)
+        updated_fields = set()
+        for fields, group in by_fields.items():
+            if fields:
+                self.model.objects.bulk_create(group, update_conflicts=True, unique_fields=[self.key],
+                                               update_fields=[*fields, 'updated_at'])
+            else:
+                self.model.objects.bulk_create(group, ignore_conflicts=True)
+            if any(getattr(obj, self.key) in existing for obj in group):
+                updated_fields.update(fields)
+        self.result['created'] += len(keys) - len(existing)
+        self.result['updated'] += len(existing)
+
+        if self.kind == 'products':
+            ids = dict(Product.objects.filter(sku__in=keys).values_list('sku', 'id'))
+            if 'reorder_level' in updated_fields:
+                # Updated reorder levels change the low-stock flag of products that already had stock
+                Product.objects.filter(sku__in=existing).update(is_low_stock=Case(
+                    When(quantity__lte=F('reorder_level'), then=Value(True)), default=Value(False),
+                    output_field=BooleanField(),
+                ))
+            self.post_opening_stock({ids[product.sku]: product for product in objects if product.quantity})
+            search.index_products(ids.values())
+
+    def post_opening_stock(self, products):
+        """
+        Records the opening stock of new products ({id: Product}) as 'ADJ' ledger rows and
+        opens their first FIFO cost layer at unit_price, one INSERT each. The stock itself was
+        written with the products, so the rows are bulk-created without Transaction.save() to
+        avoid counting it twice.
+        """
+        if not products:
+            return
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(product_id=pk, transaction_type='ADJ', quantity=product.quantity, user=self.user,
+                        timestamp=now, notes="Opening stock (catalog import)")
+            for pk, product in products.items()
+        ], batch_size=BATCH_SIZE)
+        CostLayer.objects.bulk_create([
+            CostLayer(product_id=pk, received_at=now, unit_cost=product.unit_price,
+                      quantity_received=product.quantity, quantity_remaining=product.quantity)
+            for pk, product in products.items()
+        ], batch_size=BATCH_SIZE)
+        self.result['opening_stock'] += sum(product.quantity for product in products.values())
+
+
+def import_csv(kind, lines, user=None, dry_run=False):
+    """
+    Imports `kind` ('categories', 'suppliers' or 'products') from CSV text lines (a file
+    opened in text mode). Returns {'created', 'updated', 'opening_stock', 'errors'} where
+    errors is a list of (line number, message) for the rows that were skipped. Raises
+    ValidationError if the header lacks a required column. With dry_run nothing is saved.
+    """
+    importer = _Importer(kind, user)
+    try:
+        with db_transaction.atomic():
+            importer.run(lines)
+            if dry_run:
+                raise _DryRun # Roll everything back; the counts and errors are still reported
+            dashboard_cache.invalidate('counts', 'stock', 'recent_transactions')
+            choices.invalidate(Category, Supplier) # Products can create categories and suppliers too
+    except _DryRun:
+        pass
+    return importer.result
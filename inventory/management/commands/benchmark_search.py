@@ -0,0 +1,91 @@
+# inventory/management/commands/benchmark_search.py
+
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import Q
+
+from inventory import search
+from inventory.models import Product
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'tor', 'vex', 'dri', 'pan', 'sul', 'gro', 'fen', 'bak', 'zi', 'rum', 'tel', 'qua']
+
+
+def vocabulary(size=2000):
+    """A deterministic catalog vocabulary, so seeded terms are about as selective as real product words."""
+    rng = random.Random(0)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Times product search through the FTS5 index against the previous icontains "
+        "filter. With --seed, synthetic products are added first and rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help="Search terms to time (default: terms from the seed vocabulary)")
+        parser.add_argument('--seed', type=int, default=0, help="Synthetic products to add for the run")
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per query and method")
+        parser.add_argument('--limit', type=int, default=10, help="Rows fetched per search (one page)")
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError("The FTS5 search index is not available on this database.")
+        try:
+            with db_transaction.atomic():
+                if options['seed']:
+                    self.seed(options['seed'])
+                self.run(options)
+                raise _Rollback # Leave no synthetic products behind
+        except _Rollback:
+            pass
+
+    def seed(self, count):
+        tag = uuid.uuid4().hex[:6].upper()
+        rng = random.Random(0)
+        words = vocabulary()
+        products = [
+            Product(
+                name=' '.join(rng.sample(words, 3)).title(),
+                sku=f"SKU-{n}-{tag}",
+                description=' '.join(rng.choices(words, k=12)),
+                unit_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+            ) for n in range(count)
+        ]
+        created = Product.objects.bulk_create(products, batch_size=500)
+        search.index_products(product.pk for product in created) # bulk_create sends no signals
+        self.stdout.write(f"Seeded {count} products ({Product.objects.count()} in total).")
+
+    def time(self, queryset, repeat, limit):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            rows = list(queryset[:limit])
+        return (time.perf_counter() - started) / repeat * 1000, len(rows)
+
+    def run(self, options):
+        repeat, limit = options['repeat'], options['limit']
+        words = vocabulary()
+        queries = options['queries'] or [words[0], words[1][:4], f"{words[2]} {words[3]}", 'SKU-1234']
+        self.stdout.write(f"{'query':<20} {'icontains ms':>12} {'fts ms':>8} {'speedup':>8}  hits (icontains/fts)")
+        for query in queries:
+            icontains = Product.objects.filter(Q(name__icontains=query) | Q(sku__icontains=query)).order_by('name')
+            fts = search.search_products(Product.objects.all(), query)
+            icontains_ms, icontains_hits = self.time(icontains, repeat, limit)
+            fts_ms, fts_hits = self.time(fts, repeat, limit)
+            speedup = icontains_ms / fts_ms if fts_ms else float('inf')
+            self.stdout.write(
+                f"{query:<20} {icontains_ms:>12.2f} {fts_ms:>8.2f} {speedup:>7.1f}x  "
+                f"{icontains.count()}/{fts.count()}"
+            )
@@ -0,0 +1,84 @@
+# inventory/management/commands/checkout_stress.py
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction as db_transaction, DatabaseError
+from django.db.models import Sum
+
+from inventory.models import Product, Transaction, Invoice, InvoiceItem
+from inventory.services import post_invoice_items, InsufficientStock
+
+
+class Command(BaseCommand):
+    help = (
+        "Submits many invoices in parallel against a single product, then checks that stock "
+        "was never oversold and reports checkout throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Number of parallel threads")
+        parser.add_argument('--invoices', type=int, default=200, help="Total number of invoices to submit")
+        parser.add_argument('--quantity', type=int, default=1, help="Units sold per invoice")
+        parser.add_argument('--stock', type=int, default=100, help="Opening stock of the test product")
+        parser.add_argument('--keep', action='store_true', help="Keep the test product and invoices afterwards")
+
+    def handle(self, *args, **options):
+        quantity = options['quantity']
+        tag = uuid.uuid4().hex[:8].upper()
+        product = Product.objects.create(
+            name=f"Checkout stress test {tag}", sku=f"STRESS-{tag}", quantity=options['stock'],
+            unit_price=Decimal('1.00'), selling_price=Decimal('1.00'),
+        )
+
+        def checkout(n):
+            try:
+                with db_transaction.atomic():
+                    invoice = Invoice.objects.create(
+                        invoice_number=f"STRESS-{tag}-{n}", tax_rate=Decimal('0'), discount_rate=Decimal('0'),
+                    )
+                    post_invoice_items(invoice, [
+                        InvoiceItem(product_id=product.pk, quantity=quantity, unit_price=product.selling_price)
+                    ])
+                return 'accepted'
+            except InsufficientStock:
+                return 'rejected'
+            except DatabaseError:
+                # e.g. SQLite "database is locked" when the busy timeout is exceeded
+                return 'errors'
+            finally:
+                connection.close() # Each worker thread owns its own connection
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(checkout, range(options['invoices'])))
+        elapsed = time.perf_counter() - started
+
+        counts = {key: results.count(key) for key in ('accepted', 'rejected', 'errors')}
+        product.refresh_from_db()
+        sold = Transaction.objects.filter(product=product, transaction_type='OUT').aggregate(
+            total=Sum('quantity'))['total'] or 0
+
+        self.stdout.write(
+            f"{options['invoices']} invoices, {options['workers']} workers, {elapsed:.2f}s "
+            f"({options['invoices'] / elapsed:.1f} checkouts/s)\n"
+            f"accepted={counts['accepted']} rejected={counts['rejected']} errors={counts['errors']}\n"
+            f"opening stock={options['stock']} sold={sold} closing stock={product.quantity}"
+        )
+
+        consistent = (
+            sold == counts['accepted'] * quantity
+            and product.quantity == options['stock'] - sold
+            and sold <= options['stock']
+        )
+
+        if not options['keep']:
+            Invoice.objects.filter(invoice_number__startswith=f"STRESS-{tag}-").delete()
+            product.delete()
+
+        if not consistent:
+            raise CommandError("Stock is inconsistent: the product was oversold or the ledger does not match.")
+        self.stdout.write(self.style.SUCCESS("No oversell: ledger and stock level agree."))
@@ -0,0 +1,48 @@
+# inventory/management/commands/export_data.py
+
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import data_export
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams the transaction ledger, invoices, receipts or their lines as CSV or NDJSON, "
+        "optionally gzip or brotli compressed, to a file or stdout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(data_export.DATASETS), help="Rows to export")
+        parser.add_argument('--format', choices=sorted(data_export.FORMATS), default='csv', help="Output format")
+        parser.add_argument('--start', type=date.fromisoformat, help="First date (YYYY-MM-DD)")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last date (YYYY-MM-DD)")
+        parser.add_argument('--sku', help="Only rows for this product (ledger and line exports)")
+        parser.add_argument('--compress', choices=data_export.available_encodings(), help="Compress the output")
+        parser.add_argument('--output', help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start and end and end < start:
+            raise CommandError("--end cannot be earlier than --start.")
+        product_id = None
+        if options['sku']:
+            product_id = Product.objects.filter(sku=options['sku']).values_list('pk', flat=True).first()
+            if product_id is None:
+                raise CommandError(f"No product with SKU {options['sku']}.")
+
+        chunks = data_export.stream(options['dataset'], options['format'], start_date=start, end_date=end, product_id=product_id)
+        data = data_export.encode(chunks, options['compress'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in data:
+                    f.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['dataset']} to {options['output']}."))
+        else:
+            out = sys.stdout.buffer
+            for chunk in data:
+                out.write(chunk)
+            out.flush()
@@ -0,0 +1,66 @@
+# inventory/management/commands/export_pdfs.py
+
+import os
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import pdf, pdf_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports every invoice or receipt in a date range as PDFs rendered in parallel, "
+        "into a ZIP (one PDF per document) or a single concatenated PDF."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(pdf_export.EXPORT_SOURCES), help="Document type to export")
+        parser.add_argument('--start', type=date.fromisoformat, required=True, help="First date (YYYY-MM-DD)")
+        parser.add_argument('--end', type=date.fromisoformat, required=True, help="Last date (YYYY-MM-DD)")
+        parser.add_argument('--output', required=True, help="File to write (.zip or .pdf)")
+        parser.add_argument('--format', choices=['zip', 'pdf'], help="Output format (default: from the --output extension)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Rendering processes")
+
+    def handle(self, *args, **options):
+        kind, start, end, output = options['kind'], options['start'], options['end'], options['output']
+        if end < start:
+            raise CommandError("--end cannot be earlier than --start.")
+        fmt = options['format'] or ('pdf' if output.lower().endswith('.pdf') else 'zip')
+
+        pool = pdf.start_pool(options['workers'])
+        try:
+            if fmt == 'pdf':
+                try:
+                    count = pdf_export.merged_pdf(kind, start, end, pool, output)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                if not count:
+                    raise CommandError(f"No {kind}s between {start} and {end}.")
+                self.stdout.write(self.style.SUCCESS(f"Wrote {count} {kind}s to {output}."))
+                return
+
+            total = pdf_export.documents(kind, start, end).count()
+            failed = []
+
+            def progress(done, total):
+                self.stdout.write(f"\r{done}/{total} {kind}s", ending='')
+                self.stdout.flush()
+
+            def tracked(pdfs):
+                for filename, data, error in pdfs:
+                    if error is not None:
+                        failed.append(filename)
+                    yield filename, data, error
+
+            pdfs = pdf_export.iter_pdfs(kind, start, end, pool, max_in_flight=options['workers'] * 2)
+            with open(output, 'wb') as f:
+                for chunk in pdf_export.zip_stream(tracked(pdfs), total=total, progress=progress):
+                    f.write(chunk)
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        self.stdout.write("")
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{len(failed)} PDF(s) failed; see errors.txt in the archive."))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total - len(failed)} {kind} PDFs to {output}."))
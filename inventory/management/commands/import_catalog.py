@@ -0,0 +1,42 @@
+# inventory/management/commands/import_catalog.py
+
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or updates categories, suppliers or products from a CSV file (matched by name "
+        "or SKU) in batches, posting the opening stock of new products. Bad rows are reported "
+        "by line number and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORT_KINDS), help="What the file contains")
+        parser.add_argument('path', help="CSV file with a header row")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and report without saving anything")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                result = importer.import_csv(options['kind'], f, dry_run=options['dry_run'])
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        for line, message in result['errors']:
+            self.stdout.write(self.style.WARNING(f"Line {line}: {message}"))
+        summary = (
+            f"{result['created']} created, {result['updated']} updated, "
+            f"{result['opening_stock']} units of opening stock, {len(result['errors'])} row problem(s) "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        if options['dry_run']:
+            summary += " (dry run, nothing saved)"
+        self.stdout.write(self.style.SUCCESS(summary))
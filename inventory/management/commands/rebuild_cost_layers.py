@@ -0,0 +1,177 @@
+# inventory/management/commands/rebuild_cost_layers.py
+
+from collections import defaultdict, deque
+
+from django.core.management.base import BaseCommand
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+
+from inventory.costing import CENT, DOCUMENT_NOTE, AverageReplay
+from inventory.models import Product, Transaction, ReceiptItem, InvoiceItem, CostLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds FIFO cost layers and InvoiceItem.cogs by replaying the Transaction ledger "
+        "in chronological order, a chunk of rows at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Ledger rows processed per chunk")
+
+    def handle(self, *args, **options):
+        self.open_layers = defaultdict(deque) # product_id -> open layers, oldest first
+        self.averages = AverageReplay() # Returns and adjustments open layers at the running average
+        self.unit_prices = self.averages.unit_prices
+        replayed = 0
+
+        with db_transaction.atomic():
+            CostLayer.objects.all().delete()
+            InvoiceItem.objects.update(cogs=None)
+            self.open_opening_layers()
+
+            ledger = Transaction.objects.order_by('timestamp', 'id').values_list(
+                'product_id', 'transaction_type', 'quantity', 'timestamp', 'notes', 'receipt_id'
+            ).iterator(chunk_size=options['chunk_size'])
+            chunk = []
+            for row in ledger:
+                chunk.append(row)
+                if len(chunk) == options['chunk_size']:
+                    replayed += self.replay(chunk)
+                    chunk = []
+            replayed += self.replay(chunk)
+        open_count = sum(len(layers) for layers in self.open_layers.values())
+
+        # Layers can only describe stock the ledger knows about
+        layered = dict(CostLayer.objects.filter(quantity_remaining__gt=0).values('product_id').annotate(
+            total=Sum('quantity_remaining')).values_list('product_id', 'total'))
+        mismatched = [
+            f"{name} (stock {quantity}, layered {layered.get(pk, 0)})"
+            for pk, name, quantity in Product.objects.values_list('pk', 'name', 'quantity').iterator()
+            if quantity != layered.get(pk, 0)
+        ]
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {replayed} ledger rows; {open_count} open cost layers."
+        ))
+        if mismatched:
+            self.stdout.write(self.style.WARNING(
+                f"{len(mismatched)} product(s) whose stock differs from the replayed ledger: " + "; ".join(mismatched[:20])
+            ))
+
+    def open_opening_layers(self):
+        """Stock entered with the product (not in the ledger) is the oldest layer, at unit_price."""
+        layers = []
+        for pk, unit_price, created_at in Product.objects.values_list('pk', 'unit_price', 'created_at').iterator():
+            opening = self.averages.opening.get(pk, 0)
+            if opening > 0:
+                layer = CostLayer(product_id=pk, received_at=created_at, unit_cost=unit_price,
+                                  quantity_received=opening, quantity_remaining=opening)
+                self.open_layers[pk].append(layer)
+                layers.append(layer)
+        CostLayer.objects.bulk_create(layers, batch_size=500)
+
+    def replay(self, rows):
+        """
+        Applies one chunk of ledger rows, resolving the documents they reference in two queries.
+        Layers and costs are written at the end of each chunk, so lines matched in earlier chunks
+        (cogs set / layer created) are skipped when a document's rows span several chunks.
+        """
+        if not rows:
+            return 0
+        self.new_layers, self.touched_layers = [], {}
+        receipt_numbers, invoice_numbers, edited_receipts = set(), set(), set()
+        for product_id, _, _, _, notes, receipt_id in rows:
+            match = DOCUMENT_NOTE.search(notes or '')
+            if match:
+                (receipt_numbers if match.group(1) == 'Receipt' else invoice_numbers).add(match.group(2))
+            elif receipt_id:
+                edited_receipts.add(receipt_id)
+
+        # (document number, product_id) -> lines in creation order, matched to ledger rows one by one
+        receipt_lines = defaultdict(deque)
+        for item in ReceiptItem.objects.filter(
+            receipt__receipt_number__in=receipt_numbers, cost_layers__isnull=True
+        ).select_related('receipt').order_by('id'):
+            receipt_lines[(item.receipt.receipt_number, item.product_id)].append(item)
+        invoice_lines = defaultdict(deque)
+        for item in InvoiceItem.objects.filter(
+            invoice__invoice_number__in=invoice_numbers, cogs__isnull=True
+        ).select_related('invoice').order_by('id'):
+            invoice_lines[(item.invoice.invoice_number, item.product_id)].append(item)
+        # Edits and voids of a receipt move its own layers, at its latest line's price for the product
+        edited_lines = {
+            (item.receipt_id, item.product_id): item
+            for item in ReceiptItem.objects.filter(receipt_id__in=edited_receipts).order_by('id')
+        }
+
+        unit_costs = self.averages.replay([
+            (product_id, transaction_type, quantity, notes, receipt_id)
+            for product_id, transaction_type, quantity, _, notes, receipt_id in rows
+        ])
+
+        costed = []
+        for (product_id, transaction_type, quantity, timestamp, notes, receipt_id), unit_cost in zip(rows, unit_costs):
+            match = DOCUMENT_NOTE.search(notes or '')
+            key = (match.group(2), product_id) if match else None
+            edited_line = None if match else edited_lines.get((receipt_id, product_id))
+            if edited_line is not None and transaction_type == 'OUT':
+                self.consume(product_id, self.consume_receipt(product_id, receipt_id, quantity))
+            elif edited_line is not None:
+                layer = CostLayer(
+                    product_id=product_id, receipt_item=edited_line, received_at=timestamp,
+                    unit_cost=edited_line.unit_price, quantity_received=quantity, quantity_remaining=quantity,
+                )
+                self.open_layers[product_id].append(layer)
+                self.new_layers.append(layer)
+            elif transaction_type == 'OUT' or quantity < 0: # Sales, and shrinkage found by stock-takes
+                item = invoice_lines[key].popleft() if transaction_type == 'OUT' and match and invoice_lines[key] else None
+                cost = self.consume(product_id, abs(quantity))
+                if item is not None:
+                    item.cogs = cost
+                    costed.append(item)
+            elif quantity > 0:
+                # Receipts open a layer at the line price; returns and surpluses at the average, as when posted
+                item = receipt_lines[key].popleft() if transaction_type == 'IN' and match and receipt_lines[key] else None
+                layer = CostLayer(
+                    product_id=product_id, receipt_item=item, received_at=timestamp,
+                    unit_cost=item.unit_price if item else unit_cost.quantize(CENT),
+                    quantity_received=quantity, quantity_remaining=quantity,
+                )
+                self.open_layers[product_id].append(layer)
+                self.new_layers.append(layer)
+
+        CostLayer.objects.bulk_create(self.new_layers, batch_size=500)
+        CostLayer.objects.bulk_update(self.touched_layers.values(), ['quantity_remaining'], batch_size=500)
+        InvoiceItem.objects.bulk_update(costed, ['cogs'], batch_size=500)
+        return len(rows)
+
+    def consume_receipt(self, product_id, receipt_id, quantity):
+        """Takes `quantity` units off a receipt's own layers, newest first; returns the units left."""
+        for layer in reversed(self.open_layers[product_id]):
+            if not quantity:
+                break
+            if layer.receipt_item is None or layer.receipt_item.receipt_id != receipt_id:
+                continue
+            taken = min(quantity, layer.quantity_remaining)
+            layer.quantity_remaining -= taken
+            quantity -= taken
+            if layer.pk is not None: # Written in an earlier chunk
+                self.touched_layers[layer.pk] = layer
+        return quantity
+
+    def consume(self, product_id, quantity):
+        """Takes `quantity` units from the product's oldest layers and returns their cost."""
+        layers = self.open_layers[product_id]
+        cost = 0
+        while quantity and layers:
+            layer = layers[0]
+            taken = min(quantity, layer.quantity_remaining)
+            layer.quantity_remaining -= taken
+            cost += taken * layer.unit_cost
+            quantity -= taken
+            if layer.pk is not None: # Written in an earlier chunk
+                self.touched_layers[layer.pk] = layer
+            if layer.quantity_remaining == 0:
+                layers.popleft()
+        # Units sold beyond the recorded receipts are costed at the current unit price
+        return cost + quantity * self.unit_prices.get(product_id, 0)
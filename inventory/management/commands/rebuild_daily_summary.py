@@ -0,0 +1,87 @@
+# inventory/management/commands/rebuild_daily_summary.py
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import Sum, Count
+
+from inventory.models import Receipt, Invoice, DailySummary
+
+SUMMARY_FIELDS = [
+    'sales_total', 'sales_sub_total', 'tax_total', 'discount_total', 'invoice_count',
+    'purchase_total', 'receipt_count',
+]
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the DailySummary table from invoices and receipts, or verifies it with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help="Only report days that differ; do not write")
+        parser.add_argument('--start', type=str, help="First date to process (YYYY-MM-DD)")
+        parser.add_argument('--end', type=str, help="Last date to process (YYYY-MM-DD)")
+
+    def compute(self, start, end):
+        """Aggregates the source documents per day, in one grouped query per document type."""
+        days = defaultdict(lambda: dict.fromkeys(SUMMARY_FIELDS, 0))
+
+        # Voided documents are not part of the rollup (status leads the date indexes used here)
+        invoices = Invoice.objects.filter(status='posted')
+        receipts = Receipt.objects.filter(status='posted')
+        if start:
+            invoices = invoices.filter(sale_date__gte=start)
+            receipts = receipts.filter(purchase_date__gte=start)
+        if end:
+            invoices = invoices.filter(sale_date__lte=end)
+            receipts = receipts.filter(purchase_date__lte=end)
+
+        for row in invoices.order_by().values('sale_date').annotate(
+            sales_total=Sum('total_amount'), sales_sub_total=Sum('sub_total'),
+            tax_total=Sum('tax_amount'), discount_total=Sum('discount_amount'),
+            invoice_count=Count('id'),
+        ):
+            days[row.pop('sale_date')].update(row)
+        for row in receipts.order_by().values('purchase_date').annotate(
+            purchase_total=Sum('total_amount'), receipt_count=Count('id'),
+        ):
+            days[row.pop('purchase_date')].update(row)
+        return days
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        expected = self.compute(start, end)
+
+        existing = DailySummary.objects.all()
+        if start:
+            existing = existing.filter(date__gte=start)
+        if end:
+            existing = existing.filter(date__lte=end)
+
+        if options['verify']:
+            stored = {s.date: s for s in existing}
+            drift = 0
+            for day in sorted(set(expected) | set(stored)):
+                summary = stored.get(day) or DailySummary(date=day)
+                values = expected.get(day) or dict.fromkeys(SUMMARY_FIELDS, 0)
+                diffs = [
+                    f"{field}: stored {getattr(summary, field)} expected {values[field] or 0}"
+                    for field in SUMMARY_FIELDS
+                    if Decimal(getattr(summary, field) or 0) != Decimal(values[field] or 0)
+                ]
+                if diffs:
+                    drift += 1
+                    self.stdout.write(f"{day}: " + "; ".join(diffs))
+            if drift:
+                raise CommandError(f"{drift} day(s) differ from the source documents. Run without --verify to rebuild.")
+            self.stdout.write(self.style.SUCCESS(f"DailySummary matches the source documents ({len(stored)} days)."))
+            return
+
+        with db_transaction.atomic():
+            existing.delete()
+            DailySummary.objects.bulk_create(
+                [DailySummary(date=day, **values) for day, values in sorted(expected.items())],
+                batch_size=500,
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt DailySummary for {len(expected)} days."))
@@ -0,0 +1,18 @@
+# inventory/management/commands/rebuild_search_index.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction, OperationalError
+
+from inventory import search
+
+
+class Command(BaseCommand):
+    help = "Repopulates the SQLite FTS5 product search index from the product table."
+
+    def handle(self, *args, **options):
+        try:
+            with db_transaction.atomic():
+                count = search.rebuild()
+        except OperationalError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products."))
@@ -0,0 +1,66 @@
+# inventory/management/commands/verify_average_cost.py
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from inventory.costing import CENT, AverageReplay
+from inventory.models import Product, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes each product's moving average cost and stock value by replaying the "
+        "Transaction ledger, reports products whose stored values have drifted, and "
+        "optionally corrects them with --fix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recomputed values for drifted products")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Ledger rows processed per chunk")
+        parser.add_argument('--tolerance', type=Decimal, default=Decimal('0.01'),
+                            help="Largest stock value difference that is not reported")
+
+    def handle(self, *args, **options):
+        products = {
+            pk: {'unit_price': unit_price, 'quantity': quantity, 'average_cost': average_cost, 'stock_value': stock_value}
+            for pk, unit_price, quantity, average_cost, stock_value in Product.objects.values_list(
+                'pk', 'unit_price', 'quantity', 'average_cost', 'stock_value').iterator()
+        }
+
+        self.averages = AverageReplay()
+        ledger = Transaction.objects.order_by('timestamp', 'id').values_list(
+            'product_id', 'transaction_type', 'quantity', 'notes', 'receipt_id'
+        ).iterator(chunk_size=options['chunk_size'])
+        chunk = []
+        for row in ledger:
+            chunk.append(row)
+            if len(chunk) == options['chunk_size']:
+                self.averages.replay(chunk)
+                chunk = []
+        self.averages.replay(chunk)
+
+        drifted = []
+        for pk, product in products.items():
+            quantity, value, average = self.averages.state[pk]
+            value = value.quantize(CENT)
+            # An average of 0 means "not yet costed"; both sides then value stock at unit_price
+            stored_unit_cost = product['average_cost'] or product['unit_price']
+            if abs(value - product['stock_value']) > options['tolerance'] or (
+                quantity and abs((average or product['unit_price']) - stored_unit_cost) > options['tolerance']
+            ):
+                drifted.append(Product(pk=pk, average_cost=average, stock_value=value))
+                self.stdout.write(
+                    f"Product #{pk}: stored value {product['stock_value']} avg {product['average_cost']}, "
+                    f"recomputed value {value} avg {average}"
+                )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f"Average costs match the ledger ({len(products)} products)."))
+            return
+        if not options['fix']:
+            raise CommandError(f"{len(drifted)} product(s) differ from the ledger. Run with --fix to correct them.")
+        with db_transaction.atomic():
+            Product.objects.bulk_update(drifted, ['average_cost', 'stock_value'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Corrected {len(drifted)} product(s)."))
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:33
+
+from django.db import migrations, models
+from django.db.models import Sum, Count
+
+
+def backfill_daily_summary(apps, schema_editor):
+    """Populates DailySummary from the existing invoices and receipts."""
+    Invoice = apps.get_model('inventory', 'Invoice')
+    Receipt = apps.get_model('inventory', 'Receipt')
+    DailySummary = apps.get_model('inventory', 'DailySummary')
+
+    days = {}
+    for row in Invoice.objects.order_by().values('sale_date').annotate(
+        sales_total=Sum('total_amount'), sales_sub_total=Sum('sub_total'),
+        tax_total=Sum('tax_amount'), discount_total=Sum('discount_amount'),
+        invoice_count=Count('id'),
+    ):
+        days.setdefault(row.pop('sale_date'), {}).update(row)
+    for row in Receipt.objects.order_by().values('purchase_date').annotate(
+        purchase_total=Sum('total_amount'), receipt_count=Count('id'),
+    ):
+        days.setdefault(row.pop('purchase_date'), {}).update(row)
+
+    DailySummary.objects.bulk_create(
+        [DailySummary(date=day, **values) for day, values in days.items()], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('sales_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sales_sub_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tax_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('discount_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('purchase_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('receipt_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily summaries',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(backfill_daily_summary, migrations.RunPython.noop),
+    ]
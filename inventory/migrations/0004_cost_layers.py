@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_opening_layers(apps, schema_editor):
+    """Opens one layer per product for the stock on hand, at its current cost, so older stock is sold first."""
+    Product = apps.get_model('inventory', 'Product')
+    CostLayer = apps.get_model('inventory', 'CostLayer')
+    now = timezone.now()
+    CostLayer.objects.bulk_create([
+        CostLayer(product_id=pk, received_at=now, unit_cost=unit_price,
+                  quantity_received=quantity, quantity_remaining=quantity)
+        for pk, quantity, unit_price in Product.objects.filter(quantity__gt=0).values_list('pk', 'quantity', 'unit_price').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_daily_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='cogs',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='Realized cost of goods sold (FIFO), set when the line is posted', max_digits=12, null=True),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity_received', models.PositiveIntegerField()),
+                ('quantity_remaining', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='inventory.product')),
+                ('receipt_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cost_layers', to='inventory.receiptitem')),
+            ],
+            options={
+                'ordering': ['product', 'received_at', 'id'],
+                'indexes': [models.Index(condition=models.Q(('quantity_remaining__gt', 0)), fields=['product', 'received_at', 'id'], name='costlayer_open_fifo_idx')],
+            },
+        ),
+        migrations.RunPython(seed_opening_layers, migrations.RunPython.noop),
+    ]
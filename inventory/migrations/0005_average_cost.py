@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:39
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seed_valuation(apps, schema_editor):
+    """Values existing stock at its current purchase price; verify_average_cost --fix can recompute it from the ledger."""
+    Product = apps.get_model('inventory', 'Product')
+    Product.objects.update(average_cost=F('unit_price'), stock_value=F('quantity') * F('unit_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_cost_layers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_cost',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, help_text='Moving weighted-average unit cost of the stock on hand', max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_value',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Value of the stock on hand at average cost', max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='invoiceitem',
+            name='cogs',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='Realized cost of goods sold (see INVENTORY_COST_METHOD), set when the line is posted', max_digits=12, null=True),
+        ),
+        migrations.RunPython(seed_valuation, migrations.RunPython.noop),
+    ]
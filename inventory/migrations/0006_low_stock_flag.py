@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:46
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_low_stock(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    Product.objects.filter(quantity__lte=F('reorder_level')).update(is_low_stock=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_average_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_low_stock',
+            field=models.BooleanField(default=False, editable=False, help_text='Materialized quantity <= reorder_level, kept in sync by every stock update'),
+        ),
+        migrations.RunPython(mark_low_stock, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_low_stock', True)), fields=['supplier', 'name'], name='product_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:05
+
+from django.db import migrations, OperationalError
+
+FTS_TABLE = 'inventory_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    """Creates and fills the FTS5 product search table (SQLite only; other databases use icontains)."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, sku, description, category, supplier, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    except OperationalError:
+        return # SQLite built without FTS5: search falls back to icontains
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, sku, description, category, supplier) "
+        "SELECT p.id, p.name, COALESCE(p.sku, ''), COALESCE(p.description, ''), COALESCE(c.name, ''), COALESCE(s.name, '') "
+        "FROM inventory_product p "
+        "LEFT JOIN inventory_category c ON c.id = p.category_id "
+        "LEFT JOIN inventory_supplier s ON s.id = p.supplier_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_low_stock_flag'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockTake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('open', 'Open'), ('committed', 'Committed'), ('cancelled', 'Cancelled')], default='open', max_length=10)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('committed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockTakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted_quantity', models.PositiveIntegerField()),
+                ('expected_quantity', models.PositiveIntegerField(help_text='System quantity when the count was recorded')),
+                ('variance', models.IntegerField(blank=True, editable=False, help_text='Applied adjustment, set on commit', null=True)),
+                ('counted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['stock_take', 'product'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='quantity',
+            field=models.IntegerField(help_text='Units moved. Only adjustments can be negative (e.g. stock-take shrinkage)'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.CheckConstraint(condition=models.Q(('quantity__gte', 0), ('transaction_type', 'ADJ'), _connector='OR'), name='txn_quantity_signed_adj_only'),
+        ),
+        migrations.AddField(
+            model_name='stocktake',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_takes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='stocktakeline',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_take_lines', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='stocktakeline',
+            name='stock_take',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.stocktake'),
+        ),
+        migrations.AddConstraint(
+            model_name='stocktakeline',
+            constraint=models.UniqueConstraint(fields=('stock_take', 'product'), name='stocktakeline_unique_product'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_api_versioning'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='status',
+            field=models.CharField(choices=[('posted', 'Posted'), ('void', 'Void')], default='posted', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='voided_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='voided_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='voided_invoices', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='status',
+            field=models.CharField(choices=[('posted', 'Posted'), ('void', 'Void')], default='posted', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='voided_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='voided_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='voided_receipts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'sale_date'], name='invoice_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['status', 'purchase_date'], name='receipt_status_date_idx'),
+        ),
+    ]
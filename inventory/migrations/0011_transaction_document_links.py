@@ -0,0 +1,65 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:18
+
+import re
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Notes written by postings, edits and voids: "Stock in via Receipt R-1", "Edit of Invoice I-1", ...
+# Document numbers are free text (spaces included), so the number is the rest of the note.
+DOCUMENT_NOTE = re.compile(r"(?:via|Edit of|Void of) (Receipt|Invoice) (.+)$")
+CHUNK_SIZE = 2000
+
+
+def link_documents(apps, schema_editor):
+    """
+    Links existing ledger rows to their receipt or invoice by parsing the notes, a chunk of
+    rows at a time (keyset on id): each chunk resolves its document numbers in one query per
+    document type and sets the link with one UPDATE per document. Rows naming a document that
+    no longer exists stay unlinked and are counted.
+    """
+    Transaction = apps.get_model('inventory', 'Transaction')
+    models_by_kind = {'Receipt': apps.get_model('inventory', 'Receipt'), 'Invoice': apps.get_model('inventory', 'Invoice')}
+    last_id, unlinked = 0, 0
+    while True:
+        rows = list(Transaction.objects.filter(pk__gt=last_id, notes__isnull=False).order_by('pk').values_list('pk', 'notes')[:CHUNK_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        references = defaultdict(lambda: defaultdict(list)) # kind -> document number -> row ids
+        for pk, notes in rows:
+            match = DOCUMENT_NOTE.search(notes)
+            if match:
+                references[match.group(1)][match.group(2)].append(pk)
+        for kind, numbers in references.items():
+            number_field = f'{kind.lower()}_number'
+            ids = dict(models_by_kind[kind].objects.filter(**{f'{number_field}__in': numbers}).values_list(number_field, 'pk'))
+            for number, row_ids in numbers.items():
+                if number in ids:
+                    Transaction.objects.filter(pk__in=row_ids).update(**{f'{kind.lower()}_id': ids[number]})
+                else: # Deleted document
+                    unlinked += len(row_ids)
+    if unlinked:
+        print(f"\n  {unlinked} ledger row(s) name a receipt or invoice that no longer exists; left unlinked.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_document_void'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='invoice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='inventory.invoice'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='receipt',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='inventory.receipt'),
+        ),
+        migrations.RunPython(link_documents, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,17 @@
 # inventory/models.py
 
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from django.core.exceptions import ValidationError
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Case, When, Value
 
 class Category(models.Model):
     """Model representing a product category."""
     name = models.CharField(max_length=100, unique=True, help_text="Enter product category (e.g. Electronics)")
     description = models.TextField(blank=True, null=True, help_text="Optional description")
+    updated_at = models.DateTimeField(auto_now=True) # Versions the API's ETag / Last-Modified
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -29,6 +30,7 @@ class Supplier(models.Model):
     email = models.EmailField(blank=True, null=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True) # Versions the API's ETag / Last-Modified
 
     class Meta:
         ordering = ['name']
@@ -50,11 +52,23 @@ class Product(models.Model):
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Cost per unit (purchase price)")
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Selling price per unit")
     reorder_level = models.PositiveIntegerField(default=10, help_text="Minimum stock level before reordering")
+    average_cost = models.DecimalField(max_digits=12, decimal_places=4, default=0, editable=False,
+                                       help_text="Moving weighted-average unit cost of the stock on hand")
+    stock_value = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False,
+                                      help_text="Value of the stock on hand at average cost")
+    is_low_stock = models.BooleanField(default=False, editable=False,
+                                       help_text="Materialized quantity <= reorder_level, kept in sync by every stock update")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Only low-stock rows are indexed: low-stock counts and the reorder queue read this small index
+            models.Index(fields=['supplier', 'name'], name='product_low_stock_idx', condition=models.Q(is_low_stock=True)),
+            # API change feeds page on (updated_at, id) and version on MAX(updated_at)
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.sku or 'No SKU'})"
@@ -62,17 +76,68 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('product-detail', args=[str(self.id)])
 
+    @db_transaction.atomic
+    def save(self, *args, **kwargs):
+        self.is_low_stock = self.quantity <= self.reorder_level
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'quantity', 'reorder_level'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'is_low_stock'}
+        is_new = self._state.adding
+        if is_new and not self.stock_value:
+            # Opening stock entered with the product is valued at its purchase price
+            self.average_cost = self.unit_price
+            self.stock_value = self.quantity * self.unit_price
+        super().save(*args, **kwargs)
+        if is_new and self.quantity:
+            # ...and is the oldest FIFO layer, so the first sales are costed at that price
+            CostLayer.objects.create(product=self, received_at=self.created_at, unit_cost=self.unit_price,
+                                     quantity_received=self.quantity, quantity_remaining=self.quantity)
+
+    @staticmethod
+    def current_unit_cost():
+        """Expression for the unit cost used to value stock: the average cost, or unit_price before any receipt."""
+        return Case(When(average_cost=0, then=F('unit_price')), default=F('average_cost'),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=4))
+
+    @staticmethod
+    def low_stock_after(quantity_change):
+        """
+        Expression for is_low_stock after adding `quantity_change` (an int or expression) to
+        quantity, for use in the same UPDATE: SET evaluates against the old row.
+        """
+        return Case(When(quantity__lte=F('reorder_level') - quantity_change, then=Value(True)),
+                    default=Value(False), output_field=models.BooleanField())
+
     @property
     def is_below_reorder_level(self):
         return self.quantity <= self.reorder_level
 
-    def update_stock(self, quantity_change):
+    def update_stock(self, quantity_change, track_layers=True):
         """Updates stock level. Positive for stock in, negative for stock out."""
-        if self.quantity + quantity_change < 0:
-            raise ValidationError(f"Cannot reduce stock below zero for {self.name}.")
-        self.quantity = F('quantity') + quantity_change
-        self.save(update_fields=['quantity'])
+        # Check and apply in one conditional UPDATE (... WHERE quantity >= n) so that a stale
+        # in-memory quantity or a concurrent stock-out can never take the level below zero.
+        # Movements that are not priced receipts (adjustments, returns, sales) are valued at the
+        # current average cost, which keeps average_cost unchanged and stock_value in step.
+        unit_cost = Product.current_unit_cost()
+        updated = Product.objects.filter(pk=self.pk, quantity__gte=max(-quantity_change, 0)).update(
+            quantity=F('quantity') + quantity_change,
+            is_low_stock=Product.low_stock_after(quantity_change),
+            stock_value=F('stock_value') + quantity_change * unit_cost,
+            average_cost=unit_cost,
+            updated_at=timezone.now(),
+        )
         self.refresh_from_db() # Ensure the instance reflects the updated database value
+        if not updated:
+            raise ValidationError(f"Cannot reduce stock below zero for {self.name}. Available: {self.quantity}")
+        if not track_layers:
+            return
+        # FIFO layers follow the same movement: stock out consumes the oldest layers, stock in
+        # opens a layer at the unit cost it was valued at (the average cost, unchanged above)
+        from .costing import CENT, Movement, add_layer, consume_layers # costing imports this module
+        if quantity_change < 0:
+            consume_layers([Movement(self.pk, -quantity_change)])
+        else:
+            add_layer(self.pk, quantity_change, self.average_cost.quantize(CENT))
 
 class Transaction(models.Model):
     """Model representing an inventory transaction (stock in/out)."""
@@ -83,27 +148,42 @@ class Transaction(models.Model):
     )
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='transactions')
     transaction_type = models.CharField(max_length=3, choices=TRANSACTION_TYPES)
-    quantity = models.PositiveIntegerField()
+    quantity = models.IntegerField(help_text="Units moved. Only adjustments can be negative (e.g. stock-take shrinkage)")
     timestamp = models.DateTimeField(default=timezone.now)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, help_text="User who performed the transaction")
     notes = models.TextField(blank=True, null=True)
+    # Originating document, if any (postings, edits and voids). Indexed foreign keys, so a
+    # document's movements are found with a join instead of scanning notes.
+    receipt = models.ForeignKey('Receipt', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    invoice = models.ForeignKey('Invoice', on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['product', '-timestamp'], name='txn_product_timestamp_idx'), # Product history
+            models.Index(fields=['timestamp'], name='txn_timestamp_idx'), # Date range reports
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(quantity__gte=0) | models.Q(transaction_type='ADJ'),
+                                   name='txn_quantity_signed_adj_only'),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.product.name} ({self.quantity}) on {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
+    @db_transaction.atomic
     def save(self, *args, **kwargs):
         is_new = self._state.adding
-        super().save(*args, **kwargs) # Save the transaction first
+        super().save(*args, **kwargs) # Save the transaction first (rolled back if the stock update fails)
         # Update product stock only for new transactions to avoid double counting on edits
         if is_new:
-            if self.transaction_type == 'IN' or self.transaction_type == 'ADJ': # Assuming Adjustment adds stock initially
-                self.product.update_stock(self.quantity)
+            # Receipt and invoice lines open and consume their own cost layers (see their save())
+            track_layers = self.receipt_id is None and self.invoice_id is None
+            if self.transaction_type == 'IN' or self.transaction_type == 'ADJ': # Adjustments are signed
+                self.product.update_stock(self.quantity, track_layers)
             elif self.transaction_type == 'OUT':
-                self.product.update_stock(-self.quantity)
-            # If you need complex logic for ADJ (e.g., setting absolute value), adjust here.
+                self.product.update_stock(-self.quantity, track_layers)
+            # Absolute counts are applied through stock-take sessions (see stocktake.py)
 
 # --- Receipts (Purchases from Suppliers) ---
 
@@ -117,9 +197,21 @@ class Receipt(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_receipts')
+    # Voided documents are kept for history; their stock is reversed and reports leave them out (see services.void_document)
+    STATUS_CHOICES = (
+        ('posted', 'Posted'),
+        ('void', 'Void'),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='posted')
+    voided_at = models.DateTimeField(null=True, blank=True)
+    voided_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='voided_receipts')
 
     class Meta:
         ordering = ['-purchase_date', '-created_at']
+        indexes = [
+            models.Index(fields=['purchase_date', 'created_at'], name='receipt_purchase_date_idx'),
+            models.Index(fields=['status', 'purchase_date'], name='receipt_status_date_idx'), # Reports over posted documents
+        ]
 
     def __str__(self):
         return f"Receipt {self.receipt_number} from {self.supplier.name if self.supplier else 'N/A'}"
@@ -133,7 +225,7 @@ class Receipt(models.Model):
             total=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=DecimalField()))
         )['total'] or 0.00
         self.total_amount = total
-        self.save(update_fields=['total_amount'])
+        self.save(update_fields=['total_amount', 'updated_at']) # updated_at versions the cached PDF
 
 class ReceiptItem(models.Model):
     """Represents a line item on a purchase receipt."""
@@ -155,8 +247,11 @@ class ReceiptItem(models.Model):
                 transaction_type='IN',
                 quantity=self.quantity,
                 user=self.receipt.created_by, # Associate with user who created receipt
+                receipt=self.receipt,
                 notes=f"Stock in via Receipt {self.receipt.receipt_number}"
             )
+            from .costing import add_layers # costing imports this module
+            add_layers([self]) # Received units are costed at this line's price
         # Recalculate receipt total after item save/update
         # Consider moving this logic to a signal or view if performance becomes an issue
         if self.receipt:
@@ -195,9 +290,21 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_invoices')
+    # Voided documents are kept for history; their stock is reversed and reports leave them out (see services.void_document)
+    STATUS_CHOICES = (
+        ('posted', 'Posted'),
+        ('void', 'Void'),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='posted')
+    voided_at = models.DateTimeField(null=True, blank=True)
+    voided_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='voided_invoices')
 
     class Meta:
         ordering = ['-sale_date', '-created_at']
+        indexes = [
+            models.Index(fields=['sale_date', 'created_at'], name='invoice_sale_date_idx'),
+            models.Index(fields=['status', 'sale_date'], name='invoice_status_date_idx'), # Reports over posted documents
+        ]
 
     def __str__(self):
         return f"Invoice {self.invoice_number} for {self.customer_name or 'N/A'}"
@@ -217,7 +324,7 @@ class Invoice(models.Model):
         self.tax_amount = (amount_after_discount * self.tax_rate) / 100
         self.total_amount = amount_after_discount + self.tax_amount
 
-        self.save(update_fields=['sub_total', 'tax_amount', 'discount_amount', 'total_amount'])
+        self.save(update_fields=['sub_total', 'tax_amount', 'discount_amount', 'total_amount', 'updated_at']) # updated_at versions the cached PDF
 
 class InvoiceItem(models.Model):
     """Represents a line item on a sales invoice."""
@@ -225,16 +332,26 @@ class InvoiceItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Selling price per unit for this invoice")
+    cogs = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False,
+                               help_text="Realized cost of goods sold (see INVENTORY_COST_METHOD), set when the line is posted")
+
+    class Meta:
+        indexes = [
+            # Covering index: per-invoice product aggregates (quantity * unit_price) are read from the index alone
+            models.Index(fields=['invoice', 'product', 'quantity', 'unit_price'], name='invoiceitem_covering_idx'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} @ {self.unit_price}"
 
+    @db_transaction.atomic
     def save(self, *args, **kwargs):
         is_new = self._state.adding
         # Ensure unit price defaults to product's selling price if not provided? Maybe handle in form.
         # Here we assume unit_price is set correctly before saving.
 
-        # Validate stock before saving
+        # Early check against the loaded product; the authoritative check is the
+        # conditional UPDATE in Product.update_stock, which rolls this save back if stock ran out.
         if is_new:
              if self.product.quantity < self.quantity:
                  raise ValidationError(f"Not enough stock for {self.product.name}. Available: {self.product.quantity}")
@@ -248,8 +365,17 @@ class InvoiceItem(models.Model):
                 transaction_type='OUT',
                 quantity=self.quantity,
                 user=self.invoice.created_by, # Associate with user who created invoice
+                invoice=self.invoice,
                 notes=f"Stock out via Invoice {self.invoice.invoice_number}"
             )
+            # Cost at sale, as post_invoice_items stores it for batched lines
+            from .costing import CENT, COST_METHOD, consume_layers # costing imports this module
+            fifo_cost = consume_layers([self])[0]
+            if COST_METHOD == 'average': # The average cost does not move on a sale
+                self.cogs = (self.quantity * (self.product.average_cost or self.product.unit_price)).quantize(CENT)
+            else:
+                self.cogs = fifo_cost
+            InvoiceItem.objects.filter(pk=self.pk).update(cogs=self.cogs)
 
         # Recalculate invoice totals after item save/update
         if self.invoice:
@@ -267,3 +393,119 @@ class InvoiceItem(models.Model):
         super().delete(*args, **kwargs)
         if self.invoice:
             self.invoice.calculate_totals() # Recalculate after delete
+
+# --- Inventory Valuation ---
+
+class CostLayer(models.Model):
+    """
+    A FIFO cost layer: units received together at one unit cost.
+    Sales consume the oldest open layers first (see costing.py) and store the realized
+    cost on InvoiceItem.cogs.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cost_layers')
+    receipt_item = models.ForeignKey(ReceiptItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='cost_layers')
+    received_at = models.DateTimeField(default=timezone.now)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity_received = models.PositiveIntegerField()
+    quantity_remaining = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['product', 'received_at', 'id']
+        indexes = [
+            # Only open layers are ever scanned, oldest first
+            models.Index(fields=['product', 'received_at', 'id'], condition=models.Q(quantity_remaining__gt=0),
+                         name='costlayer_open_fifo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity_remaining}/{self.quantity_received} x {self.product.name} @ {self.unit_cost}"
+
+# --- Stock-takes ---
+
+class StockTake(models.Model):
+    """
+    A physical count session. Counted quantities are recorded per product (by scan or CSV)
+    together with the system quantity at that moment; committing applies every variance as
+    a signed 'ADJ' transaction in one pass (see stocktake.py).
+    """
+    STATUS_CHOICES = (
+        ('open', 'Open'),
+        ('committed', 'Committed'),
+        ('cancelled', 'Cancelled'),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    notes = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='stock_takes')
+    committed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Stock-take #{self.pk} ({self.get_status_display()})"
+
+    def get_absolute_url(self):
+        return reverse('stocktake-detail', args=[str(self.id)])
+
+
+class StockTakeLine(models.Model):
+    """A counted product within a stock-take."""
+    stock_take = models.ForeignKey(StockTake, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_take_lines')
+    counted_quantity = models.PositiveIntegerField()
+    expected_quantity = models.PositiveIntegerField(help_text="System quantity when the count was recorded")
+    variance = models.IntegerField(null=True, blank=True, editable=False, help_text="Applied adjustment, set on commit")
+    counted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['stock_take', 'product']
+        constraints = [
+            models.UniqueConstraint(fields=['stock_take', 'product'], name='stocktakeline_unique_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name}: counted {self.counted_quantity} (expected {self.expected_quantity})"
+
+# --- Reporting ---
+
+class DailySummary(models.Model):
+    """
+    Per-day rollup of sales (invoices) and purchases (receipts).
+    Kept up to date by the signal handlers in signals.py whenever an invoice or receipt
+    is saved or deleted, so daily totals are read from one row instead of re-aggregated.
+    Rebuild or verify it from the source documents with `manage.py rebuild_daily_summary`.
+    """
+    date = models.DateField(unique=True)
+    sales_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sales_sub_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    invoice_count = models.IntegerField(default=0)
+    purchase_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    receipt_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = "Daily summaries"
+
+    def __str__(self):
+        return f"Summary for {self.date}"
+
+    @classmethod
+    def for_date(cls, day):
+        """Returns the summary for `day`, or an unsaved all-zero summary if nothing was posted."""
+        return cls.objects.filter(date=day).first() or cls(date=day)
+
+    @classmethod
+    def add(cls, day, **changes):
+        """Atomically adds `changes` ({field: delta}) to the row for `day`, creating it if needed."""
+        changes = {field: delta for field, delta in changes.items() if delta}
+        if not changes:
+            return
+        updates = {field: F(field) + delta for field, delta in changes.items()}
+        updates['updated_at'] = timezone.now()
+        if not cls.objects.filter(date=day).update(**updates):
+            cls.objects.bulk_create([cls(date=day)], ignore_conflicts=True)
+            cls.objects.filter(date=day).update(**updates)
@@ -0,0 +1,121 @@
+# inventory/pagination.py
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """A page of keyset-paginated results; links carry an opaque cursor instead of a page number."""
+
+    def __init__(self, object_list, has_next, has_previous, next_query=None, previous_query=None):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_query = next_query # Query string for the following page
+        self.previous_query = previous_query
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def key_fields(ordering):
+    """[(field name, descending)] for an ordering such as ('-timestamp', '-id')."""
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+def encode_cursor(values, direction, salt):
+    """Signs the key values of a boundary row into an opaque cursor; direction is 'n' (next) or 'p' (previous)."""
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    return signing.dumps({'k': values, 'd': direction}, salt=salt, compress=True)
+
+
+def decode_cursor(model, ordering, token, salt):
+    """Returns (key values, backwards) for a cursor, or None if it is stale or has been tampered with."""
+    try:
+        cursor = signing.loads(token, salt=salt)
+        opts = model._meta
+        values = [opts.get_field(name).to_python(value) for (name, _), value in zip(key_fields(ordering), cursor['k'])]
+    except (signing.BadSignature, ValidationError, KeyError, TypeError, ValueError):
+        return None
+    return values, cursor.get('d') == 'p'
+
+
+def keyset_condition(ordering, values, backwards=False):
+    """Rows strictly after `values` in the paging direction, as (a < x) OR (a = x AND b < y) ..."""
+    fields = key_fields(ordering)
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        lookup = 'lt' if descending != backwards else 'gt'
+        equal = {earlier: values[j] for j, (earlier, _) in enumerate(fields[:i])}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    # Redundant bound on the leading column, so the database range-scans the index from the cursor
+    name, descending = fields[0]
+    bound = 'lte' if descending != backwards else 'gte'
+    return Q(**{f'{name}__{bound}': values[0]}) & condition
+
+
+class KeysetPaginationMixin:
+    """
+    Paginates a ListView on its ordering key instead of OFFSET: each page is fetched with
+    WHERE (key) < (last key on the previous page) ORDER BY key LIMIT n+1, which an index on
+    the key serves directly, so a deep page costs the same as the first. No COUNT query is run.
+    `keyset_ordering` must end with a unique field (normally '-id') to make the key total.
+    Cursors are signed, so they are opaque to clients and cannot be forged.
+    """
+    keyset_ordering = ('-id',)
+    cursor_param = 'cursor'
+
+    def get_ordering(self):
+        return list(self.keyset_ordering)
+
+    def _salt(self):
+        return f"keyset:{type(self).__name__}"
+
+    def _cursor_query(self, obj, direction):
+        values = [getattr(obj, name) for name, _ in key_fields(self.keyset_ordering)]
+        params = self.request.GET.copy()
+        params[self.cursor_param] = encode_cursor(values, direction, self._salt())
+        params.pop('page', None)
+        return params.urlencode()
+
+    def paginate_queryset(self, queryset, page_size):
+        token = self.request.GET.get(self.cursor_param)
+        # A stale or tampered cursor starts again from the first page
+        cursor = decode_cursor(self.model, self.keyset_ordering, token, self._salt()) if token else None
+        backwards = bool(cursor and cursor[1])
+        if cursor:
+            queryset = queryset.filter(keyset_condition(self.keyset_ordering, cursor[0], backwards))
+        if backwards:
+            # Walk back from the cursor in reverse order, then flip the page the right way round
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else f'-{name}' for name in self.keyset_ordering])
+        else:
+            queryset = queryset.order_by(*self.keyset_ordering)
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        page = KeysetPage(
+            rows, has_next, has_previous,
+            next_query=self._cursor_query(rows[-1], 'n') if has_next and rows else None,
+            previous_query=self._cursor_query(rows[0], 'p') if has_previous and rows else None,
+        )
+        return None, page, rows, page.has_other_pages()
@@ -0,0 +1,261 @@
+# inventory/pdf.py
+"""
+Background PDF rendering. Views render the HTML (which needs the database and the request)
+and hand it to a pool of pre-warmed worker processes that run WeasyPrint, so a burst of
+PDF requests no longer ties up the web workers. Finished PDFs are written to PDF_JOB_DIR,
+which makes a job's state visible to every web process on the host.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import pdf_worker
+
+logger = logging.getLogger(__name__)
+
+
+class PdfQueueFull(Exception):
+    """Raised when PDF_QUEUE_SIZE jobs are already waiting or rendering in this process."""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def job_dir():
+    return str(_setting('PDF_JOB_DIR', os.path.join(settings.BASE_DIR, 'pdf_jobs')))
+
+
+def wait_seconds():
+    """How long a PDF view waits for its job before redirecting to the job's poll page."""
+    return _setting('PDF_WAIT_SECONDS', 5)
+
+
+_lock = threading.Lock()
+_pool = None
+_last_prune = 0.0
+_metrics = {
+    'submitted': 0,
+    'completed': 0,
+    'failed': 0,
+    'rejected': 0,
+    'queue_depth': 0, # Jobs waiting or rendering right now
+    'max_queue_depth': 0,
+    'render_seconds_total': 0.0,
+    'render_seconds_max': 0.0,
+    'wait_seconds_total': 0.0, # Time jobs spent queued before a worker picked them up
+}
+
+
+class InlineExecutor:
+    """Executor stand-in used when PDF_WORKERS = 0: runs each task immediately in this process."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def start_pool(workers):
+    """Starts a pool of `workers` PDF processes and warms them all up."""
+    # 'spawn' keeps the web process's threads and database connections out of the workers
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=pdf_worker.warm_up,
+    )
+    for _ in range(workers):
+        pool.submit(pdf_worker.ping)
+    return pool
+
+
+def shared_pool():
+    """Returns this process's worker pool, starting it on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            workers = _setting('PDF_WORKERS', 2)
+            _pool = start_pool(workers) if workers else InlineExecutor()
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _paths(job_id):
+    base = os.path.join(job_dir(), job_id)
+    return {'meta': f"{base}.json", 'pdf': f"{base}.pdf", 'error': f"{base}.err"}
+
+
+def _prune():
+    """Deletes job files older than PDF_JOB_TTL seconds; runs at most once a minute."""
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < 60:
+        return
+    _last_prune = now
+    cutoff = now - _setting('PDF_JOB_TTL', 600)
+    with os.scandir(job_dir()) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass # Removed by another web process
+
+
+def _reserve():
+    """Takes a place in the queue, or raises PdfQueueFull if PDF_QUEUE_SIZE tasks are already waiting or rendering."""
+    with _lock:
+        if _metrics['queue_depth'] >= _setting('PDF_QUEUE_SIZE', 20):
+            _metrics['rejected'] += 1
+            raise PdfQueueFull()
+        _metrics['submitted'] += 1
+        _metrics['queue_depth'] += 1
+        _metrics['max_queue_depth'] = max(_metrics['max_queue_depth'], _metrics['queue_depth'])
+
+
+def _submit_to_pool(fn, *args):
+    try:
+        return shared_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. WeasyPrint could not load); start a fresh pool and retry once
+        _reset_pool()
+        return shared_pool().submit(fn, *args)
+
+
+def submit(html_string, base_url, filename, user_id=None, fallback_url='/', on_ready=None):
+    """
+    Queues a PDF render and returns (job_id, future). The future resolves when the PDF file
+    has been written (see pdf_path); `on_ready`, if given, is then called with that path.
+    `html_string` may also be a list of documents, rendered in order into one PDF.
+    Raises PdfQueueFull instead of queueing without bound. With PDF_WORKERS = 0 the PDF is
+    rendered immediately in the calling process.
+    """
+    _reserve()
+    os.makedirs(job_dir(), exist_ok=True)
+    _prune()
+    job_id = uuid.uuid4().hex
+    paths = _paths(job_id)
+    with open(paths['meta'], 'w') as f:
+        json.dump({'filename': filename, 'user_id': user_id, 'fallback_url': fallback_url}, f)
+
+    submitted_at = time.monotonic()
+    render = pdf_worker.render_merged if isinstance(html_string, list) else pdf_worker.render_to_file
+    future = _submit_to_pool(render, html_string, base_url, paths['pdf'])
+    future.add_done_callback(lambda f: _finished(job_id, paths, submitted_at, f, on_ready))
+    return job_id, future
+
+
+class QueuedPool:
+    """
+    Executor over the shared worker pool whose tasks count against PDF_QUEUE_SIZE, like
+    submit()'s jobs. Bulk exports render through it, so a large export cannot crowd out
+    the single-document PDF views. submit() raises PdfQueueFull when the queue is full.
+    """
+
+    def submit(self, fn, *args):
+        _reserve()
+        future = _submit_to_pool(fn, *args)
+        future.add_done_callback(_task_finished)
+        return future
+
+
+def _task_finished(future):
+    """Frees a QueuedPool task's place in the queue."""
+    error = None if future.cancelled() else future.exception()
+    with _lock:
+        _metrics['queue_depth'] -= 1
+        if error is not None:
+            _metrics['failed'] += 1
+    if isinstance(error, BrokenProcessPool):
+        _reset_pool()
+
+
+def _finished(job_id, paths, submitted_at, future, on_ready=None):
+    """Records metrics for a completed job and marks failed jobs on disk."""
+    elapsed = time.monotonic() - submitted_at
+    # A job still queued when the pool is reset is cancelled: it failed, and frees its place too
+    error = CancelledError("Cancelled by a worker pool restart") if future.cancelled() else future.exception()
+    with _lock:
+        _metrics['queue_depth'] -= 1
+        depth = _metrics['queue_depth']
+        if error is None:
+            render_seconds = future.result()
+            _metrics['completed'] += 1
+            _metrics['render_seconds_total'] += render_seconds
+            _metrics['render_seconds_max'] = max(_metrics['render_seconds_max'], render_seconds)
+            _metrics['wait_seconds_total'] += max(elapsed - render_seconds, 0)
+        else:
+            _metrics['failed'] += 1
+    if error is None:
+        logger.info("PDF job %s rendered in %.3fs (%.3fs total, queue depth %d)", job_id, render_seconds, elapsed, depth)
+        if on_ready is not None:
+            try:
+                on_ready(paths['pdf'])
+            except OSError:
+                logger.exception("PDF job %s: on_ready callback failed", job_id)
+        return
+    logger.warning("PDF job %s failed: %s", job_id, error)
+    with open(paths['error'], 'w') as f:
+        f.write(str(error))
+    if isinstance(error, BrokenProcessPool):
+        _reset_pool()
+
+
+def job_status(job_id):
+    """
+    Returns (state, meta) for a job: state is 'ready', 'failed' or 'pending', or None
+    for an unknown or expired job. For failed jobs meta['error'] holds the message.
+    """
+    if len(job_id) != 32 or not all(c in '0123456789abcdef' for c in job_id):
+        return None, None
+    paths = _paths(job_id)
+    try:
+        with open(paths['meta']) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if os.path.exists(paths['pdf']):
+        return 'ready', meta
+    if os.path.exists(paths['error']):
+        with open(paths['error']) as f:
+            meta['error'] = f.read()
+        return 'failed', meta
+    return 'pending', meta
+
+
+def pdf_path(job_id):
+    return _paths(job_id)['pdf']
+
+
+def metrics():
+    """Snapshot of this process's PDF queue and render-time counters."""
+    with _lock:
+        snapshot = dict(_metrics)
+    completed = snapshot['completed'] or 1
+    snapshot['render_seconds_avg'] = snapshot['render_seconds_total'] / completed
+    snapshot['wait_seconds_avg'] = snapshot['wait_seconds_total'] / completed
+    snapshot['workers'] = _setting('PDF_WORKERS', 2)
+    snapshot['queue_size'] = _setting('PDF_QUEUE_SIZE', 20)
+    return snapshot
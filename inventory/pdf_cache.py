@@ -0,0 +1,97 @@
+# inventory/pdf_cache.py
+"""
+Disk cache of rendered invoice and receipt PDFs. An entry's key is a hash of the document
+type, id, updated_at and the PDF template version, so it also serves as the ETag: any
+change to the document (adding, editing or removing items re-saves its totals and bumps
+updated_at) or to the template produces a new key. Entries live in
+PDF_CACHE_DIR/<kind>/<pk>/<key>.pdf and are evicted least-recently-used once the cache
+exceeds PDF_CACHE_MAX_BYTES.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.template.loader import get_template
+
+TEMPLATES = {
+    'invoice': 'inventory/invoice_pdf.html',
+    'receipt': 'inventory/receipt_pdf.html',
+}
+
+_evict_lock = threading.Lock()
+
+
+def cache_dir():
+    return str(getattr(settings, 'PDF_CACHE_DIR', os.path.join(settings.BASE_DIR, 'pdf_cache')))
+
+
+@lru_cache(maxsize=None)
+def template_version(kind):
+    """PDF_TEMPLATE_VERSION plus a hash of the template source, so editing a template invalidates its PDFs."""
+    source = get_template(TEMPLATES[kind]).template.source
+    return f"{getattr(settings, 'PDF_TEMPLATE_VERSION', 1)}-{hashlib.sha256(source.encode()).hexdigest()[:12]}"
+
+
+def cache_key(kind, pk, updated_at):
+    raw = f"{kind}:{pk}:{updated_at.isoformat()}:{template_version(kind)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _entry_path(kind, pk, key):
+    return os.path.join(cache_dir(), kind, str(pk), f"{key}.pdf")
+
+
+def get(kind, pk, key):
+    """Returns the path of a cached PDF, marking it recently used, or None on a miss."""
+    path = _entry_path(kind, pk, key)
+    try:
+        os.utime(path) # mtime doubles as the LRU clock
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def store(kind, pk, key, source_path):
+    """Copies a rendered PDF into the cache, replacing older versions of the same document."""
+    document_dir = os.path.dirname(_entry_path(kind, pk, key))
+    shutil.rmtree(document_dir, ignore_errors=True)
+    os.makedirs(document_dir, exist_ok=True)
+    fd, partial_path = tempfile.mkstemp(dir=document_dir, suffix='.part')
+    os.close(fd)
+    shutil.copyfile(source_path, partial_path)
+    os.replace(partial_path, _entry_path(kind, pk, key))
+    evict()
+
+
+def invalidate(kind, pk):
+    """Drops every cached PDF of one document."""
+    shutil.rmtree(os.path.join(cache_dir(), kind, str(pk)), ignore_errors=True)
+
+
+def evict():
+    """Deletes least recently used entries until the cache fits in PDF_CACHE_MAX_BYTES."""
+    max_bytes = getattr(settings, 'PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+    with _evict_lock:
+        entries = []
+        for root, _, files in os.walk(cache_dir()):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
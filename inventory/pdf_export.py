@@ -0,0 +1,181 @@
+# inventory/pdf_export.py
+"""
+Bulk export of invoice or receipt PDFs for a date range. Documents are read in chunks with
+their items prefetched, their HTML is rendered here and the PDFs are rendered in parallel on
+a process pool with a bounded number in flight. Each PDF is written out as soon as it
+completes, so memory stays at a handful of documents however long the range is.
+"""
+
+import logging
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, CancelledError, wait
+
+from django.template.loader import render_to_string
+
+from . import pdf, pdf_cache, pdf_worker
+from .models import Invoice, Receipt
+
+logger = logging.getLogger(__name__)
+
+# kind -> (model, date field, number field, template)
+EXPORT_SOURCES = {
+    'invoice': (Invoice, 'sale_date', 'invoice_number', 'inventory/invoice_pdf.html'),
+    'receipt': (Receipt, 'purchase_date', 'receipt_number', 'inventory/receipt_pdf.html'),
+}
+# Documents read (with their items) per round of queries
+CHUNK_SIZE = 100
+# A merged PDF is laid out in a single worker, which holds every page in memory
+MAX_MERGED_DOCUMENTS = 500
+# Pause before retrying when the shared PDF queue is full and none of this export's PDFs are in flight
+QUEUE_RETRY_SECONDS = 0.2
+
+
+def documents(kind, start_date, end_date):
+    """Posted documents of one kind dated within [start_date, end_date], with items and products prefetched."""
+    model, date_field, _, _ = EXPORT_SOURCES[kind]
+    queryset = model.objects.filter(**{
+        'status': 'posted', # Void documents no longer count
+        f'{date_field}__gte': start_date, f'{date_field}__lte': end_date,
+    }).order_by(date_field, 'pk').select_related('created_by').prefetch_related('items__product')
+    if kind == 'receipt':
+        queryset = queryset.select_related('supplier')
+    return queryset
+
+
+def _html(kind, document):
+    # Same context as the PDF views, so cached and fresh renders are identical
+    return render_to_string(EXPORT_SOURCES[kind][3], {kind: document})
+
+
+def _wait_any(futures):
+    """
+    wait(FIRST_COMPLETED) that also returns futures cancelled by a pool reset: those are
+    cancelled without ever notifying waiters, so a plain wait() would block on them for good.
+    """
+    while True:
+        done, pending = wait(futures, timeout=QUEUE_RETRY_SECONDS, return_when=FIRST_COMPLETED)
+        done |= {future for future in pending if future.cancelled()}
+        if done:
+            return done, pending - done
+
+
+def iter_pdfs(kind, start_date, end_date, pool, max_in_flight, base_url=None):
+    """
+    Yields (filename, pdf_bytes, error) for every document in the range, in completion order.
+    PDFs already in the PDF cache are reused; fresh renders are not added to it, so a
+    month-end export does not evict the PDFs people are actually opening. With a
+    pdf.QueuedPool, a full queue is waited out (finishing this export's own PDFs first).
+    """
+    number_field = EXPORT_SOURCES[kind][2]
+    in_flight = set()
+
+    def finished(futures):
+        for future in futures:
+            # Cancelled by a pool reset: listed as failed, like a render error, not raised into the stream
+            error = CancelledError("Cancelled by a worker pool restart") if future.cancelled() else future.exception()
+            yield future.filename, None if error else future.result(), error
+
+    for document in documents(kind, start_date, end_date).iterator(chunk_size=CHUNK_SIZE):
+        filename = f"{kind}_{getattr(document, number_field)}.pdf"
+        cached_path = pdf_cache.get(kind, document.pk, pdf_cache.cache_key(kind, document.pk, document.updated_at))
+        if cached_path:
+            with open(cached_path, 'rb') as f:
+                yield filename, f.read(), None
+            continue
+        html_string = _html(kind, document)
+        while True:
+            try:
+                future = pool.submit(pdf_worker.render_bytes, html_string, base_url)
+                break
+            except pdf.PdfQueueFull:
+                if in_flight:
+                    done, in_flight = _wait_any(in_flight)
+                    yield from finished(done)
+                else:
+                    time.sleep(QUEUE_RETRY_SECONDS) # Queue taken by other people's PDFs
+        future.filename = filename
+        in_flight.add(future)
+        if len(in_flight) >= max_in_flight:
+            done, in_flight = _wait_any(in_flight)
+            yield from finished(done)
+    while in_flight:
+        done, in_flight = _wait_any(in_flight)
+        yield from finished(done)
+
+
+class _StreamBuffer:
+    """Write-only, non-seekable file object: zipfile writes into it and zip_stream drains it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(pdfs, total=None, progress=None):
+    """
+    Packs (filename, pdf_bytes, error) tuples into a ZIP and yields it chunk by chunk.
+    Failed documents are listed in errors.txt inside the archive. `progress(done, total)`
+    is called after each document.
+    """
+    buffer = _StreamBuffer()
+    errors = []
+    # PDFs are already compressed; storing them keeps the export CPU-bound on rendering only
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for done, (filename, data, error) in enumerate(pdfs, start=1):
+            if error is None:
+                archive.writestr(filename, data)
+            else:
+                errors.append(f"{filename}: {error}")
+            if progress:
+                progress(done, total)
+            yield buffer.drain()
+        if errors:
+            archive.writestr('errors.txt', "\n".join(errors) + "\n")
+    yield buffer.drain()
+
+
+def merged_html(kind, start_date, end_date):
+    """
+    The HTML of every document in the range, in date order, for one merged PDF (see
+    pdf.submit). Raises ValueError above MAX_MERGED_DOCUMENTS; use a ZIP instead.
+    """
+    queryset = documents(kind, start_date, end_date)
+    count = queryset.count()
+    if count > MAX_MERGED_DOCUMENTS:
+        raise ValueError(
+            f"{count} {kind}s is more than a single PDF can hold ({MAX_MERGED_DOCUMENTS}); export a ZIP instead."
+        )
+    return [_html(kind, document) for document in queryset.iterator(chunk_size=CHUNK_SIZE)] if count else []
+
+
+def merged_pdf(kind, start_date, end_date, pool, path, base_url=None):
+    """
+    Renders every document in the range into one PDF at `path` on a pool worker, waiting for
+    it, and returns the number of documents. Used by the export_pdfs command.
+    """
+    html_strings = merged_html(kind, start_date, end_date)
+    if html_strings:
+        pool.submit(pdf_worker.render_merged, html_strings, base_url, path).result()
+    return len(html_strings)
+
+
+def log_progress(done, total):
+    if done % 50 == 0 or done == total:
+        logger.info("PDF export: %s/%s documents", done, total if total is not None else '?')
@@ -0,0 +1,47 @@
+# inventory/pdf_worker.py
+"""
+Functions run inside the PDF worker processes. This module deliberately has no Django
+imports: a freshly spawned worker only loads WeasyPrint.
+"""
+
+import os
+import time
+
+
+def warm_up():
+    """Pool initializer: imports WeasyPrint and renders a tiny page so fonts and CSS are loaded once."""
+    from weasyprint import HTML
+    HTML(string="<p>warm-up</p>").write_pdf()
+
+
+def ping():
+    """No-op task submitted once per worker to start the processes ahead of the first request."""
+    return os.getpid()
+
+
+def render_to_file(html_string, base_url, path):
+    """Renders `html_string` to a PDF at `path` and returns the render time in seconds."""
+    from weasyprint import HTML
+    started = time.perf_counter()
+    partial_path = f"{path}.part"
+    HTML(string=html_string, base_url=base_url).write_pdf(partial_path)
+    os.replace(partial_path, path) # Readers never see a half-written file
+    return time.perf_counter() - started
+
+
+def render_bytes(html_string, base_url):
+    """Renders `html_string` and returns the PDF bytes."""
+    from weasyprint import HTML
+    return HTML(string=html_string, base_url=base_url).write_pdf()
+
+
+def render_merged(html_strings, base_url, path):
+    """Renders several documents into one PDF at `path`, in order; returns the render time in seconds."""
+    from weasyprint import HTML
+    started = time.perf_counter()
+    documents = [HTML(string=html_string, base_url=base_url).render() for html_string in html_strings]
+    pages = [page for document in documents for page in document.pages]
+    partial_path = f"{path}.part"
+    documents[0].copy(pages).write_pdf(partial_path)
+    os.replace(partial_path, path)
+    return time.perf_counter() - started
@@ -0,0 +1,114 @@
+# inventory/search.py
+"""
+Product search backed by an SQLite FTS5 index over product name, SKU, description and
+category and supplier names. Each search term matches as a prefix ("wid" finds "Widget")
+and results are ranked with bm25. The index table is created by migration 0007 and kept in
+sync by the signal handlers in signals.py; `manage.py rebuild_search_index` repopulates it.
+On other databases, or an SQLite build without FTS5, search falls back to icontains.
+"""
+
+import re
+
+from django.db import connection, OperationalError
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product, Category, Supplier
+
+FTS_TABLE = 'inventory_product_fts'
+# bm25 column weights: name, sku, description, category, supplier
+RANK_WEIGHTS = (10.0, 8.0, 1.0, 2.0, 2.0)
+
+_available = None
+
+
+def fts_available():
+    """True if the FTS5 index table exists on the default database (checked once per process)."""
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _available
+
+
+def match_expression(query):
+    """
+    Turns free text into an FTS5 query: every word must match, as a prefix. Words are
+    quoted, so FTS5 operators and punctuation in user input are treated as plain text.
+    """
+    terms = re.findall(r'\w+', query)
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def search_products(queryset, query):
+    """Filters a Product queryset to matches for `query`, best matches first."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset
+    if not fts_available():
+        return queryset.filter(Q(name__icontains=query) | Q(sku__icontains=query))
+    product_table = Product._meta.db_table
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    # The index picks the matching rows; bm25 needs a MATCH in its own query, so each match is
+    # ranked by a lookup on its rowid
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]),
+    ).annotate(search_rank=RawSQL(
+        f'SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {product_table}.id',
+        [expression], output_field=FloatField(),
+    )).order_by('search_rank', 'name')
+
+
+def _index_where(where_sql, params):
+    """Re-indexes the products selected by `where_sql` (on the product table `p`) in two statements."""
+    if not fts_available():
+        return
+    product_table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM {product_table} p WHERE {where_sql})", params
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, sku, description, category, supplier) "
+            f"SELECT p.id, p.name, COALESCE(p.sku, ''), COALESCE(p.description, ''), "
+            f"COALESCE(c.name, ''), COALESCE(s.name, '') "
+            f"FROM {product_table} p "
+            f"LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id "
+            f"LEFT JOIN {Supplier._meta.db_table} s ON s.id = p.supplier_id "
+            f"WHERE {where_sql}",
+            params,
+        )
+
+
+def index_products(product_ids):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), 500):
+        chunk = product_ids[start:start + 500]
+        _index_where(f"p.id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+def index_category(category_id):
+    _index_where("p.category_id = %s", [category_id])
+
+
+def index_supplier(supplier_id):
+    _index_where("p.supplier_id = %s", [supplier_id])
+
+
+def remove_product(product_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild():
+    """Repopulates the whole index from the product table. Returns the number of products indexed."""
+    if not fts_available():
+        raise OperationalError(f"The {FTS_TABLE} FTS5 table is not available on this database.")
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    _index_where("1 = 1", [])
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
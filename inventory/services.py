@@ -0,0 +1,442 @@
+# inventory/services.py
+
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .models import Product, Transaction, ReceiptItem, Invoice, InvoiceItem, CostLayer
+from . import dashboard_cache
+from .costing import (
+    CENT, COST_METHOD, Movement, add_layers, consume_layers, receive_at_average, revalue_at_average, issue_at_average,
+)
+
+# Rows per INSERT for bulk_create and products per grouped stock UPDATE.
+# Kept well under SQLite's bound-parameter limit.
+BATCH_SIZE = 500
+
+
+def _chunked(seq, size):
+    """Yields successive slices of `seq` of at most `size` elements."""
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+def group_quantities(items):
+    """Returns {product_id: total quantity} for a list of line items."""
+    totals = defaultdict(int)
+    for item in items:
+        totals[item.product_id] += item.quantity
+    return dict(totals)
+
+
+def apply_stock_deltas(deltas, revalue=True):
+    """
+    Applies {product_id: quantity_change} to Product.quantity.
+    All products in a chunk are updated by a single UPDATE using a CASE on the primary key,
+    instead of one UPDATE + refresh_from_db per line as Product.update_stock does.
+    With `revalue`, stock_value moves by the change at the current average cost; pass
+    revalue=False when the caller prices the movement itself (receipts).
+    """
+    deltas = [(pk, change) for pk, change in deltas.items() if change]
+    now = timezone.now()
+    for chunk in _chunked(sorted(deltas), BATCH_SIZE):
+        change = Case(
+            *[When(pk=pk, then=Value(qty)) for pk, qty in chunk],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        fields = {'quantity': F('quantity') + change, 'is_low_stock': Product.low_stock_after(change), 'updated_at': now}
+        if revalue:
+            fields['stock_value'] = F('stock_value') + change * Product.current_unit_cost()
+        Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(**fields)
+
+
+class InsufficientStock(ValidationError):
+    """
+    Raised when a stock-out cannot be covered. `shortfalls` holds one dict per short product:
+    {'product_id', 'product_name', 'requested', 'available'}.
+    """
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__([
+            f"Not enough stock for {s['product_name']}. Available: {s['available']}, Requested: {s['requested']}"
+            for s in shortfalls
+        ])
+
+
+class _RollbackDecrement(Exception):
+    pass
+
+
+def decrement_stock(requested):
+    """
+    Removes {product_id: quantity} from stock without overselling under concurrency.
+    Each product is decremented by a conditional UPDATE (... WHERE quantity >= n), so the
+    check and the decrement are one atomic statement and never read a stale row. Products
+    are updated in primary-key order so concurrent checkouts lock rows in the same order.
+    Returns a list of shortfalls (see InsufficientStock); if it is not empty nothing was
+    decremented.
+    """
+    short = []
+    now = timezone.now()
+    try:
+        with db_transaction.atomic():
+            for pk, qty in sorted(requested.items()):
+                updated = Product.objects.filter(pk=pk, quantity__gte=qty).update(
+                    quantity=F('quantity') - qty, is_low_stock=Product.low_stock_after(-qty), updated_at=now
+                )
+                if not updated:
+                    short.append(pk)
+            if short:
+                # Undo the decrements that did succeed; the document is posted all-or-nothing
+                raise _RollbackDecrement
+    except _RollbackDecrement:
+        pass
+    if not short:
+        return []
+    products = Product.objects.only('name', 'quantity').in_bulk(short)
+    return [{
+        'product_id': pk,
+        'product_name': products[pk].name if pk in products else f"Product #{pk}",
+        'requested': requested[pk],
+        'available': products[pk].quantity if pk in products else 0,
+    } for pk in short]
+
+
+@db_transaction.atomic
+def post_receipt_items(receipt, items):
+    """
+    Saves new ReceiptItems for `receipt` and posts them to stock in one pass:
+    bulk-inserts the lines and their 'IN' transactions, applies grouped stock
+    increments, opens a FIFO cost layer per line, updates the moving average
+    cost and recalculates the receipt total once.
+    """
+    items = list(items)
+    if not items:
+        return items
+    for item in items:
+        item.receipt = receipt
+    ReceiptItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+    Transaction.objects.bulk_create([
+        Transaction(
+            product_id=item.product_id,
+            transaction_type='IN',
+            quantity=item.quantity,
+            user=receipt.created_by,
+            receipt=receipt,
+            notes=f"Stock in via Receipt {receipt.receipt_number}",
+        ) for item in items
+    ], batch_size=BATCH_SIZE)
+    apply_stock_deltas(group_quantities(items), revalue=False)
+    add_layers(items)
+    receive_at_average(items)
+    dashboard_cache.invalidate('stock', 'recent_transactions')
+    receipt.calculate_total()
+    return items
+
+
+@db_transaction.atomic
+def post_invoice_items(invoice, items, calculate_totals=True):
+    """
+    Saves new InvoiceItems for `invoice` and posts them to stock in one pass:
+    decrements stock for all lines with conditional updates, bulk-inserts the
+    lines and their 'OUT' transactions, stores each line's cost at sale (COGS,
+    FIFO or moving average per INVENTORY_COST_METHOD) and recalculates the
+    invoice totals once.
+    Raises InsufficientStock (nothing is saved) if any product is short.
+    """
+    items = list(items)
+    if not items:
+        return items
+    shortfalls = decrement_stock(group_quantities(items))
+    if shortfalls:
+        raise InsufficientStock(shortfalls)
+    for item in items:
+        item.invoice = invoice
+    InvoiceItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+    Transaction.objects.bulk_create([
+        Transaction(
+            product_id=item.product_id,
+            transaction_type='OUT',
+            quantity=item.quantity,
+            user=invoice.created_by,
+            invoice=invoice,
+            notes=f"Stock out via Invoice {invoice.invoice_number}",
+        ) for item in items
+    ], batch_size=BATCH_SIZE)
+    fifo_costs = consume_layers(items)
+    average_costs = issue_at_average(items)
+    for item, fifo, average in zip(items, fifo_costs, average_costs):
+        item.cogs = average if COST_METHOD == 'average' else fifo
+    InvoiceItem.objects.bulk_update(items, ['cogs'], batch_size=BATCH_SIZE)
+    dashboard_cache.invalidate('stock', 'recent_transactions')
+    if calculate_totals: # checkout() saves the invoice with its totals already set
+        invoice.calculate_totals()
+    return items
+
+
+def _line_totals(document, with_cogs):
+    """{product_id: {'quantity', 'cogs'}} over a document's saved lines, in one grouped query."""
+    totals = {'quantity': Sum('quantity')}
+    if with_cogs:
+        totals['cogs'] = Sum('cogs')
+    return {row['product_id']: row for row in document.items.order_by().values('product_id').annotate(**totals)}
+
+
+def _allocate_cogs(invoice, product_ids, totals):
+    """Spreads each product's total cost of sale over its lines on the invoice, by quantity."""
+    lines = defaultdict(list)
+    for item in invoice.items.filter(product_id__in=product_ids).order_by('id'):
+        lines[item.product_id].append(item)
+    for product_id, items in lines.items():
+        remaining, quantity_left = totals.get(product_id, Decimal('0')), sum(item.quantity for item in items)
+        for item in items:
+            # Each line takes its share; the last takes what is left, so the lines add up exactly
+            item.cogs = (remaining * item.quantity / quantity_left).quantize(CENT) if quantity_left else Decimal('0')
+            remaining -= item.cogs
+            quantity_left -= item.quantity
+    InvoiceItem.objects.bulk_update([item for items in lines.values() for item in items], ['cogs'], batch_size=BATCH_SIZE)
+
+
+def _receipt_lines(receipt, exclude=()):
+    """{line id: (product_id, quantity, unit_price)} over a receipt's saved lines."""
+    lines = receipt.items.exclude(pk__in=exclude).values_list('pk', 'product_id', 'quantity', 'unit_price')
+    return {pk: (product_id, quantity, unit_price) for pk, product_id, quantity, unit_price in lines}
+
+
+def _post_stock(document, changes, note, user):
+    """
+    Applies the stock that leaves in {product_id: stock change} with conditional decrements
+    and writes one ledger row per changed product, linked to the document, in one batched
+    insert. Raises InsufficientStock if a product is short. Stock that comes in is left to
+    the caller, which prices it. Returns (stock_out, stock_in, timestamp of the rows).
+    """
+    stock_out = {pk: -change for pk, change in changes.items() if change < 0}
+    stock_in = {pk: change for pk, change in changes.items() if change > 0}
+
+    shortfalls = decrement_stock(stock_out)
+    if shortfalls:
+        raise InsufficientStock(shortfalls)
+    now = timezone.now()
+    link = {'invoice': document} if isinstance(document, Invoice) else {'receipt': document}
+    Transaction.objects.bulk_create([
+        Transaction(product_id=pk, transaction_type='IN' if change > 0 else 'OUT', quantity=abs(change),
+                    user=user, timestamp=now, notes=note, **link)
+        for pk, change in sorted(changes.items())
+    ], batch_size=BATCH_SIZE)
+    dashboard_cache.invalidate('stock', 'recent_transactions')
+    return stock_out, stock_in, now
+
+
+def _post_changes(invoice, changes, note, user=None):
+    """
+    Posts {product_id: stock change} for an invoice with one ledger row per product (see
+    _post_stock). Stock that leaves is valued at average cost and consumed from the FIFO
+    layers; stock that comes back is valued at the current unit cost and opens a layer, as
+    other adjustments are. Returns (stock_in, {product_id: cost of the stock that left},
+    {product_id: unit cost of the stock that came back}).
+    """
+    stock_out, stock_in, now = _post_stock(invoice, changes, note, user)
+
+    # Stock leaving: valued at average cost (stock_value) and taken from the oldest layers
+    movements = [Movement(pk, quantity) for pk, quantity in sorted(stock_out.items())]
+    fifo_costs = consume_layers(movements)
+    average_costs = issue_at_average(movements)
+    cost_changes = {
+        movement.product_id: average if COST_METHOD == 'average' else fifo
+        for movement, fifo, average in zip(movements, fifo_costs, average_costs)
+    }
+    # Stock coming back: valued at the current unit cost, as a new layer at that cost
+    apply_stock_deltas(stock_in)
+    unit_costs = {}
+    for chunk in _chunked(sorted(stock_in), BATCH_SIZE):
+        unit_costs.update(Product.objects.filter(pk__in=chunk).annotate(cost=Product.current_unit_cost()).values_list('pk', 'cost'))
+    CostLayer.objects.bulk_create([
+        CostLayer(product_id=pk, received_at=now, unit_cost=unit_costs[pk].quantize(CENT),
+                  quantity_received=quantity, quantity_remaining=quantity)
+        for pk, quantity in sorted(stock_in.items())
+    ], batch_size=BATCH_SIZE)
+    return stock_in, cost_changes, unit_costs
+
+
+def _post_receipt_changes(receipt, before, after, note, user=None):
+    """
+    Posts the difference between a receipt's lines `before` and `after` an edit or a void
+    ({line id: (product_id, quantity, unit_price)}) with one ledger row per product whose
+    quantity changed (see _post_stock). Everything is valued at the lines' own prices, so
+    a line whose price alone changed re-costs its stock too, and the moving average is
+    re-derived as for receipts. Each line's FIFO layers follow it: units it gains open a
+    layer at its price, units it loses come off its own open layers first (the rest, already
+    sold, from the oldest layers) and a new price re-costs what is left of them.
+    Returns {product_id: stock change}.
+    """
+    changes, value_changes = defaultdict(int), defaultdict(Decimal)
+    by_line = {} # (line id, product_id) -> [quantity, price] before, then after
+    for line_id, (product_id, quantity, unit_price) in before.items():
+        changes[product_id] -= quantity
+        value_changes[product_id] -= quantity * unit_price
+        by_line[(line_id, product_id)] = [quantity, unit_price, 0, unit_price]
+    for line_id, (product_id, quantity, unit_price) in after.items():
+        changes[product_id] += quantity
+        value_changes[product_id] += quantity * unit_price
+        by_line.setdefault((line_id, product_id), [0, unit_price, 0, unit_price])[2:] = [quantity, unit_price]
+    by_line = {key: line for key, line in by_line.items() if line[:2] != line[2:]}
+    changes = {pk: change for pk, change in changes.items() if change}
+
+    _, stock_in, now = _post_stock(receipt, changes, note, user)
+    apply_stock_deltas(stock_in, revalue=False)
+    revalue_at_average({pk: value for pk, value in value_changes.items() if value})
+
+    open_layers = defaultdict(list) # Newest first: the units a line loses are its last received
+    for layer in CostLayer.objects.select_for_update().filter(
+        receipt_item_id__in={line_id for line_id, _ in by_line}, quantity_remaining__gt=0
+    ).order_by('-received_at', '-id'):
+        open_layers[(layer.receipt_item_id, layer.product_id)].append(layer)
+    new_layers, sold = [], defaultdict(int)
+    for (line_id, product_id), (old, _, new, unit_price) in sorted(by_line.items()):
+        to_remove = max(old - new, 0)
+        for layer in open_layers[(line_id, product_id)]:
+            taken = min(to_remove, layer.quantity_remaining)
+            layer.quantity_remaining -= taken
+            to_remove -= taken
+            layer.unit_cost = unit_price
+        if to_remove:
+            sold[product_id] += to_remove # Already sold off this line: taken from the oldest layers
+        if new > old:
+            new_layers.append(CostLayer(product_id=product_id, receipt_item_id=line_id, received_at=now,
+                                        unit_cost=unit_price, quantity_received=new - old, quantity_remaining=new - old))
+    CostLayer.objects.bulk_update([layer for layers in open_layers.values() for layer in layers],
+                                  ['quantity_remaining', 'unit_cost'], batch_size=BATCH_SIZE)
+    CostLayer.objects.bulk_create(new_layers, batch_size=BATCH_SIZE)
+    consume_layers([Movement(pk, quantity) for pk, quantity in sorted(sold.items())])
+    return changes
+
+
+@db_transaction.atomic
+def repost_items(document, formset, user=None):
+    """
+    Saves an edited invoice's or receipt's line formset and posts only the net change per
+    product. The saved lines are compared with the edited ones, grouped per product, and a
+    product whose total is unchanged is not touched. Each changed product gets one ledger
+    row ('Edit of Invoice X'), written in one batched insert:
+    - On invoices, stock that leaves (more sold) is decremented conditionally, valued at
+      average cost and consumed from the FIFO layers; stock that comes back is valued at
+      the current unit cost and opens a layer. Each touched product's cost of sale is
+      updated and spread over its lines.
+    - On receipts, changes are valued at the lines' own prices and adjust the lines' own
+      cost layers (see _post_receipt_changes).
+    Totals are recalculated once. Raises InsufficientStock (nothing is saved) if a product
+    is short. Returns {product_id: stock change}.
+    """
+    is_invoice = isinstance(document, Invoice)
+    before = _line_totals(document, True) if is_invoice else _receipt_lines(document)
+
+    # Lines are written in bulk: the per-line save() / delete() side effects are replaced by the posting below
+    items = formset.save(commit=False)
+    new = [item for item in items if item.pk is None]
+    changed = [item for item in items if item.pk is not None]
+    deleted = [item.pk for item in formset.deleted_objects]
+    formset.model.objects.bulk_create(new, batch_size=BATCH_SIZE)
+    formset.model.objects.bulk_update(changed, ['product', 'quantity', 'unit_price'], batch_size=BATCH_SIZE)
+    note = f"Edit of {'Invoice ' + document.invoice_number if is_invoice else 'Receipt ' + document.receipt_number}"
+
+    if not is_invoice:
+        # Removed lines are deleted after posting, while their cost layers still point at them
+        changes = _post_receipt_changes(document, before, _receipt_lines(document, exclude=deleted), note, user)
+        formset.model.objects.filter(pk__in=deleted).delete()
+        document.calculate_total()
+        return changes
+
+    formset.model.objects.filter(pk__in=deleted).delete()
+    after = _line_totals(document, True)
+    changes = {}
+    for pk in before.keys() | after.keys():
+        # Selling more takes stock out
+        change = (before[pk]['quantity'] if pk in before else 0) - (after[pk]['quantity'] if pk in after else 0)
+        if change:
+            changes[pk] = change
+    stock_in, cost_changes, unit_costs = _post_changes(document, changes, note, user)
+
+    for pk, quantity in stock_in.items():
+        cost_changes[pk] = -(quantity * unit_costs[pk]).quantize(CENT) # Returned to the shelf
+    touched = set(changes) | {item.product_id for item in new + changed}
+    _allocate_cogs(document, touched, {
+        pk: ((before[pk]['cogs'] or Decimal('0')) if pk in before else Decimal('0')) + cost_changes.get(pk, Decimal('0'))
+        for pk in touched
+    })
+    document.calculate_totals()
+    return changes
+
+
+@db_transaction.atomic
+def void_document(document, user=None):
+    """
+    Voids a posted invoice or receipt instead of deleting it: the document and its lines are
+    kept for history and its stock is reversed per product in one pass, with one ledger row
+    per product ('Void of Invoice X') written in one batched insert. Goods on a voided invoice
+    come back to the shelf; goods on a voided receipt leave it, and InsufficientStock is
+    raised (nothing is saved) if they have already been sold. Raises ValidationError if the
+    document is already void. Returns {product_id: stock change}.
+    """
+    is_invoice = isinstance(document, Invoice)
+    model = type(document)
+    # Re-read the status under a row lock, so two concurrent voids cannot both reverse the stock
+    if model.objects.select_for_update().filter(pk=document.pk).values_list('status', flat=True).first() != 'posted':
+        raise ValidationError(f"{document} is already void.")
+
+    note = f"Void of {'Invoice ' + document.invoice_number if is_invoice else 'Receipt ' + document.receipt_number}"
+    if is_invoice: # Sold goods come back
+        changes = {pk: row['quantity'] for pk, row in _line_totals(document, False).items() if row['quantity']}
+        _post_changes(document, changes, note, user)
+    else: # Received goods go out, at their lines' prices and off their own layers
+        changes = _post_receipt_changes(document, _receipt_lines(document), {}, note, user)
+
+    document.status = 'void'
+    document.voided_at = timezone.now()
+    document.voided_by = user
+    # Saved through the model, so the daily rollup (signals.py) takes the document out of its day
+    document.save(update_fields=['status', 'voided_at', 'voided_by', 'updated_at'])
+    return changes
+
+
+
+@db_transaction.atomic
+def checkout(cart, user=None, customer_name=None, tax_rate=0, discount_rate=0):
+    """
+    Rings up a point-of-sale cart of [(sku, quantity)] as a new invoice at the products'
+    selling prices. The SKUs are resolved in one query and the totals are computed before
+    the invoice is inserted, so it is written once. The lines are then posted like any
+    other invoice (post_invoice_items): conditional stock decrements, bulk inserts, COGS.
+    Raises ValidationError for unknown SKUs and InsufficientStock if any product is
+    short; in both cases nothing is saved. Returns (invoice, lines).
+    """
+    skus = list(dict.fromkeys(sku for sku, _ in cart))
+    products = {product.sku: product for product in Product.objects.filter(sku__in=skus).only('pk', 'sku', 'name', 'selling_price')}
+    unknown = [sku for sku in skus if sku not in products]
+    if unknown:
+        raise ValidationError(f"Unknown SKU(s): {', '.join(unknown)}.")
+
+    lines = [InvoiceItem(product=products[sku], quantity=quantity, unit_price=products[sku].selling_price)
+             for sku, quantity in cart]
+    # Same arithmetic as Invoice.calculate_totals, rounded to cents as the columns store it.
+    # The rates are rounded first, to the 2 places their columns keep, so the stored totals
+    # are the ones the stored rates give.
+    tax_rate, discount_rate = Decimal(tax_rate).quantize(CENT), Decimal(discount_rate).quantize(CENT)
+    sub_total = sum((line.quantity * line.unit_price for line in lines), Decimal('0')).quantize(CENT)
+    discount_amount = (sub_total * discount_rate / 100).quantize(CENT)
+    tax_amount = ((sub_total - discount_amount) * tax_rate / 100).quantize(CENT)
+    invoice = Invoice.objects.create(
+        invoice_number=f"INV-{uuid.uuid4().hex[:8].upper()}", # Same numbering as InvoiceForm
+        customer_name=customer_name, created_by=user,
+        tax_rate=tax_rate, discount_rate=discount_rate, sub_total=sub_total,
+        discount_amount=discount_amount, tax_amount=tax_amount,
+        total_amount=sub_total - discount_amount + tax_amount,
+    )
+    post_invoice_items(invoice, lines, calculate_totals=False)
+    return invoice, lines
@@ -0,0 +1,165 @@
+# inventory/signals.py
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Product, Supplier, Category, Transaction, Receipt, Invoice, DailySummary
+from . import choices, dashboard_cache, pdf_cache, search
+
+# How each document type contributes to DailySummary:
+# (date field, {summary field: document field}, summary count field)
+SUMMARY_SOURCES = {
+    Invoice: ('sale_date', {
+        'sales_total': 'total_amount',
+        'sales_sub_total': 'sub_total',
+        'tax_total': 'tax_amount',
+        'discount_total': 'discount_amount',
+    }, 'invoice_count'),
+    Receipt: ('purchase_date', {
+        'purchase_total': 'total_amount',
+    }, 'receipt_count'),
+}
+
+
+def _stored_row(sender, pk):
+    """Reads the summary-relevant columns of a document as stored in the database; None once it is void."""
+    date_field, fields, _ = SUMMARY_SOURCES[sender]
+    return sender.objects.filter(pk=pk, status='posted').values(date_field, *fields.values()).first()
+
+
+def _apply_change(sender, before, after):
+    """Posts the difference between two stored rows (either may be None) to DailySummary."""
+    date_field, fields, count_field = SUMMARY_SOURCES[sender]
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for row, sign in ((before, -1), (after, 1)):
+        if row is None:
+            continue
+        day = changes[row[date_field]]
+        for summary_field, document_field in fields.items():
+            day[summary_field] += sign * (row[document_field] or 0)
+        day[count_field] += sign
+    for date, day_changes in changes.items():
+        DailySummary.add(date, **day_changes)
+
+
+# Reading the stored rows (rather than the in-memory instance) keeps the rollup in step with
+# what was actually written: rounded decimals, normalised dates and F() expressions.
+# The handlers run inside the caller's transaction, so a rolled-back posting leaves no trace.
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=Receipt)
+def remember_summary_row(sender, instance, **kwargs):
+    instance._summary_before = None if instance._state.adding else _stored_row(sender, instance.pk)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Receipt)
+def update_summary_on_save(sender, instance, **kwargs):
+    _apply_change(sender, getattr(instance, '_summary_before', None), _stored_row(sender, instance.pk))
+    instance._summary_before = None
+
+
+@receiver(pre_delete, sender=Invoice)
+@receiver(pre_delete, sender=Receipt)
+def remember_deleted_summary_row(sender, instance, **kwargs):
+    instance._summary_before = _stored_row(sender, instance.pk)
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Receipt)
+def update_summary_on_delete(sender, instance, **kwargs):
+    _apply_change(sender, getattr(instance, '_summary_before', None), None)
+
+
+# Cached PDFs are keyed on updated_at, so a changed document never serves a stale PDF;
+# dropping the old entries straight away just returns their space to the cache.
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Receipt)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Receipt)
+def invalidate_cached_pdf(sender, instance, **kwargs):
+    pdf_cache.invalidate(sender.__name__.lower(), instance.pk)
+
+
+# Dashboard sections are marked stale by the writes that change them. Writes that bypass
+# model signals (bulk_create / update() in services.py) invalidate explicitly.
+
+@receiver(post_save, sender=Product)
+def invalidate_dashboard_on_product_save(sender, instance, created, **kwargs):
+    if created:
+        dashboard_cache.invalidate('stock', 'counts')
+    else:
+        dashboard_cache.invalidate('stock')
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_dashboard_on_product_delete(sender, instance, **kwargs):
+    dashboard_cache.invalidate('stock', 'counts', 'recent_transactions') # Its transactions cascade
+
+
+@receiver(post_save, sender=Supplier)
+@receiver(post_save, sender=Category)
+def invalidate_dashboard_counts_on_save(sender, instance, created, **kwargs):
+    choices.invalidate(sender) # A rename changes the filter choices too
+    if created:
+        dashboard_cache.invalidate('counts')
+
+
+@receiver(post_delete, sender=Supplier)
+@receiver(post_delete, sender=Category)
+def invalidate_dashboard_counts_on_delete(sender, instance, **kwargs):
+    choices.invalidate(sender)
+    dashboard_cache.invalidate('counts')
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_dashboard_transactions(sender, instance, **kwargs):
+    dashboard_cache.invalidate('recent_transactions', 'stock')
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_dashboard_sales(sender, instance, **kwargs):
+    dashboard_cache.invalidate('todays_sales')
+
+
+# The FTS5 product search index (see search.py). Category and supplier names are indexed
+# with each product, so renaming or deleting one re-indexes its products.
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    if not created:
+        search.index_category(instance.pk)
+
+
+@receiver(post_save, sender=Supplier)
+def index_supplier_products(sender, instance, created, **kwargs):
+    if not created:
+        search.index_supplier(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Supplier)
+def remember_grouped_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Supplier)
+def reindex_grouped_products(sender, instance, **kwargs):
+    search.index_products(getattr(instance, '_search_product_ids', []))
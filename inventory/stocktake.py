@@ -0,0 +1,174 @@
+# inventory/stocktake.py
+"""
+Stock-take sessions: record absolute counted quantities, then commit them as adjustments.
+
+Each count stores the system quantity at the moment it was recorded. The variance
+(counted - expected) is what the count found missing or extra at that moment. Applying it
+as a delta keeps sales and receipts posted between counting and committing. Committing is
+set-based: one UPDATE fixes the variances, one correlated UPDATE moves every counted
+product's stock, and the ledger rows are inserted in batches. The cost scales with the
+number of counted products, not with per-product round trips.
+"""
+
+import csv
+
+from django.core.exceptions import ValidationError
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, OuterRef, Subquery, Value, When, BooleanField, DecimalField
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Product, Transaction, CostLayer, StockTake, StockTakeLine
+from .costing import Movement, consume_layers
+from . import dashboard_cache
+
+BATCH_SIZE = 500
+
+
+def _check_open(stock_take):
+    if stock_take.status != 'open':
+        raise ValidationError(f"Stock-take #{stock_take.pk} is {stock_take.get_status_display().lower()}; it can no longer be changed.")
+
+
+def record_counts(stock_take, counts, add=False):
+    """
+    Records {product_id: counted quantity} for an open stock-take. Counts replace earlier
+    ones for the same product, or are added to them with `add` (scanning one item at a
+    time). Each product's expected quantity is read in the same batch as its count.
+    """
+    _check_open(stock_take)
+    counts = {pk: qty for pk, qty in counts.items() if qty is not None}
+    now = timezone.now()
+    product_ids = sorted(counts)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        chunk = product_ids[start:start + BATCH_SIZE]
+        on_hand = dict(Product.objects.filter(pk__in=chunk).values_list('pk', 'quantity'))
+        previous = {}
+        if add:
+            previous = dict(StockTakeLine.objects.filter(stock_take=stock_take, product_id__in=chunk)
+                            .values_list('product_id', 'counted_quantity'))
+        StockTakeLine.objects.bulk_create([
+            StockTakeLine(
+                stock_take=stock_take, product_id=pk, counted_quantity=previous.get(pk, 0) + counts[pk],
+                expected_quantity=on_hand[pk], counted_at=now,
+            ) for pk in chunk if pk in on_hand
+        ], update_conflicts=True, unique_fields=['stock_take', 'product'],
+           update_fields=['counted_quantity', 'expected_quantity', 'counted_at'])
+
+
+def record_scan(stock_take, sku, quantity=1):
+    """Adds `quantity` scanned units of the product with `sku`. Returns the product."""
+    product = Product.objects.filter(sku=sku).only('pk', 'name').first()
+    if product is None:
+        raise ValidationError(f"No product with SKU {sku!r}.")
+    record_counts(stock_take, {product.pk: quantity}, add=True)
+    return product
+
+
+def import_counts(stock_take, lines):
+    """
+    Records counts from CSV text with `sku` and `counted_quantity` columns. SKUs are
+    resolved through one in-memory map. Returns (lines recorded, [(line number, problem)]).
+    """
+    reader = csv.DictReader(lines)
+    reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+    if not {'sku', 'counted_quantity'} <= set(reader.fieldnames):
+        raise ValidationError("The file needs sku and counted_quantity columns.")
+    skus = dict(Product.objects.exclude(sku=None).values_list('sku', 'pk'))
+    counts, errors = {}, []
+    for row in reader:
+        sku = (row.get('sku') or '').strip()
+        try:
+            counted = int((row.get('counted_quantity') or '').strip())
+            if counted < 0:
+                raise ValueError
+        except ValueError:
+            errors.append((reader.line_num, "counted_quantity: Enter a whole number of units, 0 or more."))
+            continue
+        if sku not in skus:
+            errors.append((reader.line_num, f"Unknown SKU {sku!r}."))
+        elif skus[sku] in counts:
+            errors.append((reader.line_num, f"SKU {sku!r} appears more than once; its first count is kept."))
+        else:
+            counts[skus[sku]] = counted
+    record_counts(stock_take, counts)
+    return len(counts), errors
+
+
+@db_transaction.atomic
+def commit(stock_take, user=None):
+    """
+    Applies every variance of an open stock-take to stock and the ledger. Products are
+    valued at their current unit cost, as other adjustments are. Surplus opens a FIFO cost
+    layer, and shrinkage consumes the oldest layers. Returns the number of adjusted products.
+    """
+    # Re-read the status under a row lock so a session can only be committed once
+    stock_take.status = StockTake.objects.select_for_update().values_list('status', flat=True).get(pk=stock_take.pk)
+    _check_open(stock_take)
+    lines = StockTakeLine.objects.filter(stock_take=stock_take)
+    lines.update(variance=F('counted_quantity') - F('expected_quantity'))
+    counted = list(lines.exclude(variance=0).order_by('product_id').values_list('product_id', 'variance'))
+    # Stock sold since the count beyond what was on the shelf clamps the level at zero, so the
+    # change applied (and recorded in the ledger) is the variance, limited to the stock left.
+    # The rows stay locked until the commit, so the UPDATE below applies exactly this change.
+    on_hand = {}
+    for start in range(0, len(counted), BATCH_SIZE):
+        chunk = [pk for pk, _ in counted[start:start + BATCH_SIZE]]
+        on_hand.update(Product.objects.select_for_update().filter(pk__in=chunk).values_list('pk', 'quantity'))
+    variances = [(pk, max(variance, -on_hand[pk])) for pk, variance in counted if pk in on_hand]
+    variances = [(pk, change) for pk, change in variances if change]
+
+    if variances:
+        # Correlated subquery: each counted product reads its own variance, in one statement.
+        variance = Coalesce(Subquery(lines.filter(product=OuterRef('pk')).values('variance')[:1]), Value(0))
+        new_quantity = Greatest(F('quantity') + variance, Value(0))
+        unit_cost = Product.current_unit_cost()
+        Product.objects.filter(pk__in=lines.exclude(variance=0).values('product_id')).update(
+            quantity=new_quantity,
+            is_low_stock=Case(When(reorder_level__gte=new_quantity, then=Value(True)), default=Value(False),
+                              output_field=BooleanField()),
+            stock_value=Case(When(quantity__lte=-variance, then=Value(0)),
+                             default=F('stock_value') + variance * unit_cost,
+                             output_field=DecimalField(max_digits=14, decimal_places=2)),
+            average_cost=unit_cost,
+            updated_at=timezone.now(),
+        )
+
+        now = timezone.now()
+        note = f"Stock-take #{stock_take.pk} count variance"
+        Transaction.objects.bulk_create([
+            Transaction(product_id=pk, transaction_type='ADJ', quantity=change, user=user, timestamp=now, notes=note)
+            for pk, change in variances
+        ], batch_size=BATCH_SIZE)
+
+        # FIFO layers follow the count: surplus is a new layer at the current unit cost
+        surplus = [(pk, change) for pk, change in variances if change > 0]
+        unit_costs = {} # average_cost was just set to each product's current unit cost
+        for start in range(0, len(surplus), BATCH_SIZE):
+            chunk = [pk for pk, _ in surplus[start:start + BATCH_SIZE]]
+            unit_costs.update(Product.objects.filter(pk__in=chunk).values_list('pk', 'average_cost'))
+        CostLayer.objects.bulk_create([
+            CostLayer(product_id=pk, received_at=now, unit_cost=unit_costs[pk], quantity_received=change,
+                      quantity_remaining=change)
+            for pk, change in surplus
+        ], batch_size=BATCH_SIZE)
+        shrinkage = [(pk, -change) for pk, change in variances if change < 0]
+        layered = set()
+        for start in range(0, len(shrinkage), BATCH_SIZE):
+            chunk = [pk for pk, _ in shrinkage[start:start + BATCH_SIZE]]
+            layered.update(CostLayer.objects.filter(product_id__in=chunk, quantity_remaining__gt=0)
+                           .values_list('product_id', flat=True).distinct())
+        # Only products that still have open layers need a per-product FIFO walk
+        consume_layers([Movement(pk, quantity) for pk, quantity in shrinkage if pk in layered])
+        dashboard_cache.invalidate('stock', 'recent_transactions')
+
+    stock_take.status = 'committed'
+    stock_take.committed_at = timezone.now()
+    stock_take.save(update_fields=['status', 'committed_at'])
+    return len(variances)
+
+
+def cancel(stock_take):
+    _check_open(stock_take)
+    stock_take.status = 'cancelled'
+    stock_take.save(update_fields=['status'])
@@ -0,0 +1,17 @@
+# inventory/templatetags/inventory_pagination.py
+
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def page_query(context, number):
+    """
+    Query string for page `number` that keeps the request's other GET parameters, built with
+    QueryDict.urlencode (as KeysetPaginationMixin builds its cursor links), so filter values
+    are encoded rather than written into the link raw.
+    """
+    params = context['request'].GET.copy()
+    params['page'] = number
+    return params.urlencode()
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import CancelledError, Future
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import brotli
+
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.apps import apps
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.db import connection, IntegrityError
+from django.db.models import F, Sum
+from django.forms import inlineformset_factory
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Product, Category, Supplier, Transaction, Receipt, ReceiptItem, Invoice, InvoiceItem, DailySummary, CostLayer,
+    StockTake,
+)
+from .forms import InvoiceItemFormSet, ProductFilterForm, StockCheckedLineFormSet
+from .services import decrement_stock, post_invoice_items, post_receipt_items, void_document, InsufficientStock
+from .utils import day_range
+from . import api, dashboard_cache, importer, pdf, pdf_cache, pdf_export, pdf_worker, search, stocktake
+
+
+def make_product(name='Widget', sku='W-1', quantity=10):
+    return Product.objects.create(
+        name=name, sku=sku, quantity=quantity,
+        unit_price=Decimal('5.00'), selling_price=Decimal('8.00'),
+    )
+
+
+def make_invoice(number='INV-TEST'):
+    return Invoice.objects.create(invoice_number=number, tax_rate=Decimal('0'), discount_rate=Decimal('0'))
+
+
+class StockDecrementTests(TestCase):
+
+    def test_decrement_uses_database_value_not_stale_instance(self):
+        product = make_product(quantity=5)
+        stale = Product.objects.get(pk=product.pk)
+        Product.objects.filter(pk=product.pk).update(quantity=1) # Another checkout sold 4
+        self.assertEqual(stale.quantity, 5)
+
+        with self.assertRaises(ValidationError):
+            stale.update_stock(-3)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 1)
+
+    def test_shortfall_is_reported_and_nothing_is_decremented(self):
+        ok = make_product(name='Plenty', sku='P-1', quantity=10)
+        short = make_product(name='Scarce', sku='S-1', quantity=2)
+
+        shortfalls = decrement_stock({ok.pk: 4, short.pk: 3})
+
+        self.assertEqual(shortfalls, [{
+            'product_id': short.pk, 'product_name': 'Scarce', 'requested': 3, 'available': 2,
+        }])
+        ok.refresh_from_db()
+        self.assertEqual(ok.quantity, 10)
+
+    def test_lines_for_same_product_are_checked_together(self):
+        product = make_product(quantity=5)
+        invoice = make_invoice()
+        lines = [
+            InvoiceItem(product=product, quantity=3, unit_price=Decimal('8.00')),
+            InvoiceItem(product=product, quantity=3, unit_price=Decimal('8.00')),
+        ]
+
+        with self.assertRaises(InsufficientStock) as cm:
+            post_invoice_items(invoice, lines)
+        self.assertEqual(cm.exception.shortfalls[0]['requested'], 6)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 5)
+        self.assertFalse(invoice.items.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+
+class BatchedPostingTests(TestCase):
+
+    def setUp(self):
+        self.a = make_product('Alpha', 'BP-A', quantity=100)
+        self.b = make_product('Beta', 'BP-B', quantity=100)
+
+    def post_invoice(self, number, lines_per_product):
+        invoice = make_invoice(number)
+        lines = [InvoiceItem(product=product, quantity=1, unit_price=Decimal('8.00'))
+                 for _ in range(lines_per_product) for product in (self.a, self.b)]
+        with CaptureQueriesContext(connection) as queries:
+            post_invoice_items(invoice, lines)
+        return invoice, len(queries)
+
+    def test_one_row_per_line_and_queries_per_product_not_per_line(self):
+        invoice, few = self.post_invoice('INV-2', 1)
+        _, many = self.post_invoice('INV-40', 20)
+        self.assertEqual(few, many)
+        self.assertEqual(invoice.items.count(), 2)
+        self.assertEqual(Transaction.objects.filter(invoice=invoice, transaction_type='OUT').count(), 2)
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.quantity, 79)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('16.00'))
+
+        receipt = Receipt.objects.create(receipt_number='REC-BP')
+        post_receipt_items(receipt, [ReceiptItem(product=self.a, quantity=5, unit_price=Decimal('4.00')),
+                                     ReceiptItem(product=self.a, quantity=5, unit_price=Decimal('6.00'))])
+        self.assertEqual(Transaction.objects.filter(receipt=receipt).count(), 2)
+        self.assertEqual(CostLayer.objects.filter(receipt_item__receipt=receipt).count(), 2)
+        self.a.refresh_from_db()
+        receipt.refresh_from_db()
+        self.assertEqual((self.a.quantity, receipt.total_amount), (89, Decimal('50.00')))
+
+    def test_admin_invoice_with_a_short_line_saves_nothing(self):
+        self.client.force_login(User.objects.create_superuser('root', password='x'))
+        invoice = make_invoice()
+        line, = post_invoice_items(invoice, [InvoiceItem(product=self.a, quantity=2, unit_price=Decimal('8.00'))])
+        data = {
+            'invoice_number': invoice.invoice_number, 'sale_date': timezone.localdate(), 'tax_rate': '0', 'discount_rate': '0',
+            'items-TOTAL_FORMS': '2', 'items-INITIAL_FORMS': '1', 'items-0-id': line.pk, 'items-0-invoice': invoice.pk,
+            'items-0-product': self.a.pk, 'items-0-quantity': '5', 'items-0-unit_price': '8.00',
+            'items-1-product': self.b.pk, 'items-1-quantity': '101', 'items-1-unit_price': '8.00',
+        }
+        change_url = reverse('admin:inventory_invoice_change', args=[invoice.pk])
+        response = self.client.post(change_url, data)
+        self.assertContains(response, "Available: 100, Requested in total: 101")
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertEqual((self.a.quantity, self.b.quantity), (98, 100))
+        self.assertEqual(list(invoice.items.values_list('quantity', flat=True)), [2])
+
+        # Once every line is covered the edit posts only the net change
+        data['items-1-quantity'] = '1'
+        self.assertEqual(self.client.post(change_url, data).status_code, 302)
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertEqual((self.a.quantity, self.b.quantity), (95, 99))
+        self.assertEqual(Transaction.objects.filter(invoice=invoice).count(), 3)
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+
+    def setUp(self):
+        # SQLite never reports multiple connections as supported, but its file test database (TEST NAME) allows them
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Parallel checkouts need a file-backed test database")
+
+    def test_parallel_invoices_never_oversell(self):
+        out = StringIO()
+        call_command('checkout_stress', workers=8, invoices=60, stock=25, stdout=out)
+        self.assertIn('sold=25 closing stock=0', out.getvalue())
+
+
+class ReportIndexTests(TestCase):
+    """EXPLAIN-based checks that the report access paths stay on their indexes."""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+        self.start, self.end = day_range(date(2025, 1, 1), date(2025, 1, 31))
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, msg=plan)
+
+    def test_day_range_is_half_open(self):
+        product = make_product()
+        last_moment = self.end - timedelta(microseconds=1)
+        Transaction.objects.bulk_create([
+            Transaction(product=product, transaction_type='IN', quantity=1, timestamp=self.start),
+            Transaction(product=product, transaction_type='IN', quantity=1, timestamp=last_moment),
+            Transaction(product=product, transaction_type='IN', quantity=1, timestamp=self.end),
+        ])
+        in_range = Transaction.objects.filter(timestamp__gte=self.start, timestamp__lt=self.end)
+        self.assertEqual(in_range.count(), 2)
+        self.assertTrue(timezone.is_aware(self.start))
+
+    def test_transaction_date_range_uses_timestamp_index(self):
+        qs = Transaction.objects.filter(timestamp__gte=self.start, timestamp__lt=self.end).order_by('timestamp')
+        self.assertUsesIndex(qs, 'txn_timestamp_idx')
+
+    def test_product_history_uses_product_timestamp_index(self):
+        product = make_product()
+        qs = Transaction.objects.filter(product=product).order_by('-timestamp')[:10]
+        self.assertUsesIndex(qs, 'txn_product_timestamp_idx')
+
+    def test_invoice_date_filter_uses_sale_date_index(self):
+        qs = Invoice.objects.filter(sale_date__gte=self.start.date(), sale_date__lte=self.end.date())
+        self.assertUsesIndex(qs, 'invoice_sale_date_idx')
+
+    def test_receipt_date_filter_uses_purchase_date_index(self):
+        qs = Receipt.objects.filter(purchase_date__gte=self.start.date(), purchase_date__lte=self.end.date())
+        self.assertUsesIndex(qs, 'receipt_purchase_date_idx')
+
+    def test_posted_invoice_date_filter_uses_status_date_index(self):
+        qs = Invoice.objects.filter(status='posted', sale_date__gte=self.start.date(), sale_date__lte=self.end.date())
+        self.assertUsesIndex(qs, 'invoice_status_date_idx')
+
+    def test_invoice_item_aggregate_uses_covering_index(self):
+        invoice = make_invoice()
+        qs = InvoiceItem.objects.filter(invoice=invoice).values('product').annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum(F('quantity') * F('unit_price'))
+        )
+        self.assertUsesIndex(qs, 'invoiceitem_covering_idx')
+
+    def test_low_stock_lookup_uses_partial_index(self):
+        self.assertUsesIndex(Product.objects.filter(is_low_stock=True).values('pk'), 'product_low_stock_idx')
+
+
+class DailySummaryTests(TestCase):
+
+    def test_summary_follows_posting_edit_and_delete(self):
+        product = make_product(quantity=50)
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=product, quantity=2, unit_price=Decimal('8.00'))])
+        receipt = Receipt.objects.create(receipt_number='REC-TEST')
+        post_receipt_items(receipt, [ReceiptItem(product=product, quantity=3, unit_price=Decimal('5.00'))])
+
+        today = DailySummary.objects.get(date=invoice.sale_date)
+        self.assertEqual((today.sales_total, today.invoice_count), (Decimal('16.00'), 1))
+        self.assertEqual((today.purchase_total, today.receipt_count), (Decimal('15.00'), 1))
+
+        # Moving the invoice to another day moves its contribution
+        invoice.sale_date = date(2025, 1, 5)
+        invoice.save()
+        self.assertEqual(DailySummary.for_date(today.date).invoice_count, 0)
+        self.assertEqual(DailySummary.for_date(date(2025, 1, 5)).sales_total, Decimal('16.00'))
+        call_command('rebuild_daily_summary', verify=True, stdout=StringIO())
+
+        invoice.delete()
+        receipt.delete()
+        self.assertEqual(DailySummary.for_date(date(2025, 1, 5)).sales_total, Decimal('0.00'))
+        self.assertEqual(DailySummary.for_date(today.date).receipt_count, 0)
+        call_command('rebuild_daily_summary', verify=True, stdout=StringIO())
+
+
+class FifoCostTests(TestCase):
+
+    def receive(self, product, number, quantity, unit_cost):
+        receipt = Receipt.objects.create(receipt_number=number)
+        post_receipt_items(receipt, [ReceiptItem(product=product, quantity=quantity, unit_price=Decimal(unit_cost))])
+
+    def test_sales_consume_oldest_layers_first(self):
+        product = make_product(quantity=0)
+        self.receive(product, 'REC-1', 5, '2.00')
+        self.receive(product, 'REC-2', 5, '3.00')
+        invoice = make_invoice()
+        post_invoice_items(invoice, [
+            InvoiceItem(product=product, quantity=4, unit_price=Decimal('8.00')),
+            InvoiceItem(product=product, quantity=3, unit_price=Decimal('8.00')), # 1 @ 2.00 + 2 @ 3.00
+        ])
+
+        self.assertEqual(list(invoice.items.order_by('id').values_list('cogs', flat=True)), [Decimal('8.00'), Decimal('8.00')])
+        self.assertEqual(list(CostLayer.objects.values_list('quantity_remaining', flat=True)), [0, 3])
+
+        # Replaying the ledger reproduces the same layers and costs
+        call_command('rebuild_cost_layers', chunk_size=2, stdout=StringIO())
+        self.assertEqual(list(invoice.items.order_by('id').values_list('cogs', flat=True)), [Decimal('8.00'), Decimal('8.00')])
+        self.assertEqual(list(CostLayer.objects.values_list('quantity_remaining', flat=True)), [0, 3])
+
+    def test_sales_cost_opening_stock_before_received_stock(self):
+        product = make_product(quantity=10) # Opening stock is the oldest layer, at unit_price 5.00
+        self.receive(product, 'REC-1', 10, '20.00')
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=product, quantity=5, unit_price=Decimal('30.00'))])
+        self.assertEqual(invoice.items.get().cogs, Decimal('25.00'))
+
+        # Manual movements go through the same layers: a stock-out takes the next opening units
+        # and returned stock opens a layer of its own, at the average cost it was valued at
+        Transaction.objects.create(product=product, transaction_type='OUT', quantity=6)
+        Transaction.objects.create(product=product, transaction_type='ADJ', quantity=2)
+        self.assertEqual(list(CostLayer.objects.filter(product=product).order_by('received_at', 'id').values_list(
+            'unit_cost', 'quantity_remaining')), [(Decimal('5.00'), 0), (Decimal('20.00'), 9), (Decimal('12.50'), 2)])
+
+        call_command('rebuild_cost_layers', stdout=StringIO())
+        self.assertEqual(invoice.items.get().cogs, Decimal('25.00'))
+        self.assertEqual(sum(CostLayer.objects.values_list('quantity_remaining', flat=True)), 11)
+
+    def test_layers_are_paged_in_receipt_order(self):
+        product = make_product(quantity=0)
+        for number in range(5):
+            self.receive(product, f'REC-{number}', 1, f'{number + 1}.00')
+        invoice = make_invoice()
+        with mock.patch('inventory.costing.LAYER_FETCH_SIZE', 2):
+            post_invoice_items(invoice, [InvoiceItem(product=product, quantity=4, unit_price=Decimal('8.00'))])
+        self.assertEqual(invoice.items.get().cogs, Decimal('10.00')) # 1 + 2 + 3 + 4
+        self.assertEqual(list(CostLayer.objects.values_list('quantity_remaining', flat=True)), [0, 0, 0, 0, 1])
+
+    def test_single_line_saves_keep_layers_in_step(self):
+        product = make_product(quantity=0)
+        receipt = Receipt.objects.create(receipt_number='REC-1')
+        ReceiptItem.objects.create(receipt=receipt, product=product, quantity=4, unit_price=Decimal('3.00'))
+        self.assertEqual(CostLayer.objects.get().receipt_item.receipt, receipt)
+        item = InvoiceItem.objects.create(invoice=make_invoice(), product=product, quantity=3, unit_price=Decimal('8.00'))
+        self.assertEqual(item.cogs, Decimal('9.00'))
+        self.assertEqual(CostLayer.objects.get().quantity_remaining, 1)
+
+    def test_stock_without_layers_is_costed_at_unit_price(self):
+        product = make_product(quantity=3)
+        CostLayer.objects.filter(product=product).delete() # Predates cost tracking: no layers
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=product, quantity=2, unit_price=Decimal('8.00'))])
+        self.assertEqual(invoice.items.get().cogs, Decimal('10.00'))
+
+
+class AverageCostTests(TestCase):
+
+    def test_receipts_move_the_average_and_sales_use_it(self):
+        product = make_product(quantity=10) # Opening stock valued at unit_price 5.00
+        receipt = Receipt.objects.create(receipt_number='REC-AVG')
+        post_receipt_items(receipt, [ReceiptItem(product=product, quantity=10, unit_price=Decimal('7.00'))])
+        product.refresh_from_db()
+        self.assertEqual((product.average_cost, product.stock_value), (Decimal('6.0000'), Decimal('120.00')))
+
+        post_invoice_items(make_invoice(), [InvoiceItem(product=product, quantity=5, unit_price=Decimal('8.00'))])
+        product.refresh_from_db()
+        self.assertEqual((product.average_cost, product.stock_value), (Decimal('6.0000'), Decimal('90.00')))
+        call_command('verify_average_cost', stdout=StringIO())
+
+        # Drift is detected and corrected from the ledger
+        Product.objects.filter(pk=product.pk).update(stock_value=Decimal('1.00'))
+        with self.assertRaises(CommandError):
+            call_command('verify_average_cost', stdout=StringIO())
+        call_command('verify_average_cost', fix=True, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.stock_value, Decimal('90.00'))
+
+
+class ProfitReportTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('analyst', password='x', is_staff=True))
+        self.tools, self.garden = Category.objects.create(name='Tools'), Category.objects.create(name='Garden')
+        self.a = make_product('Alpha', 'PR-A')
+        self.b = make_product('Beta', 'PR-B')
+        Product.objects.filter(pk=self.a.pk).update(category=self.tools)
+        Product.objects.filter(pk=self.b.pk).update(category=self.garden)
+
+    def sell(self, number, day, *lines):
+        invoice = Invoice.objects.create(invoice_number=number, sale_date=day, tax_rate=Decimal('0'), discount_rate=Decimal('0'))
+        post_invoice_items(invoice, [InvoiceItem(product=product, quantity=quantity, unit_price=Decimal(price))
+                                     for product, quantity, price in lines])
+        return invoice
+
+    def test_totals_and_breakdowns_are_aggregated_per_group(self):
+        self.sell('INV-1', date(2025, 1, 10), (self.a, 2, '8.00')) # Revenue 16, cost 2 x 5.00
+        second = self.sell('INV-2', date(2025, 1, 11), (self.b, 3, '9.00'), (self.a, 1, '8.00'))
+        second.items.filter(product=self.a).update(cogs=None) # Posted before cost tracking: unit_price
+        void_document(self.sell('INV-3', date(2025, 1, 10), (self.a, 1, '8.00')))
+
+        with mock.patch('inventory.views.ProfitReportView.lines_per_page', 2):
+            response = self.client.get(reverse('profit-report'), {
+                'start_date': '2025-01-01', 'end_date': '2025-01-31', 'q': 'a b&c',
+            })
+        context = response.context
+        self.assertEqual((context['total_revenue'], context['total_cogs'], context['total_profit']),
+                         (Decimal('51.00'), Decimal('30.00'), Decimal('21.00')))
+        self.assertEqual([(row['product__sku'], row['quantity_sold'], row['profit']) for row in context['profit_by_product']],
+                         [('PR-B', 3, Decimal('12.00')), ('PR-A', 3, Decimal('9.00'))])
+        self.assertEqual([(row['product__category__name'], row['profit']) for row in context['profit_by_category']],
+                         [('Garden', Decimal('12.00')), ('Tools', Decimal('9.00'))])
+        self.assertEqual([(row['invoice__sale_date'], row['revenue'], row['cogs']) for row in context['profit_by_day']],
+                         [(date(2025, 1, 10), Decimal('16.00'), Decimal('10.00')),
+                          (date(2025, 1, 11), Decimal('35.00'), Decimal('20.00'))])
+
+        # Three lines over two pages; the page links carry the other parameters urlencoded
+        self.assertEqual(len(context['items_sold']), 2)
+        self.assertContains(response, 'href="?start_date=2025-01-01&amp;end_date=2025-01-31&amp;q=a+b%26c&amp;page=2"')
+        content = response.content.decode()
+        self.assertEqual(content.count('<nav'), content.count('</nav>'))
+
+
+class PdfJobTests(TestCase):
+
+    def setUp(self):
+        self.job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.job_dir.cleanup)
+        self.settings_override = override_settings(PDF_JOB_DIR=self.job_dir.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_queue_is_bounded(self):
+        with override_settings(PDF_QUEUE_SIZE=0), self.assertRaises(pdf.PdfQueueFull):
+            pdf.submit('<p>x</p>', '/', 'x.pdf')
+        self.assertEqual(pdf.metrics()['queue_depth'], 0)
+
+    def test_job_cancelled_by_a_pool_reset_fails_and_frees_its_place(self):
+        queued = Future() # Still waiting for a worker when the pool is shut down
+        depth = pdf.metrics()['queue_depth']
+        with mock.patch('inventory.pdf._submit_to_pool', return_value=queued):
+            job_id, _ = pdf.submit('<p>x</p>', '/', 'x.pdf')
+        self.assertEqual(pdf.metrics()['queue_depth'], depth + 1)
+        queued.cancel()
+        self.assertEqual(pdf.metrics()['queue_depth'], depth)
+        self.assertEqual(pdf.job_status(job_id)[0], 'failed')
+
+    def test_job_state_is_read_from_disk(self):
+        job_id = 'a' * 32
+        with open(os.path.join(self.job_dir.name, f"{job_id}.json"), 'w') as f:
+            json.dump({'filename': 'x.pdf', 'user_id': None, 'fallback_url': '/'}, f)
+        self.assertEqual(pdf.job_status(job_id)[0], 'pending')
+        open(pdf.pdf_path(job_id), 'wb').close()
+        self.assertEqual(pdf.job_status(job_id)[0], 'ready')
+        self.assertEqual(pdf.job_status('../' + 'a' * 29), (None, None))
+
+
+class PdfCacheTests(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(PDF_CACHE_DIR=cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(User.objects.create_user('clerk'))
+        self.invoice = make_invoice()
+        rendered = os.path.join(cache_dir.name, 'rendered.pdf')
+        with open(rendered, 'wb') as f:
+            f.write(b'%PDF-1.4')
+        self.key = pdf_cache.cache_key('invoice', self.invoice.pk, self.invoice.updated_at)
+        pdf_cache.store('invoice', self.invoice.pk, self.key, rendered)
+
+    def test_cached_pdf_supports_conditional_get(self):
+        url = f'/invoices/{self.invoice.pk}/pdf/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{self.key}"')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_pdf_is_the_same_for_every_viewer(self):
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+
+        def render_html(html_string, base_url, path):
+            with open(path, 'w') as f: # The rendered HTML stands in for the PDF bytes
+                f.write(html_string)
+            return 0.0
+
+        invoice = make_invoice('INV-SHARED')
+        url = f'/invoices/{invoice.pk}/pdf/'
+        pdf._reset_pool()
+        self.addCleanup(pdf._reset_pool)
+        bodies = []
+        with override_settings(PDF_WORKERS=0, PDF_JOB_DIR=job_dir.name), \
+                mock.patch('inventory.views.HTML', object()), \
+                mock.patch('inventory.pdf_worker.render_to_file', render_html):
+            for username in ('alice', 'bob'):
+                self.client.force_login(User.objects.create_user(username))
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                bodies.append(b''.join(response.streaming_content))
+        self.assertEqual(bodies[0], bodies[1]) # Bob is served Alice's cached render...
+        self.assertNotIn(b'alice', bodies[1]) # ...which names neither viewer
+        self.assertIn(b'INV-SHARED', bodies[1])
+
+    def test_redirect_carries_no_validators(self):
+        invoice = make_invoice('INV-MISS')
+        with mock.patch('inventory.views.HTML', None): # Cache miss without WeasyPrint redirects back
+            response = self.client.get(f'/invoices/{invoice.pk}/pdf/')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_editing_the_document_invalidates_its_pdf(self):
+        post_invoice_items(self.invoice, [InvoiceItem(product=make_product(), quantity=1, unit_price=Decimal('8.00'))])
+        self.assertIsNone(pdf_cache.get('invoice', self.invoice.pk, self.key))
+        self.assertNotEqual(pdf_cache.cache_key('invoice', self.invoice.pk, self.invoice.updated_at), self.key)
+
+
+class PdfExportTests(TestCase):
+
+    def test_zip_is_streamed_per_document_and_lists_failures(self):
+        pdfs = [('invoice_1.pdf', b'%PDF-1', None), ('invoice_2.pdf', None, RuntimeError('boom')), ('invoice_3.pdf', b'%PDF-3', None)]
+        progress = []
+        chunks = list(pdf_export.zip_stream(iter(pdfs), total=3, progress=lambda done, total: progress.append(done)))
+
+        self.assertEqual(progress, [1, 2, 3])
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 2) # Written out as documents complete
+        archive = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.namelist(), ['invoice_1.pdf', 'invoice_3.pdf', 'errors.txt'])
+        self.assertEqual(archive.read('invoice_3.pdf'), b'%PDF-3')
+        self.assertIn('invoice_2.pdf: boom', archive.read('errors.txt').decode())
+
+    def test_cancelled_renders_are_listed_as_failures(self):
+        make_invoice('INV-CX1')
+        cancelled = Future()
+        cancelled.cancel() # Dropped by a pool reset before a worker took it
+        pool = mock.Mock()
+        pool.submit.return_value = cancelled
+        today = timezone.localdate()
+        (filename, data, error), = pdf_export.iter_pdfs('invoice', today, today, pool, max_in_flight=2)
+        self.assertEqual((filename, data), ('invoice_INV-CX1.pdf', None))
+        self.assertIsInstance(error, CancelledError)
+
+    def test_web_exports_render_through_the_bounded_queue(self):
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        for number in ('INV-EX1', 'INV-EX2', 'INV-EX3'):
+            make_invoice(number)
+        void_document(make_invoice('INV-VOID')) # Left out of the export
+        today = timezone.localdate()
+        pdf._reset_pool()
+        self.addCleanup(pdf._reset_pool)
+
+        def render_merged(html_strings, base_url, path):
+            with open(path, 'w') as f:
+                f.write(''.join(html_strings))
+            return 0.0
+
+        with override_settings(PDF_WORKERS=0, PDF_QUEUE_SIZE=1, PDF_JOB_DIR=job_dir.name), \
+                mock.patch('inventory.pdf_worker.render_bytes', lambda html_string, base_url: b'%PDF'), \
+                mock.patch('inventory.pdf_worker.render_merged', render_merged), \
+                mock.patch('inventory.views.HTML', object()):
+            pdfs = list(pdf_export.iter_pdfs('invoice', today, today, pdf.QueuedPool(), max_in_flight=3))
+            self.assertEqual(sorted(filename for filename, _, _ in pdfs),
+                             ['invoice_INV-EX1.pdf', 'invoice_INV-EX2.pdf', 'invoice_INV-EX3.pdf'])
+            self.assertEqual(pdf.metrics()['queue_depth'], 0)
+
+            # The merged PDF is a queued job; with the queue full the request is turned away, not blocked
+            self.client.force_login(User.objects.create_user('exporter', password='x', is_staff=True))
+            data = {'document_type': 'invoice', 'output_format': 'pdf', 'start_date': today, 'end_date': today}
+            response = self.client.post(reverse('pdf-export'), data)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'INV-EX3', b''.join(response.streaming_content))
+            with override_settings(PDF_QUEUE_SIZE=0):
+                self.assertRedirects(self.client.post(reverse('pdf-export'), data), reverse('pdf-export'))
+                with self.assertRaises(pdf.PdfQueueFull):
+                    pdf.QueuedPool().submit(pdf_worker.render_bytes, '<p>x</p>', None)
+
+
+class DashboardCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_steady_state_needs_no_queries_and_writes_invalidate(self):
+        product = make_product(quantity=20)
+        self.assertEqual(dashboard_cache.dashboard_values()['total_products'], 1)
+        with self.assertNumQueries(0):
+            dashboard_cache.dashboard_values()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post_invoice_items(make_invoice(), [InvoiceItem(product=product, quantity=15, unit_price=Decimal('8.00'))])
+        values = dashboard_cache.dashboard_values()
+        self.assertEqual(values['low_stock_products'], 1)
+        self.assertEqual(values['todays_total_sales'], Decimal('120.00'))
+        self.assertEqual(len(values['recent_transactions']), 1)
+        self.assertEqual(values['total_products'], 1) # Untouched section still cached
+
+
+class LowStockFlagTests(TestCase):
+
+    def assertLowStock(self, product, expected):
+        product.refresh_from_db()
+        self.assertIs(product.is_low_stock, expected)
+
+    def test_flag_follows_every_stock_path(self):
+        product = make_product(quantity=12) # reorder_level defaults to 10
+        self.assertLowStock(product, False)
+
+        post_invoice_items(make_invoice(), [InvoiceItem(product=product, quantity=2, unit_price=Decimal('8.00'))])
+        self.assertLowStock(product, True) # 10 <= 10
+
+        receipt = Receipt.objects.create(receipt_number='REC-LOW')
+        post_receipt_items(receipt, [ReceiptItem(product=product, quantity=1, unit_price=Decimal('5.00'))])
+        self.assertLowStock(product, False)
+
+        product.update_stock(-1)
+        self.assertLowStock(product, True)
+
+        product.reorder_level = 5
+        product.save()
+        self.assertLowStock(product, False)
+
+    def test_catalog_edit_keeps_stock_posted_since_the_product_was_loaded(self):
+        product = make_product(quantity=12)
+        stale = Product.objects.get(pk=product.pk)
+        product.update_stock(5) # Posted while the edit is in flight
+        self.client.force_login(User.objects.create_user('buyer', password='x', is_staff=True))
+        data = {'name': 'Renamed', 'sku': product.sku, 'unit_price': '5.00', 'selling_price': '8.00', 'reorder_level': 16}
+        with mock.patch('inventory.views.ProductUpdateView.get_object', return_value=stale):
+            self.client.post(reverse('product-edit', args=[product.pk]), data)
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.quantity, product.stock_value), ('Renamed', 17, Decimal('85.00')))
+        self.assertLowStock(product, False) # 17 > 16, though the loaded 12 was not
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        if not search.fts_available():
+            self.skipTest("FTS5 search index not available on this database")
+
+    def names(self, query):
+        return [product.name for product in search.search_products(Product.objects.all(), query)]
+
+    def test_prefix_matches_are_ranked_and_index_follows_changes(self):
+        tools = Category.objects.create(name='Hand Tools')
+        spanner = make_product(name='Spanner', sku='SP-1')
+        spanner.description = 'Fits a wrench set'
+        spanner.save()
+        wrench = make_product(name='Wrench', sku='WR-1')
+        wrench.category = tools
+        wrench.save()
+
+        self.assertEqual(self.names('wren'), ['Wrench', 'Spanner']) # Name match outranks description
+        self.assertEqual(self.names('hand too'), ['Wrench'])
+        self.assertEqual(self.names('"wren* -'), ['Wrench', 'Spanner']) # FTS5 syntax in input is plain text
+
+        tools.name = 'Garage'
+        tools.save()
+        self.assertEqual(self.names('garage'), ['Wrench'])
+        wrench.delete()
+        self.assertEqual(self.names('wren'), ['Spanner'])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='x')
+        self.client.force_login(self.user)
+        product = make_product()
+        stamp = timezone.now()
+        # Pairs of rows share a timestamp, so pages must break ties on id
+        Transaction.objects.bulk_create([
+            Transaction(product=product, transaction_type='IN', quantity=1, timestamp=stamp - timedelta(minutes=i // 2))
+            for i in range(60)
+        ])
+
+    def page(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{reverse('transaction-list')}?{query}")
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+        return response.context['page_obj']
+
+    def test_pages_walk_forward_and_back_without_gaps_or_count(self):
+        seen, pages = [], []
+        page = self.page()
+        while True:
+            pages.append([t.pk for t in page])
+            seen.extend(pages[-1])
+            if not page.has_next():
+                break
+            page = self.page(page.next_query)
+        expected = list(Transaction.objects.order_by('-timestamp', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(ids) for ids in pages], [25, 25, 10])
+
+        back = self.page(page.previous_query)
+        self.assertEqual([t.pk for t in back], pages[1])
+        self.assertTrue(back.has_previous())
+        self.assertEqual(self.page('cursor=forged').has_previous(), False) # Bad cursors restart at page one
+
+
+class DataExportTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product()
+        invoice = make_invoice('INV-EXP')
+        post_invoice_items(invoice, [InvoiceItem(product=self.product, quantity=2, unit_price=Decimal('8.00'))])
+        self.client.force_login(User.objects.create_user('accounts', password='x', is_staff=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse('data-export'), params, HTTP_ACCEPT_ENCODING=params.pop('encoding', ''))
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_and_ndjson_stream_with_negotiated_compression(self):
+        response, body = self.export(dataset='invoice_items', file_format='csv')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'id,invoice_number,sale_date,status,sku,product,quantity,unit_price,cogs')
+        self.assertIn('INV-EXP,', lines[1])
+        self.assertIn(',posted,', lines[1])
+
+        response, body = self.export(dataset='transactions', file_format='ndjson', product=self.product.pk, encoding='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        row = json.loads(brotli.decompress(body))
+        self.assertEqual((row['type'], row['sku'], row['quantity']), ('OUT', 'W-1', 2))
+
+        response, body = self.export(dataset='transactions', file_format='csv', encoding='gzip',
+                                     start_date=(timezone.now().date() + timedelta(days=1)).isoformat())
+        self.assertEqual(gzip.decompress(body).decode().splitlines(), ['id,timestamp,type,sku,product,quantity,user,receipt_number,invoice_number,notes'])
+
+
+class CatalogImportTests(TestCase):
+
+    def test_upsert_resolves_names_posts_opening_stock_and_reports_bad_rows(self):
+        existing = make_product(sku='W-1', quantity=3)
+        rows = (
+            "sku,name,unit_price,selling_price,category,supplier,opening_stock\n"
+            "W-1,Widget Mk2,5.00,9.00,Tools,Acme,7\n"
+            "B-1,Bolt,0.10,0.25,Tools,Acme,40\n"
+            "N-1,Nut,abc,0.20,Hardware,,5\n"
+            "B-1,Bolt again,0.10,0.25,,,1\n"
+            "S-1,Screw,0.05,0.15,,Acme,\n"
+        )
+        result = importer.import_csv('products', StringIO(rows))
+
+        self.assertEqual((result['created'], result['updated'], result['opening_stock']), (2, 1, 40))
+        self.assertEqual([line for line, _ in result['errors']], [2, 4, 5]) # Existing SKU stock, bad price, duplicate
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.quantity, existing.selling_price), ('Widget Mk2', 3, Decimal('9.00')))
+        bolt = Product.objects.select_related('category', 'supplier').get(sku='B-1')
+        self.assertEqual((bolt.category.name, bolt.supplier.name, bolt.quantity, bolt.stock_value), ('Tools', 'Acme', 40, Decimal('4.00')))
+        self.assertFalse(bolt.is_low_stock)
+        self.assertEqual(Transaction.objects.get(product=bolt).transaction_type, 'ADJ')
+        self.assertEqual(list(CostLayer.objects.filter(product=bolt).values_list('unit_cost', 'quantity_remaining')),
+                         [(Decimal('0.10'), 40)])
+        self.assertFalse(Category.objects.filter(name='Hardware').exists()) # Only valid rows create names
+
+        # The opening layer costs the first sales
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=bolt, quantity=10, unit_price=Decimal('0.25'))])
+        self.assertEqual(invoice.items.get().cogs, Decimal('1.00'))
+
+    def test_blank_cells_keep_stored_values_on_update(self):
+        header = "sku,name,unit_price,selling_price,category,supplier,reorder_level\n"
+        importer.import_csv('products', StringIO(header + "K-1,Kettle,5.00,9.00,Kitchen,Acme,3\n"))
+        importer.import_csv('products', StringIO(header + "K-1,Kettle Mk2,5.00,9.50,,,\nT-1,Toaster,6.00,11.00,,,\n"))
+
+        kettle = Product.objects.select_related('category', 'supplier').get(sku='K-1')
+        self.assertEqual((kettle.name, kettle.selling_price, kettle.category.name, kettle.supplier.name, kettle.reorder_level),
+                         ('Kettle Mk2', Decimal('9.50'), 'Kitchen', 'Acme', 3))
+        toaster = Product.objects.get(sku='T-1') # New rows take the field defaults
+        self.assertEqual((toaster.category_id, toaster.supplier_id, toaster.reorder_level), (None, None, 10))
+
+    def test_missing_column_and_dry_run(self):
+        with self.assertRaises(ValidationError):
+            importer.import_csv('products', StringIO("sku,name\nA,B\n"))
+        result = importer.import_csv('suppliers', StringIO("name,email\nAcme,bad-address\nZeta,z@example.com\n"), dry_run=True)
+        self.assertEqual((result['created'], len(result['errors'])), (1, 1))
+        self.assertFalse(Supplier.objects.exists())
+
+
+class StockTakeTests(TestCase):
+
+    def test_commit_applies_variances_as_signed_adjustments(self):
+        short, extra, exact = make_product('Short', 'S-1', 10), make_product('Extra', 'E-1', 4), make_product('Exact', 'X-1', 7)
+        receipt = Receipt.objects.create(receipt_number='REC-ST')
+        post_receipt_items(receipt, [ReceiptItem(product=short, quantity=5, unit_price=Decimal('6.00'))])
+        session = StockTake.objects.create()
+
+        stocktake.record_scan(session, 'E-1', 3)
+        stocktake.record_scan(session, 'E-1', 3)
+        recorded, errors = stocktake.import_counts(session, StringIO("sku,counted_quantity\nS-1,12\nX-1,7\nNOPE,1\nX-1,x\n"))
+        self.assertEqual((recorded, [line for line, _ in errors]), (2, [4, 5]))
+        # A sale after the count is kept: only the counted variance is applied
+        post_invoice_items(make_invoice(), [InvoiceItem(product=short, quantity=2, unit_price=Decimal('8.00'))])
+
+        self.assertEqual(stocktake.commit(session), 2)
+        for product, quantity in ((short, 10), (extra, 6), (exact, 7)):
+            product.refresh_from_db()
+            self.assertEqual(product.quantity, quantity)
+        self.assertEqual(
+            sorted(Transaction.objects.filter(transaction_type='ADJ').values_list('product__sku', 'quantity')),
+            [('E-1', 2), ('S-1', -3)],
+        )
+        self.assertEqual(CostLayer.objects.filter(product=extra, quantity_remaining=2).count(), 1)
+        with self.assertRaises(ValidationError):
+            stocktake.record_scan(session, 'E-1')
+
+    def test_clamped_shrinkage_records_the_change_applied(self):
+        product = make_product('Shelf', 'SH-1', 5)
+        session = StockTake.objects.create()
+        stocktake.record_scan(session, 'SH-1', 1) # 4 missing
+        post_invoice_items(make_invoice(), [InvoiceItem(product=product, quantity=3, unit_price=Decimal('8.00'))])
+
+        self.assertEqual(stocktake.commit(session), 1)
+        product.refresh_from_db()
+        self.assertEqual((product.quantity, product.stock_value), (0, Decimal('0')))
+        self.assertEqual(Transaction.objects.get(transaction_type='ADJ').quantity, -2) # Only 2 were left to remove
+        call_command('verify_average_cost', stdout=StringIO())
+
+    def test_only_adjustments_may_be_negative(self):
+        with self.assertRaises(IntegrityError):
+            Transaction.objects.bulk_create([Transaction(product=make_product(), transaction_type='OUT', quantity=-1)])
+
+
+class ProductApiTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('pos', password='x'))
+        self.products = [make_product(f'Item {i}', f'API-{i}', quantity=i) for i in range(5)]
+
+    def test_fields_filters_and_keyset_pages(self):
+        response = self.client.get(reverse('api-stock'), {'fields': 'sku,quantity', 'limit': 2})
+        data = response.json()
+        self.assertEqual(data['results'], [{'sku': 'API-0', 'quantity': 0}, {'sku': 'API-1', 'quantity': 1}])
+        skus = [row['sku'] for row in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            skus += [row['sku'] for row in data['results']]
+        self.assertEqual(skus, [f'API-{i}' for i in range(5)])
+
+        self.assertEqual(self.client.get(reverse('api-products'), {'fields': 'cost'}).status_code, 400)
+        low = self.client.get(reverse('api-products'), {'low_stock': '1', 'fields': 'sku'}).json()['results']
+        self.assertEqual(len(low), 5) # All below the default reorder level of 10
+
+    def test_conditional_get_answers_304_until_something_changes(self):
+        url = reverse('api-products')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(3): # Session, user, version aggregate
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.products[0].update_stock(3)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        detail = self.client.get(reverse('api-product-detail', args=[self.products[0].pk]))
+        self.assertEqual(detail.json()['quantity'], 3)
+        self.assertEqual(self.client.get(reverse('api-product-detail', args=[self.products[0].pk]),
+                                         HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+
+
+class StockAvailabilityTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('sync', password='x'))
+        for i in range(3):
+            make_product(f'Item {i}', f'AV-{i}', quantity=i * 20)
+
+    def post(self, skus):
+        return self.client.post(reverse('api-stock-availability'), json.dumps({'skus': skus}),
+                                content_type='application/json')
+
+    def test_streams_rows_in_request_order_and_lists_unknown_skus(self):
+        with self.assertNumQueries(3): # Session, user, one chunk of SKUs
+            response = self.post(['AV-2', 'NOPE', 'AV-0', 'AV-2'])
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['missing'], ['NOPE'])
+        self.assertEqual([(row['sku'], row['quantity'], row['is_low_stock']) for row in data['results']],
+                         [('AV-2', 40, False), ('AV-0', 0, True)])
+        self.assertEqual(data['results'][0]['selling_price'], '8.00')
+
+    def test_large_lists_are_chunked_and_capped(self):
+        skus = [f'AV-{i}' for i in range(1200)]
+        with self.assertNumQueries(5): # Session, user, three chunks
+            data = json.loads(b''.join(self.post(skus).streaming_content))
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(len(data['missing']), 1197)
+        self.assertEqual(self.post([f'X-{i}' for i in range(api.MAX_SKUS + 1)]).status_code, 400)
+        self.assertEqual(self.client.post(reverse('api-stock-availability'), 'nope',
+                                          content_type='application/json').status_code, 400)
+
+
+class PosCheckoutTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('till', password='x', is_staff=True))
+        self.apple = make_product('Apple', 'POS-A', quantity=10)
+        self.pear = make_product('Pear', 'POS-P', quantity=1)
+
+    def checkout(self, items, **extra):
+        return self.client.post(reverse('api-pos-checkout'), json.dumps({'items': items, **extra}),
+                                content_type='application/json')
+
+    def test_cart_is_posted_as_an_invoice_with_totals(self):
+        response = self.checkout([{'sku': 'POS-A', 'quantity': 3}, {'sku': 'POS-P', 'quantity': 1}],
+                                 tax_rate='10', discount_rate=5)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['sub_total'], data['discount_amount'], data['tax_amount'], data['total_amount']),
+                         ('32.00', '1.60', '3.04', '33.44'))
+        invoice = Invoice.objects.get(pk=data['invoice'])
+        self.assertEqual(invoice.total_amount, Decimal('33.44'))
+        self.assertEqual(invoice.items.count(), 2)
+        self.assertEqual(Transaction.objects.filter(transaction_type='OUT').count(), 2)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.quantity, 7)
+        self.assertEqual(DailySummary.objects.get().sales_total, Decimal('33.44'))
+
+    def test_totals_use_the_rates_as_stored(self):
+        response = self.checkout([{'sku': 'POS-A', 'quantity': 10}], tax_rate='12.344', discount_rate='3.339')
+        data = response.json()
+        invoice = Invoice.objects.get(pk=data['invoice'])
+        self.assertEqual((invoice.tax_rate, invoice.discount_rate), (Decimal('12.34'), Decimal('3.34')))
+        self.assertEqual((data['discount_amount'], data['tax_amount'], data['total_amount']), ('2.67', '9.54', '86.87')) # 9.55 at the unrounded 12.344%
+        stored = (invoice.sub_total, invoice.discount_amount, invoice.tax_amount, invoice.total_amount)
+        invoice.calculate_totals() # Recomputed from the stored rates
+        self.assertEqual(stored, tuple(value.quantize(Decimal('0.01')) for value in (
+            invoice.sub_total, invoice.discount_amount, invoice.tax_amount, invoice.total_amount)))
+
+    def test_short_or_unknown_items_save_nothing(self):
+        response = self.checkout([{'sku': 'POS-A', 'quantity': 2}, {'sku': 'POS-P', 'quantity': 2}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['shortfalls'][0]['available'], 1)
+        self.assertEqual(self.checkout([{'sku': 'NOPE', 'quantity': 1}]).status_code, 400)
+        self.assertEqual(self.checkout([{'sku': 'POS-A', 'quantity': 0}]).status_code, 400)
+        self.assertFalse(Invoice.objects.exists())
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.quantity, 10)
+
+
+class ProductPickerTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('clerk', password='x', is_staff=True))
+        self.products = [make_product(f'Pick {i}', f'PK-{i}', quantity=50) for i in range(8)]
+        make_product('Never Listed', 'PK-X')
+
+    def invoice_with_lines(self, number, count):
+        invoice = make_invoice(number)
+        post_invoice_items(invoice, [InvoiceItem(product=p, quantity=1, unit_price=p.selling_price)
+                                     for p in self.products[:count]])
+        return invoice
+
+    def test_edit_page_queries_do_not_grow_with_lines_or_catalog(self):
+        counts = []
+        for number, lines in (('INV-2', 2), ('INV-6', 6)):
+            invoice = self.invoice_with_lines(number, lines)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('invoice-edit', args=[invoice.pk]))
+            counts.append(len(queries))
+            self.assertContains(response, 'Pick 1 (PK-1)')
+            self.assertNotContains(response, 'Never Listed') # Only the selected products are rendered
+        self.assertEqual(counts[0], counts[1])
+
+    def test_formset_validates_every_line_with_one_product_query(self):
+        data = {'items-TOTAL_FORMS': '5', 'items-INITIAL_FORMS': '0'}
+        for i, product in enumerate(self.products[:5]):
+            data.update({f'items-{i}-product': product.pk, f'items-{i}-quantity': 2, f'items-{i}-unit_price': '8.00'})
+        formset = InvoiceItemFormSet(data, instance=Invoice(), prefix='items')
+        with self.assertNumQueries(1): # The lines' products, loaded together
+            self.assertTrue(formset.is_valid())
+        self.assertEqual([form.cleaned_data['product'] for form in formset], self.products[:5])
+
+    def test_autocomplete_pages_through_matches(self):
+        url = reverse('api-product-autocomplete')
+        data = self.client.get(url, {'q': 'pick'}).json()
+        self.assertEqual(len(data['results']), 8)
+        self.assertFalse(data['pagination']['more'])
+        api.AUTOCOMPLETE_PAGE_SIZE, size = 3, api.AUTOCOMPLETE_PAGE_SIZE
+        try:
+            first = self.client.get(url).json()
+            second = self.client.get(first['pagination']['next']).json()
+        finally:
+            api.AUTOCOMPLETE_PAGE_SIZE = size
+        self.assertEqual([row['text'] for row in first['results'] + second['results']],
+                         ['Never Listed (PK-X)', 'Pick 0 (PK-0)', 'Pick 1 (PK-1)', 'Pick 2 (PK-2)', 'Pick 3 (PK-3)', 'Pick 4 (PK-4)'])
+
+    def test_filter_choices_are_cached_until_a_category_changes(self):
+        cache.clear()
+        Category.objects.create(name='Tools')
+        ProductFilterForm().as_p()
+        with self.assertNumQueries(0):
+            ProductFilterForm().as_p()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Garden')
+        self.assertIn('Garden', ProductFilterForm().as_p())
+
+
+class FormsetStockValidationTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(quantity=10)
+
+    def formset(self, lines, invoice=None):
+        """lines: [(saved item or None, product, quantity, delete)]"""
+        data = {'items-TOTAL_FORMS': str(len(lines)),
+                'items-INITIAL_FORMS': str(sum(1 for item, *_ in lines if item))}
+        for i, (item, product, quantity, delete) in enumerate(lines):
+            data.update({f'items-{i}-product': product.pk, f'items-{i}-quantity': quantity,
+                         f'items-{i}-unit_price': '8.00'})
+            if item:
+                data[f'items-{i}-id'] = item.pk
+            if delete:
+                data[f'items-{i}-DELETE'] = 'on'
+        return InvoiceItemFormSet(data, instance=invoice or Invoice(), prefix='items')
+
+    def test_lines_for_one_product_are_checked_together(self):
+        formset = self.formset([(None, self.product, 6, False), (None, self.product, 5, False)])
+        with self.assertNumQueries(1):
+            self.assertFalse(formset.is_valid())
+        for form in formset:
+            self.assertIn("Available: 10, Requested in total: 11", form.errors['quantity'][0])
+        self.assertTrue(self.formset([(None, self.product, 6, False), (None, self.product, 4, False)]).is_valid())
+
+    def test_edited_lines_count_only_their_change(self):
+        invoice = make_invoice()
+        item, = post_invoice_items(invoice, [InvoiceItem(product=self.product, quantity=8, unit_price=Decimal('8.00'))])
+        # 2 left on the shelf: the line may grow by 2, or by more if another line is deleted
+        self.assertTrue(self.formset([(item, self.product, 10, False)], invoice).is_valid())
+        self.assertFalse(self.formset([(item, self.product, 11, False)], invoice).is_valid())
+        self.assertTrue(self.formset([(item, self.product, 8, True), (None, self.product, 10, False)], invoice).is_valid())
+
+    def test_removed_receipt_lines_load_their_products_together(self):
+        products = [make_product(f'Removed {i}', f'RM-{i}', quantity=0) for i in range(3)]
+        receipt = Receipt.objects.create(receipt_number='REC-RM', supplier=Supplier.objects.create(name='Acme'))
+        items = post_receipt_items(receipt, [ReceiptItem(product=p, quantity=4, unit_price=Decimal('5.00')) for p in products])
+        Product.objects.filter(pk=products[0].pk).update(quantity=1) # Sold since
+        FormSet = inlineformset_factory(Receipt, ReceiptItem, formset=StockCheckedLineFormSet,
+                                        fields=['product', 'quantity', 'unit_price'], can_delete=True)
+        data = {'items-TOTAL_FORMS': '3', 'items-INITIAL_FORMS': '3'}
+        for i, item in enumerate(items):
+            data.update({f'items-{i}-id': item.pk, f'items-{i}-product': item.product_id, f'items-{i}-quantity': 4,
+                         f'items-{i}-unit_price': '5.00', f'items-{i}-DELETE': 'on'})
+        formset = FormSet(data, instance=receipt, prefix='items')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.non_form_errors(), ["Not enough stock for Removed 0. Available: 1, Requested in total: 4"])
+        stock_reads = [q for q in queries if q['sql'].startswith('SELECT "inventory_product"."id", "inventory_product"."name", "inventory_product"."quantity" FROM')]
+        self.assertEqual(len(stock_reads), 1)
+
+
+class DocumentEditRepostTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('editor', password='x', is_staff=True)
+        self.client.force_login(self.user)
+        self.a = make_product('Alpha', 'ED-A', quantity=10)
+        self.b = make_product('Beta', 'ED-B', quantity=10)
+
+    def lines_data(self, items, extra=()):
+        """items: [(saved item, quantity, delete)], extra: [(product, quantity)] for new lines"""
+        data = {'items-TOTAL_FORMS': str(len(items) + len(extra)), 'items-INITIAL_FORMS': str(len(items))}
+        for i, (item, quantity, delete) in enumerate(items):
+            data.update({f'items-{i}-id': item.pk, f'items-{i}-product': item.product_id,
+                         f'items-{i}-quantity': quantity, f'items-{i}-unit_price': item.unit_price})
+            if delete:
+                data[f'items-{i}-DELETE'] = 'on'
+        for i, (product, quantity) in enumerate(extra, len(items)):
+            data.update({f'items-{i}-product': product.pk, f'items-{i}-quantity': quantity, f'items-{i}-unit_price': '8.00'})
+        return data
+
+    def test_invoice_edit_posts_only_net_changes(self):
+        invoice = make_invoice()
+        line_a, line_b = post_invoice_items(invoice, [
+            InvoiceItem(product=self.a, quantity=3, unit_price=Decimal('8.00')),
+            InvoiceItem(product=self.b, quantity=2, unit_price=Decimal('8.00')),
+        ])
+        data = {'invoice_number': invoice.invoice_number, 'sale_date': timezone.localdate(), 'tax_rate': '0', 'discount_rate': '0',
+                **self.lines_data([(line_a, 3, False), (line_b, 2, True)], extra=[(self.a, 2)])}
+        response = self.client.post(reverse('invoice-edit', args=[invoice.pk]), data)
+        self.assertRedirects(response, invoice.get_absolute_url())
+
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertEqual((self.a.quantity, self.b.quantity), (5, 10))
+        edits = Transaction.objects.filter(notes=f"Edit of Invoice {invoice.invoice_number}")
+        self.assertEqual(sorted(edits.values_list('product__sku', 'transaction_type', 'quantity')),
+                         [('ED-A', 'OUT', 2), ('ED-B', 'IN', 2)])
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('40.00'))
+        self.assertEqual(invoice.items.aggregate(cogs=Sum('cogs'))['cogs'], Decimal('25.00')) # 5 x 5.00
+        call_command('verify_average_cost', stdout=StringIO())
+
+        # Saving again without changes posts nothing
+        header = {key: value for key, value in data.items() if not key.startswith('items-')}
+        lines = list(invoice.items.order_by('id'))
+        self.client.post(reverse('invoice-edit', args=[invoice.pk]),
+                         {**header, **self.lines_data([(line, line.quantity, False) for line in lines])})
+        self.assertEqual(edits.count(), 2)
+
+    def test_receipt_edit_cannot_remove_stock_already_sold(self):
+        receipt = Receipt.objects.create(receipt_number='REC-ED', supplier=Supplier.objects.create(name='Acme'),
+                                         created_by=self.user)
+        line, = post_receipt_items(receipt, [ReceiptItem(product=self.a, quantity=10, unit_price=Decimal('4.00'))])
+        data = {'receipt_number': receipt.receipt_number, 'supplier': receipt.supplier_id, 'purchase_date': timezone.localdate(),
+                **self.lines_data([(line, 6, False)])}
+        self.client.post(reverse('receipt-edit', args=[receipt.pk]), data)
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.quantity, 16)
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.total_amount, Decimal('24.00'))
+
+        Transaction.objects.create(product=self.a, transaction_type='OUT', quantity=15) # Sold since
+        data.update(self.lines_data([(line, 6, True)]))
+        response = self.client.post(reverse('receipt-edit', args=[receipt.pk]), data)
+        self.assertContains(response, "Available: 1, Requested in total: 6")
+        self.assertTrue(receipt.items.exists())
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.quantity, 1)
+        call_command('verify_average_cost', stdout=StringIO())
+
+    def test_receipt_edits_move_the_lines_own_layers_at_the_line_price(self):
+        receipt = Receipt.objects.create(receipt_number='REC-FIFO', supplier=Supplier.objects.create(name='Acme'),
+                                         created_by=self.user)
+        line, = post_receipt_items(receipt, [ReceiptItem(product=self.a, quantity=10, unit_price=Decimal('20.00'))])
+        header = {'receipt_number': receipt.receipt_number, 'supplier': receipt.supplier_id, 'purchase_date': timezone.localdate()}
+
+        def edit(quantity, unit_price):
+            data = {**header, **self.lines_data([(line, quantity, False)]), 'items-0-unit_price': unit_price}
+            self.assertRedirects(self.client.post(reverse('receipt-edit', args=[receipt.pk]), data), receipt.get_absolute_url())
+            self.a.refresh_from_db()
+            return list(CostLayer.objects.filter(product=self.a).order_by('received_at', 'id').values_list(
+                'receipt_item', 'unit_cost', 'quantity_remaining'))
+
+        # Receiving less comes off this line's layer, not the opening stock, at the line price
+        self.assertEqual(edit(6, '20.00'), [(None, Decimal('5.00'), 10), (line.pk, Decimal('20.00'), 6)])
+        self.assertEqual((self.a.quantity, self.a.stock_value), (16, Decimal('170.00')))
+        # Receiving more at a new price opens a layer at that price and re-costs the rest of the line
+        self.assertEqual(edit(8, '25.00'), [(None, Decimal('5.00'), 10), (line.pk, Decimal('25.00'), 6),
+                                            (line.pk, Decimal('25.00'), 2)])
+        self.assertEqual(self.a.stock_value, Decimal('250.00'))
+        # A new price alone changes the cost too
+        self.assertEqual(edit(8, '30.00')[1:], [(line.pk, Decimal('30.00'), 6), (line.pk, Decimal('30.00'), 2)])
+        self.assertEqual((self.a.quantity, self.a.stock_value), (18, Decimal('290.00')))
+        self.assertEqual(Transaction.objects.filter(receipt=receipt).count(), 3) # Received, less, more
+
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=self.a, quantity=12, unit_price=Decimal('40.00'))])
+        self.assertEqual(invoice.items.get().cogs, Decimal('110.00')) # 10 x 5.00 + 2 x 30.00
+        call_command('verify_average_cost', stdout=StringIO())
+        call_command('rebuild_cost_layers', stdout=StringIO())
+        self.assertEqual(invoice.items.get().cogs, Decimal('110.00'))
+        self.assertEqual(sum(CostLayer.objects.filter(receipt_item=line).values_list('quantity_remaining', flat=True)), 6)
+
+    def test_rebuild_reopens_invoice_returns_at_the_running_average(self):
+        product = make_product('Gamma', 'ED-C', quantity=0)
+        receipt = Receipt.objects.create(receipt_number='REC-AVG', supplier=Supplier.objects.create(name='Acme'),
+                                         created_by=self.user)
+        post_receipt_items(receipt, [ReceiptItem(product=product, quantity=5, unit_price=Decimal('6.00')),
+                                     ReceiptItem(product=product, quantity=20, unit_price=Decimal('8.00'))])
+        invoice = make_invoice('INV 7') # Document numbers may contain spaces
+        line, = post_invoice_items(invoice, [InvoiceItem(product=product, quantity=12, unit_price=Decimal('12.00'))])
+        data = {'invoice_number': invoice.invoice_number, 'sale_date': timezone.localdate(), 'tax_rate': '0', 'discount_rate': '0',
+                **self.lines_data([(line, 7, False)])}
+        self.assertRedirects(self.client.post(reverse('invoice-edit', args=[invoice.pk]), data), invoice.get_absolute_url())
+
+        def layers():
+            return list(CostLayer.objects.filter(product=product, quantity_remaining__gt=0).order_by('received_at', 'id')
+                        .values_list('unit_cost', 'quantity_remaining'))
+
+        # The 5 returned units come back at the average cost, (5 x 6.00 + 20 x 8.00) / 25
+        self.assertEqual(layers(), [(Decimal('8.00'), 13), (Decimal('7.60'), 5)])
+        call_command('rebuild_cost_layers', stdout=StringIO())
+        self.assertEqual(layers(), [(Decimal('8.00'), 13), (Decimal('7.60'), 5)])
+        self.assertEqual(invoice.items.get().cogs, Decimal('86.00')) # 5 x 6.00 + 7 x 8.00, as sold
+        call_command('verify_average_cost', stdout=StringIO())
+
+
+
+class DocumentVoidTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('voider', password='x', is_staff=True)
+        self.client.force_login(self.user)
+        self.a = make_product('Alpha', 'VD-A', quantity=10)
+        self.b = make_product('Beta', 'VD-B', quantity=10)
+
+    def test_void_invoice_returns_stock_in_one_batch_and_leaves_reports(self):
+        invoice = make_invoice()
+        post_invoice_items(invoice, [
+            InvoiceItem(product=self.a, quantity=3, unit_price=Decimal('8.00')),
+            InvoiceItem(product=self.a, quantity=1, unit_price=Decimal('8.00')),
+            InvoiceItem(product=self.b, quantity=2, unit_price=Decimal('8.00')),
+        ])
+        self.assertEqual(DailySummary.for_date(invoice.sale_date).invoice_count, 1)
+
+        response = self.client.post(reverse('invoice-void', args=[invoice.pk]))
+        self.assertRedirects(response, invoice.get_absolute_url())
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.voided_by), ('void', self.user))
+        self.assertEqual(invoice.items.count(), 3) # Kept for the record
+        self.a.refresh_from_db()
+        self.b.refresh_from_db()
+        self.assertEqual((self.a.quantity, self.b.quantity), (10, 10))
+        voids = Transaction.objects.filter(notes=f"Void of Invoice {invoice.invoice_number}")
+        self.assertEqual(sorted(voids.values_list('product__sku', 'transaction_type', 'quantity')),
+                         [('VD-A', 'IN', 4), ('VD-B', 'IN', 2)])
+
+        summary = DailySummary.for_date(invoice.sale_date)
+        self.assertEqual((summary.invoice_count, summary.sales_total), (0, Decimal('0')))
+        call_command('rebuild_daily_summary', '--verify', stdout=StringIO())
+        call_command('verify_average_cost', stdout=StringIO())
+
+        # A second void changes nothing, and the voided invoice can no longer be edited
+        self.client.post(reverse('invoice-void', args=[invoice.pk]))
+        self.assertEqual(voids.count(), 2)
+        self.assertEqual(self.client.get(reverse('invoice-edit', args=[invoice.pk])).status_code, 404)
+
+    def test_receipt_whose_stock_was_sold_cannot_be_voided(self):
+        receipt = Receipt.objects.create(receipt_number='REC-VD', created_by=self.user)
+        post_receipt_items(receipt, [ReceiptItem(product=self.a, quantity=5, unit_price=Decimal('4.00'))])
+        Transaction.objects.create(product=self.a, transaction_type='OUT', quantity=12) # 3 left
+
+        response = self.client.post(reverse('receipt-void', args=[receipt.pk]), follow=True)
+        self.assertContains(response, "Available: 3, Requested: 5")
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.status, 'posted')
+        self.a.refresh_from_db()
+        self.assertEqual(self.a.quantity, 3)
+
+        Transaction.objects.create(product=self.a, transaction_type='IN', quantity=2)
+        self.client.post(reverse('receipt-void', args=[receipt.pk]))
+        receipt.refresh_from_db()
+        self.a.refresh_from_db()
+        self.assertEqual((receipt.status, self.a.quantity), ('void', 0))
+        self.assertEqual(DailySummary.for_date(receipt.purchase_date).receipt_count, 0)
+        call_command('verify_average_cost', stdout=StringIO())
+
+    def test_admin_voids_instead_of_deleting_and_keeps_void_documents_read_only(self):
+        admin_user = User.objects.create_superuser('root', password='x')
+        self.client.force_login(admin_user)
+        invoice = make_invoice()
+        post_invoice_items(invoice, [InvoiceItem(product=self.a, quantity=3, unit_price=Decimal('8.00'))])
+        change_url = reverse('admin:inventory_invoice_change', args=[invoice.pk])
+        self.assertContains(self.client.get(change_url), 'name="items-0-quantity"')
+        self.assertEqual(self.client.get(reverse('admin:inventory_invoice_delete', args=[invoice.pk])).status_code, 403)
+
+        response = self.client.post(reverse('admin:inventory_invoice_changelist'),
+                                    {'action': 'void_selected', '_selected_action': [invoice.pk]})
+        self.assertEqual(response.status_code, 302)
+        invoice.refresh_from_db()
+        self.a.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.voided_by, self.a.quantity), ('void', admin_user, 10))
+
+        # The void invoice is view-only: its lines cannot be edited, added or removed
+        response = self.client.get(change_url)
+        self.assertFalse(response.context['has_change_permission'])
+        self.assertNotContains(response, 'name="items-0-quantity"')
+        line = invoice.items.get()
+        self.client.post(change_url, {
+            'invoice_number': invoice.invoice_number, 'sale_date': timezone.localdate(), 'tax_rate': '0', 'discount_rate': '0',
+            'items-TOTAL_FORMS': '2', 'items-INITIAL_FORMS': '1', 'items-0-id': line.pk, 'items-0-invoice': invoice.pk,
+            'items-0-product': self.a.pk, 'items-0-quantity': '9', 'items-0-unit_price': '8.00',
+            'items-1-product': self.b.pk, 'items-1-quantity': '1', 'items-1-unit_price': '8.00',
+        })
+        self.assertEqual(list(invoice.items.values_list('quantity', flat=True)), [3])
+        self.b.refresh_from_db()
+        self.assertEqual(self.b.quantity, 10)
+
+
+
+class TransactionDocumentLinkTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(quantity=20)
+        self.receipt = Receipt.objects.create(receipt_number='REC-LNK')
+        self.invoice = make_invoice('INV-LNK')
+
+    def test_postings_and_voids_are_linked_to_their_document(self):
+        post_receipt_items(self.receipt, [ReceiptItem(product=self.product, quantity=5, unit_price=Decimal('4.00'))])
+        post_invoice_items(self.invoice, [InvoiceItem(product=self.product, quantity=3, unit_price=Decimal('8.00'))])
+        void_document(self.invoice)
+        self.assertEqual(sorted(self.invoice.transactions.values_list('transaction_type', 'quantity')), [('IN', 3), ('OUT', 3)])
+        self.assertEqual(list(self.receipt.transactions.values_list('transaction_type', 'quantity')), [('IN', 5)])
+
+        self.client.force_login(User.objects.create_user('clerk', password='x'))
+        response = self.client.get(reverse('transaction-list'), {'invoice': self.invoice.pk})
+        self.assertEqual(len(response.context['transactions']), 2)
+        self.assertContains(response, self.invoice.get_absolute_url())
+
+    def test_migration_links_existing_rows_from_their_notes(self):
+        spaced = Receipt.objects.create(receipt_number='R 2')
+        Transaction.objects.bulk_create([
+            Transaction(product=self.product, transaction_type='IN', quantity=5, notes="Stock in via Receipt REC-LNK"),
+            Transaction(product=self.product, transaction_type='OUT', quantity=1, notes="Edit of Invoice INV-LNK"),
+            Transaction(product=self.product, transaction_type='OUT', quantity=2, notes="Stock out via Invoice INV-GONE"),
+            Transaction(product=self.product, transaction_type='ADJ', quantity=1, notes="Opening stock (catalog import)"),
+            Transaction(product=self.product, transaction_type='OUT', quantity=1, notes="Void of Receipt R 2"),
+        ])
+        migration = importlib.import_module('inventory.migrations.0011_transaction_document_links')
+        out = StringIO()
+        with redirect_stdout(out):
+            migration.link_documents(apps, None)
+        self.assertEqual(list(Transaction.objects.order_by('id').values_list('receipt_id', 'invoice_id')), [
+            (self.receipt.pk, None), (None, self.invoice.pk), (None, None), (None, None), (spaced.pk, None),
+        ])
+        self.assertIn("1 ledger row(s) name a receipt or invoice that no longer exists", out.getvalue()) # INV-GONE
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
@@ -19,6 +19,7 @@ urlpatterns = [
     # Product URLs
     path('products/', views.ProductListView.as_view(), name='product-list'),
     path('products/add/', views.ProductCreateView.as_view(), name='product-add'),
+    path('products/import/', views.CatalogImportView.as_view(), name='product-import'), # Bulk CSV catalog import
     path('products/<int:pk>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('products/<int:pk>/edit/', views.ProductUpdateView.as_view(), name='product-edit'),
     path('products/<int:pk>/delete/', views.ProductDeleteView.as_view(), name='product-delete'),
@@ -31,16 +32,18 @@ urlpatterns = [
     path('receipts/add/', views.ReceiptCreateView.as_view(), name='receipt-add'),
     path('receipts/<int:pk>/', views.ReceiptDetailView.as_view(), name='receipt-detail'),
     path('receipts/<int:pk>/edit/', views.ReceiptUpdateView.as_view(), name='receipt-edit'),
-    path('receipts/<int:pk>/delete/', views.ReceiptDeleteView.as_view(), name='receipt-delete'),
+    path('receipts/<int:pk>/void/', views.ReceiptVoidView.as_view(), name='receipt-void'),
 
     # Invoice URLs
     path('invoices/', views.InvoiceListView.as_view(), name='invoice-list'),
     path('invoices/add/', views.InvoiceCreateView.as_view(), name='invoice-add'),
     path('invoices/<int:pk>/', views.InvoiceDetailView.as_view(), name='invoice-detail'),
     path('invoices/<int:pk>/edit/', views.InvoiceUpdateView.as_view(), name='invoice-edit'),
-    path('invoices/<int:pk>/delete/', views.InvoiceDeleteView.as_view(), name='invoice-delete'),
+    path('invoices/<int:pk>/void/', views.InvoiceVoidView.as_view(), name='invoice-void'),
     path('receipts/<int:pk>/pdf/', views.receipt_pdf_view, name='receipt-pdf'),
     path('invoices/<int:pk>/pdf/', views.invoice_pdf_view, name='invoice-pdf'),
+    path('pdf/jobs/<str:job_id>/', views.pdf_job_view, name='pdf-job'),
+    path('pdf/metrics/', views.pdf_metrics_view, name='pdf-metrics'),
     path('invoices/today/', views.TodaysSalesListView.as_view(), name='todays-sales-list'), 
     
     # Report URLs
@@ -57,8 +60,23 @@ urlpatterns = [
     path('reports/', views.ReportListView.as_view(), name='report-list'), # Date Range Selection
     path('reports/view/', views.report_view, name='report-view'), # Date Range View (HTML)
     path('reports/profit/', views.ProfitReportView.as_view(), name='profit-report'), # NEW: Profit Report
+    path('reports/pdf-export/', views.PdfExportView.as_view(), name='pdf-export'), # Bulk invoice/receipt PDFs
+    path('reports/data-export/', views.DataExportView.as_view(), name='data-export'), # Streaming CSV / NDJSON
+    path('reports/reorder-queue/', views.ReorderQueueView.as_view(), name='reorder-queue'), # Low stock by supplier
+    path('stock-takes/', views.StockTakeListView.as_view(), name='stocktake-list'), # Physical count sessions
+    path('stock-takes/<int:pk>/', views.StockTakeDetailView.as_view(), name='stocktake-detail'),
     path('reports/daily-sales/', views.DailySalesReportSelectView.as_view(), name='daily-sales-report-select'),
     path('reports/daily-sales/<str:date_str>/pdf/', views.daily_sales_report_pdf_view, name='daily-sales-report-pdf'),
     path('activity/today/', views.DailyActivityView.as_view(), name='daily-activity'),
 
+    # Read-only JSON API (see api.py)
+    path('api/products/', api.resource_list, {'name': 'products'}, name='api-products'),
+    path('api/products/<int:pk>/', api.product_detail, name='api-product-detail'),
+    path('api/products/autocomplete/', api.product_autocomplete, name='api-product-autocomplete'),
+    path('api/stock/', api.resource_list, {'name': 'stock'}, name='api-stock'),
+    path('api/stock/availability/', api.stock_availability, name='api-stock-availability'),
+    path('api/categories/', api.resource_list, {'name': 'categories'}, name='api-categories'),
+    path('api/suppliers/', api.resource_list, {'name': 'suppliers'}, name='api-suppliers'),
+    path('api/pos/checkout/', api.pos_checkout, name='api-pos-checkout'),
+
 ]
\ No newline at end of file
@@ -0,0 +1,19 @@
+# inventory/utils.py
+
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def day_range(start_date, end_date):
+    """
+    Converts an inclusive date range into a half-open, timezone-aware datetime range
+    [start_date 00:00, day after end_date 00:00) in the current time zone.
+
+    Filter with timestamp__gte=start, timestamp__lt=end: unlike timestamp__date__gte/lte,
+    this compares the raw column and lets the database use the timestamp index.
+    """
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
@@ -4,14 +4,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import (
-    ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
+    ListView, DetailView, CreateView, UpdateView, DeleteView, FormView, TemplateView
 )
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 from django.db import transaction as db_transaction
-from django.db.models import Sum, F, Q, Count
+from django.db.models import Sum, F, Q, Count, DecimalField, ExpressionWrapper, FloatField
+from django.db.models.functions import Cast, Coalesce
+from django.core.paginator import Paginator
 from django.utils import timezone
-from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponse, FileResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.conf import settings
 from django.template.loader import render_to_string
 from django.contrib import messages
 from django import forms # Needed for InvoiceFilterForm ValidationError
@@ -19,6 +24,11 @@ from django import forms # Needed for InvoiceFilterForm ValidationError
 # --- Third-Party Imports ---
 from dateutil.parser import parse # For parsing dates in date range report
 from datetime import datetime # For parsing date in daily sales report PDF view
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial, wraps
+from itertools import groupby
+import csv
+import io
 
 # --- WeasyPrint Import (with error handling) ---
 try:
@@ -33,13 +43,18 @@ except ImportError:
 # --- Local Imports ---
 from .models import (
     Product, Category, Supplier, Transaction, Receipt, Invoice,
-    ReceiptItem, InvoiceItem
+    ReceiptItem, InvoiceItem, DailySummary, StockTake
 )
 from .forms import (
     ProductForm, CategoryForm, SupplierForm, ProductFilterForm,
     ReceiptForm, ReceiptItemFormSet, InvoiceForm, InvoiceItemFormSet,
-    DateRangeReportForm, DailySalesReportForm # Make sure DailySalesReportForm is imported
+    DateRangeReportForm, DailySalesReportForm, # Make sure DailySalesReportForm is imported
+    PdfExportForm, DataExportForm, CatalogImportForm, StockCountScanForm, StockCountUploadForm,
 )
+from .services import post_receipt_items, post_invoice_items, repost_items, void_document, InsufficientStock
+from .utils import day_range
+from .pagination import KeysetPaginationMixin
+from . import dashboard_cache, data_export, importer, pdf, pdf_cache, pdf_export, search, stocktake
 
 # --- Permissions Mixin ---
 class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
@@ -58,34 +73,23 @@ class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
         # Handle non-authenticated users (should be caught by LoginRequiredMixin, but good fallback)
         return super().handle_no_permission()
 
+
+def flag_shortfalls(items_formset, shortfalls):
+    """Puts an InsufficientStock shortfall on every line of each short product."""
+    shortfalls = {s['product_id']: s for s in shortfalls}
+    for item_form in items_formset.forms:
+        product = item_form.cleaned_data.get('product')
+        if product and product.pk in shortfalls:
+            s = shortfalls[product.pk]
+            item_form.add_error('quantity', f"Not enough stock. Available: {s['available']}, Requested in total: {s['requested']}")
+
 # --- Dashboard View ---
 @login_required
 def dashboard(request):
-    total_products = Product.objects.count()
-    # Count products where quantity is less than or equal to reorder level
-    low_stock_products = Product.objects.filter(quantity__lte=F('reorder_level')).count()
-    total_suppliers = Supplier.objects.count()
-    total_categories = Category.objects.count()
-    # Get the 10 most recent transactions
-    recent_transactions = Transaction.objects.select_related('product', 'user').order_by('-timestamp')[:10]
-
-    # Calculate basic sales for today (optional for dashboard)
-    today = timezone.now().date()
-    todays_sales_summary = Invoice.objects.filter(sale_date=today).aggregate(
-        total_sales=Sum('total_amount'),
-        invoice_count=Count('id')
-    )
-
-    context = {
-        'total_products': total_products,
-        'low_stock_products': low_stock_products,
-        'total_suppliers': total_suppliers,
-        'total_categories': total_categories,
-        'recent_transactions': recent_transactions,
-        'todays_total_sales': todays_sales_summary.get('total_sales') or 0.00,
-        'todays_invoice_count': todays_sales_summary.get('invoice_count') or 0,
-        'page_title': 'Dashboard'
-    }
+    # Counts, stock figures, recent transactions and today's sales are served from the
+    # dashboard cache, which the write paths invalidate (see dashboard_cache.py)
+    context = dashboard_cache.dashboard_values()
+    context['page_title'] = 'Dashboard'
     return render(request, 'inventory/dashboard.html', context)
 
 # --- Category Views (CRUD) ---
@@ -238,15 +242,15 @@ class ProductListView(LoginRequiredMixin, ListView): # All logged-in users can v
             below_reorder = form.cleaned_data.get('below_reorder')
 
             if name:
-                # Filter by name OR sku containing the search term (case-insensitive)
-                queryset = queryset.filter(Q(name__icontains=name) | Q(sku__icontains=name))
+                # Full-text prefix search over name, SKU, description, category and supplier, best matches first
+                queryset = search.search_products(queryset, name)
             if category:
                 queryset = queryset.filter(category=category)
             if supplier:
                 queryset = queryset.filter(supplier=supplier)
             if below_reorder:
-                # Filter where quantity is less than or equal to the reorder_level field
-                queryset = queryset.filter(quantity__lte=F('reorder_level'))
+                # Materialized quantity <= reorder_level flag, served by the partial low-stock index
+                queryset = queryset.filter(is_low_stock=True)
 
         return queryset
 
@@ -303,7 +307,12 @@ class ProductUpdateView(StaffRequiredMixin, UpdateView):
         return context
 
     def form_valid(self, form):
-        product = form.save()
+        product = form.save(commit=False)
+        # Write the catalog fields only: stock and valuation (quantity, average_cost, stock_value)
+        # are kept by postings, which may have moved them since this product was loaded
+        product.save(update_fields=[*form._meta.fields, 'updated_at'])
+        # ...and derive the low-stock flag from the stored quantity, not the loaded one
+        Product.objects.filter(pk=product.pk).update(is_low_stock=Product.low_stock_after(0))
         messages.success(self.request, f"Product '{product.name}' updated successfully.")
         # Redirect to detail view after update
         return HttpResponseRedirect(product.get_absolute_url())
@@ -331,12 +340,12 @@ class ProductDeleteView(StaffRequiredMixin, DeleteView):
         return super().post(request, *args, **kwargs)
 
 # --- Transaction View ---
-class TransactionListView(LoginRequiredMixin, ListView):
+class TransactionListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Transaction
     template_name = 'inventory/transaction_list.html'
     context_object_name = 'transactions'
     paginate_by = 25 # Show more transactions per page
-    ordering = ['-timestamp']
+    keyset_ordering = ('-timestamp', '-id') # Cursor pages; a deep page costs the same as the first
 
     def get_queryset(self):
         # Optimize by fetching related product and user
@@ -345,6 +354,11 @@ class TransactionListView(LoginRequiredMixin, ListView):
         product_id = self.request.GET.get('product')
         if product_id:
             queryset = queryset.filter(product_id=product_id)
+        # Movements of one document, through the indexed document links
+        for document in ('invoice', 'receipt'):
+            document_id = self.request.GET.get(document)
+            if document_id and document_id.isdigit():
+                queryset = queryset.filter(**{f'{document}_id': document_id})
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -378,7 +392,7 @@ class ReceiptDetailView(LoginRequiredMixin, DetailView):
         # Prefetch related items and their products for efficiency
         return super().get_queryset().prefetch_related(
             'items__product' # Prefetch items and the product linked to each item
-        ).select_related('supplier', 'created_by')
+        ).select_related('supplier', 'created_by', 'voided_by')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -412,9 +426,8 @@ class ReceiptCreateView(StaffRequiredMixin, CreateView):
             # Check if the formset is valid
             if items_formset.is_valid():
                 items_formset.instance = self.object # Link formset items to the saved Receipt
-                items_formset.save() # Save ReceiptItem objects (triggers stock updates via model save)
-                # Receipt total calculation also happens in ReceiptItem save() or can be triggered here
-                # self.object.calculate_total() # Ensure total is calculated after all items are saved
+                # Post all lines in one batch (bulk insert, grouped stock update, single total calculation)
+                post_receipt_items(self.object, items_formset.save(commit=False))
                 messages.success(self.request, f"Receipt '{self.object.receipt_number}' created successfully.")
                 return HttpResponseRedirect(self.get_success_url()) # Redirect on success
             else:
@@ -440,10 +453,15 @@ class ReceiptUpdateView(StaffRequiredMixin, UpdateView):
     form_class = ReceiptForm
     template_name = 'inventory/receipt_form.html'
 
+    def get_queryset(self):
+        return super().get_queryset().filter(status='posted') # A voided document is no longer edited
+
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         # Initialize formset with existing instance
-        if self.request.POST:
+        if 'items_formset' in kwargs:
+            pass # Keep the formset passed in, it carries per-line stock errors
+        elif self.request.POST:
             data['items_formset'] = ReceiptItemFormSet(self.request.POST, instance=self.object, prefix='items')
         else:
             data['items_formset'] = ReceiptItemFormSet(instance=self.object, prefix='items')
@@ -454,21 +472,24 @@ class ReceiptUpdateView(StaffRequiredMixin, UpdateView):
         context = self.get_context_data()
         items_formset = context['items_formset']
 
-        with db_transaction.atomic():
-            self.object = form.save() # Save changes to main Receipt
-
-            if items_formset.is_valid():
-                items_formset.instance = self.object
-                # Handle stock reversal for deleted/changed items - requires custom logic or signals
-                # For now, saving the formset handles additions/updates based on its logic
-                items_formset.save()
-                # Ensure total is recalculated after all changes
-                self.object.calculate_total()
-                messages.success(self.request, f"Receipt '{self.object.receipt_number}' updated successfully.")
-                return HttpResponseRedirect(self.get_success_url())
-            else:
-                messages.error(self.request, "Please correct the errors in the receipt items below.")
-                return self.form_invalid(form)
+        try:
+            with db_transaction.atomic():
+                if items_formset.is_valid():
+                    self.object = form.save() # Save changes to main Receipt
+                    items_formset.instance = self.object
+                    # Saves changes, additions and deletions, posts only the net stock change per product
+                    # and recalculates the total once
+                    repost_items(self.object, items_formset, user=self.request.user)
+                    messages.success(self.request, f"Receipt '{self.object.receipt_number}' updated successfully.")
+                    return HttpResponseRedirect(self.get_success_url())
+        except InsufficientStock as e:
+            # Fewer units received than have since been sold or used; the whole edit was rolled back
+            flag_shortfalls(items_formset, e.shortfalls)
+            messages.error(self.request, "Some of this stock has already left the shelf. Please review the quantities below.")
+            return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
+
+        messages.error(self.request, "Please correct the errors in the receipt items below.")
+        return self.form_invalid(form)
 
     def form_invalid(self, form):
         context = self.get_context_data()
@@ -479,41 +500,36 @@ class ReceiptUpdateView(StaffRequiredMixin, UpdateView):
         # Redirect to detail view after update
         return reverse('receipt-detail', kwargs={'pk': self.object.pk})
 
-class ReceiptDeleteView(StaffRequiredMixin, DeleteView):
-    model = Receipt
-    template_name = 'inventory/confirm_delete_base.html' # Reusable template
-    success_url = reverse_lazy('receipt-list')
+class DocumentVoidView(StaffRequiredMixin, DetailView):
+    """
+    Confirms and voids a posted invoice or receipt. The document is kept (marked void) and its
+    stock is reversed in one batched posting, instead of deleting it line by line.
+    """
+    template_name = 'inventory/confirm_void.html'
+    object_type = None
+    warning_message = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['page_title'] = f'Delete Receipt: {self.object.receipt_number}'
-        context['object_type'] = 'Receipt'
-        context['cancel_url'] = self.object.get_absolute_url() if self.object else reverse_lazy('receipt-list')
-        # Add a specific warning for receipt deletion
-        context['warning_message'] = "Deleting this receipt will attempt to reverse the stock quantities added by its items. This might affect current stock levels."
+        context['page_title'] = f'Void {self.object}'
+        context['object_type'] = self.object_type
+        context['cancel_url'] = self.object.get_absolute_url()
+        context['warning_message'] = self.warning_message
         return context
 
     def post(self, request, *args, **kwargs):
-        receipt = self.get_object()
-        with db_transaction.atomic():
-            try:
-                # Attempt to reverse stock for each item before deleting the receipt
-                for item in receipt.items.all():
-                     Transaction.objects.create(
-                         product=item.product,
-                         transaction_type='ADJ', # Or a specific 'RECEIPT_DELETE' type
-                         quantity=-item.quantity, # Negative quantity to reverse effect
-                         user=request.user,
-                         notes=f"Stock reversed due to deletion of Receipt {receipt.receipt_number}"
-                     )
-                # If stock reversal is successful (or no items), proceed with deletion
-                messages.success(request, f"Receipt '{receipt.receipt_number}' deleted. Stock levels adjusted (reversed).")
-                return super().post(request, *args, **kwargs)
-            except Exception as e:
-                 # Handle potential errors during stock reversal (e.g., product deleted)
-                 messages.error(request, f"Error reversing stock for Receipt {receipt.receipt_number}: {e}. Deletion aborted.")
-                 # Redirect back to detail view if deletion fails
-                 return redirect(receipt.get_absolute_url())
+        self.object = self.get_object()
+        try:
+            void_document(self.object, user=request.user)
+            messages.success(request, f"{self.object} voided. Stock levels were reversed.")
+        except forms.ValidationError as e: # Already void, or InsufficientStock (nothing was changed)
+            messages.error(request, f"{self.object} was not voided: {' '.join(e.messages)}")
+        return redirect(self.object.get_absolute_url())
+
+class ReceiptVoidView(DocumentVoidView):
+    model = Receipt
+    object_type = 'Receipt'
+    warning_message = "Voiding this receipt takes the quantities it received back out of stock. It cannot be voided if that stock has already been sold."
 
 # --- Invoice Filter Form ---
 # (Defined here for use in InvoiceListView)
@@ -533,12 +549,12 @@ class InvoiceFilterForm(forms.Form):
         return cleaned_data
 
 # --- Invoice Views (CRUD with Formsets + Filtering + Today's Sales) ---
-class InvoiceListView(LoginRequiredMixin, ListView): # View All Invoices
+class InvoiceListView(LoginRequiredMixin, KeysetPaginationMixin, ListView): # View All Invoices
     model = Invoice
     template_name = 'inventory/invoice_list.html'
     context_object_name = 'invoices'
     paginate_by = 15
-    ordering = ['-sale_date', '-created_at']
+    keyset_ordering = ('-sale_date', '-created_at', '-id') # Served by invoice_sale_date_idx
 
     def get_queryset(self):
         queryset = super().get_queryset().select_related('created_by')
@@ -578,20 +594,17 @@ class TodaysSalesListView(LoginRequiredMixin, ListView): # View for Today's Sale
     def get_queryset(self):
         """Filter invoices where sale_date is today."""
         today = timezone.now().date()
-        return super().get_queryset().filter(sale_date=today).select_related('created_by').order_by('created_at')
+        return super().get_queryset().filter(status='posted', sale_date=today).select_related('created_by').order_by('created_at')
 
     def get_context_data(self, **kwargs):
         """Add today's date and sales totals to context."""
         context = super().get_context_data(**kwargs)
         today = timezone.now().date()
-        # Calculate totals for today's invoices
-        totals = self.get_queryset().aggregate(
-            total_sales=Sum('total_amount'),
-            invoice_count=Count('id')
-        )
+        # Totals for today's invoices from the daily rollup
+        summary = DailySummary.for_date(today)
         context['today_date'] = today
-        context['total_sales_today'] = totals.get('total_sales') or 0.00
-        context['invoice_count_today'] = totals.get('invoice_count') or 0
+        context['total_sales_today'] = summary.sales_total
+        context['invoice_count_today'] = summary.invoice_count
         context['page_title'] = f'Sales for Today ({today.strftime("%Y-%m-%d")})'
         return context
 
@@ -604,7 +617,7 @@ class InvoiceDetailView(LoginRequiredMixin, DetailView):
         # Optimize by prefetching items and related product/user
         return super().get_queryset().prefetch_related(
             'items__product'
-        ).select_related('created_by')
+        ).select_related('created_by', 'voided_by')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -618,7 +631,9 @@ class InvoiceCreateView(StaffRequiredMixin, CreateView):
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        if self.request.POST:
+        if 'items_formset' in kwargs:
+            pass # Keep the formset passed in, it carries per-line stock errors
+        elif self.request.POST:
             data['items_formset'] = InvoiceItemFormSet(self.request.POST, prefix='items')
         else:
             data['items_formset'] = InvoiceItemFormSet(prefix='items')
@@ -629,21 +644,30 @@ class InvoiceCreateView(StaffRequiredMixin, CreateView):
         context = self.get_context_data()
         items_formset = context['items_formset']
 
-        with db_transaction.atomic():
-            form.instance.created_by = self.request.user # Assign user
-            # Don't save main form yet if formset is invalid
-            if items_formset.is_valid():
-                # Save main form first to get PK for formset FK
-                self.object = form.save()
-                items_formset.instance = self.object
-                items_formset.save() # Triggers InvoiceItem save, stock deduction, total calculation
-                messages.success(self.request, f"Invoice '{self.object.invoice_number}' created successfully.")
-                return HttpResponseRedirect(self.get_success_url())
-            else:
-                # Formset invalid, transaction rolled back
-                messages.error(self.request, "Please correct the errors in the invoice items below (check stock levels).")
-                # Re-render form with main form data and invalid formset
-                return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
+        try:
+            with db_transaction.atomic():
+                form.instance.created_by = self.request.user # Assign user
+                # Don't save main form yet if formset is invalid
+                if items_formset.is_valid():
+                    # Save main form first to get PK for formset FK
+                    self.object = form.save()
+                    items_formset.instance = self.object
+                    # Post all lines in one batch (stock check, bulk insert, grouped stock deduction, single total calculation)
+                    post_invoice_items(self.object, items_formset.save(commit=False))
+                    messages.success(self.request, f"Invoice '{self.object.invoice_number}' created successfully.")
+                    return HttpResponseRedirect(self.get_success_url())
+        except InsufficientStock as e:
+            # Stock was taken (e.g. by a concurrent checkout) since the formset was validated;
+            # the whole invoice was rolled back.
+            self.object = None
+            flag_shortfalls(items_formset, e.shortfalls)
+            messages.error(self.request, "Some items are no longer in stock. Please review the quantities below.")
+            return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
+
+        # Formset invalid, nothing was saved
+        messages.error(self.request, "Please correct the errors in the invoice items below (check stock levels).")
+        # Re-render form with main form data and invalid formset
+        return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
 
     def form_invalid(self, form):
         # Handle main form invalid OR formset invalid (caught in form_valid)
@@ -660,9 +684,14 @@ class InvoiceUpdateView(StaffRequiredMixin, UpdateView):
     form_class = InvoiceForm
     template_name = 'inventory/invoice_form.html'
 
+    def get_queryset(self):
+        return super().get_queryset().filter(status='posted') # A voided document is no longer edited
+
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        if self.request.POST:
+        if 'items_formset' in kwargs:
+            pass # Keep the formset passed in, it carries per-line stock errors
+        elif self.request.POST:
             data['items_formset'] = InvoiceItemFormSet(self.request.POST, instance=self.object, prefix='items')
         else:
             data['items_formset'] = InvoiceItemFormSet(instance=self.object, prefix='items')
@@ -673,19 +702,24 @@ class InvoiceUpdateView(StaffRequiredMixin, UpdateView):
         context = self.get_context_data()
         items_formset = context['items_formset']
 
-        with db_transaction.atomic():
-            # Need robust stock handling for updates/deletions here or via signals
-            if items_formset.is_valid():
-                self.object = form.save() # Save main invoice changes
-                items_formset.instance = self.object
-                items_formset.save() # Saves changes, additions, deletions
-                # Ensure totals are recalculated after formset save
-                self.object.calculate_totals()
-                messages.success(self.request, f"Invoice '{self.object.invoice_number}' updated successfully.")
-                return HttpResponseRedirect(self.get_success_url())
-            else:
-                messages.error(self.request, "Please correct the errors in the invoice items below (check stock levels).")
-                return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
+        try:
+            with db_transaction.atomic():
+                if items_formset.is_valid():
+                    self.object = form.save() # Save main invoice changes
+                    items_formset.instance = self.object
+                    # Saves changes, additions and deletions, posts only the net stock change per product
+                    # and recalculates the totals once
+                    repost_items(self.object, items_formset, user=self.request.user)
+                    messages.success(self.request, f"Invoice '{self.object.invoice_number}' updated successfully.")
+                    return HttpResponseRedirect(self.get_success_url())
+        except InsufficientStock as e:
+            # Stock was taken since the formset was validated; the whole edit was rolled back
+            flag_shortfalls(items_formset, e.shortfalls)
+            messages.error(self.request, "Some items are no longer in stock. Please review the quantities below.")
+            return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
+
+        messages.error(self.request, "Please correct the errors in the invoice items below (check stock levels).")
+        return self.render_to_response(self.get_context_data(form=form, items_formset=items_formset))
 
     def form_invalid(self, form):
         context = self.get_context_data()
@@ -695,38 +729,114 @@ class InvoiceUpdateView(StaffRequiredMixin, UpdateView):
     def get_success_url(self):
         return reverse('invoice-detail', kwargs={'pk': self.object.pk})
 
-class InvoiceDeleteView(StaffRequiredMixin, DeleteView):
+class InvoiceVoidView(DocumentVoidView):
     model = Invoice
-    template_name = 'inventory/confirm_delete_base.html' # Reusable template
-    success_url = reverse_lazy('invoice-list') # Go back to list view on success
+    object_type = 'Invoice'
+    warning_message = "Voiding this invoice returns the quantities it sold to stock and removes it from sales reports."
+
+# --- Stock-take Views ---
+class StockTakeListView(StaffRequiredMixin, ListView):
+    """Count sessions, newest first; POST opens a new one."""
+    model = StockTake
+    template_name = 'inventory/stocktake_list.html'
+    context_object_name = 'stock_takes'
+    paginate_by = 20
+    ordering = ['-created_at'] # Meta ordering is dropped from the grouped (annotated) query
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('created_by').annotate(line_count=Count('lines'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['page_title'] = f'Delete Invoice: {self.object.invoice_number}'
-        context['object_type'] = 'Invoice'
-        context['cancel_url'] = self.object.get_absolute_url() if self.object else reverse_lazy('invoice-list')
-        context['warning_message'] = "Deleting this invoice will attempt to return the stock quantities deducted by its items. This might affect current stock levels."
+        context['page_title'] = 'Stock-takes'
         return context
 
     def post(self, request, *args, **kwargs):
-        invoice = self.get_object()
-        with db_transaction.atomic():
-            try:
-                # Attempt stock return before deleting
-                for item in invoice.items.all():
-                     Transaction.objects.create(
-                         product=item.product,
-                         transaction_type='IN', # Stock comes back IN
-                         quantity=item.quantity,
-                         user=request.user,
-                         notes=f"Stock returned due to deletion of Invoice {invoice.invoice_number}"
-                     )
-                messages.success(request, f"Invoice '{invoice.invoice_number}' deleted. Stock levels adjusted (returned).")
-                # Proceed with actual deletion via superclass method
-                return super().post(request, *args, **kwargs)
-            except Exception as e:
-                 messages.error(request, f"Error returning stock for Invoice {invoice.invoice_number}: {e}. Deletion aborted.")
-                 return redirect(invoice.get_absolute_url())
+        stock_take = StockTake.objects.create(created_by=request.user, notes=request.POST.get('notes') or None)
+        messages.success(request, f"{stock_take} opened. Scan items or upload counts, then commit.")
+        return redirect(stock_take.get_absolute_url())
+
+class StockTakeDetailView(StaffRequiredMixin, DetailView):
+    """A count session: record counts by scan or CSV, review variances, then commit or cancel."""
+    model = StockTake
+    template_name = 'inventory/stocktake_detail.html'
+    context_object_name = 'stock_take'
+    lines_per_page = 50
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        lines = self.object.lines.select_related('product').annotate(
+            difference=F('counted_quantity') - F('expected_quantity'),
+        ).order_by('-counted_at', 'product__name')
+        context['summary'] = self.object.lines.aggregate(
+            counted=Count('id'),
+            with_variance=Count('id', filter=~Q(counted_quantity=F('expected_quantity'))),
+            net_variance=Coalesce(Sum(F('counted_quantity') - F('expected_quantity')), 0),
+        )
+        context['page_obj'] = Paginator(lines, self.lines_per_page).get_page(self.request.GET.get('page'))
+        context['scan_form'] = kwargs.get('scan_form') or StockCountScanForm()
+        context['upload_form'] = kwargs.get('upload_form') or StockCountUploadForm()
+        context['page_title'] = str(self.object)
+        return context
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        action = request.POST.get('action')
+        try:
+            if action == 'scan':
+                form = StockCountScanForm(request.POST)
+                if not form.is_valid():
+                    return self.render_to_response(self.get_context_data(scan_form=form))
+                product = stocktake.record_scan(self.object, form.cleaned_data['sku'].strip(), form.cleaned_data['quantity'])
+                messages.success(request, f"Counted {form.cleaned_data['quantity']} x {product.name}.")
+            elif action == 'upload':
+                form = StockCountUploadForm(request.POST, request.FILES)
+                if not form.is_valid():
+                    return self.render_to_response(self.get_context_data(upload_form=form))
+                csv_file = io.TextIOWrapper(form.cleaned_data['csv_file'].file, encoding='utf-8-sig', newline='')
+                recorded, errors = stocktake.import_counts(self.object, csv_file)
+                messages.success(request, f"Recorded {recorded} count(s).")
+                for line, problem in errors[:20]:
+                    messages.warning(request, f"Line {line}: {problem}")
+                if len(errors) > 20:
+                    messages.warning(request, f"... and {len(errors) - 20} more problem row(s).")
+            elif action == 'commit':
+                adjusted = stocktake.commit(self.object, user=request.user)
+                messages.success(request, f"Stock-take #{self.object.pk} committed: {adjusted} product(s) adjusted.")
+            elif action == 'cancel':
+                stocktake.cancel(self.object)
+                messages.info(request, f"Stock-take #{self.object.pk} cancelled; stock was not changed.")
+        except (forms.ValidationError, UnicodeDecodeError, csv.Error) as e:
+            messages.error(request, ' '.join(e.messages) if isinstance(e, forms.ValidationError) else f"Could not read the file: {e}")
+        return redirect(self.object.get_absolute_url())
+
+# --- Reorder Queue ---
+class ReorderQueueView(StaffRequiredMixin, TemplateView):
+    """Low-stock products grouped by supplier, with the quantity to order to restock them."""
+    template_name = 'inventory/reorder_queue.html'
+    target_multiplier = 2 # Suggest ordering up to this multiple of the reorder level
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        products = Product.objects.filter(is_low_stock=True).select_related('supplier').annotate(
+            suggested_quantity=F('reorder_level') * self.target_multiplier - F('quantity'),
+        ).order_by(F('supplier__name').asc(nulls_last=True), 'name')
+
+        queue = []
+        for supplier, items in groupby(products, key=lambda product: product.supplier):
+            items = list(items)
+            for product in items:
+                product.suggested_quantity = max(product.suggested_quantity, 1)
+                product.estimated_cost = product.suggested_quantity * product.unit_price
+            queue.append({
+                'supplier': supplier,
+                'products': items,
+                'estimated_cost': sum(product.estimated_cost for product in items),
+            })
+
+        context['queue'] = queue
+        context['page_title'] = 'Reorder Queue'
+        return context
 
 # --- Date Range Report Views ---
 class ReportListView(StaffRequiredMixin, FormView):
@@ -747,6 +857,106 @@ class ReportListView(StaffRequiredMixin, FormView):
         self.request.session['report_end_date'] = end_date.isoformat()
         return redirect('report-view')
 
+class PdfExportView(StaffRequiredMixin, FormView):
+    """Exports all invoices or receipts in a date range as a streamed ZIP of PDFs or one combined PDF."""
+    template_name = 'inventory/pdf_export.html'
+    form_class = PdfExportForm
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_title'] = 'Bulk PDF Export'
+        return context
+
+    def form_valid(self, form):
+        if HTML is None:
+            messages.error(self.request, "PDF generation library (WeasyPrint) is not installed.")
+            return self.form_invalid(form)
+        kind = form.cleaned_data['document_type']
+        start_date, end_date = form.cleaned_data['start_date'], form.cleaned_data['end_date']
+        name = f"{kind}s_{start_date.isoformat()}_{end_date.isoformat()}"
+        base_url = self.request.build_absolute_uri('/')
+
+        if form.cleaned_data['output_format'] == 'pdf':
+            try:
+                html_strings = pdf_export.merged_html(kind, start_date, end_date)
+            except ValueError as e:
+                form.add_error(None, str(e))
+                return self.form_invalid(form)
+            if not html_strings:
+                form.add_error(None, f"No {kind}s found in this date range.")
+                return self.form_invalid(form)
+            # A bounded PDF job like any other; a long merge is finished on the job's poll page
+            return render_pdf(self.request, html_strings, f"{name}.pdf", reverse('pdf-export'))
+
+        # The ZIP is streamed as each PDF completes; the download itself shows the progress
+        total = pdf_export.documents(kind, start_date, end_date).count()
+        workers = getattr(settings, 'PDF_WORKERS', 2) or 1
+        # Renders count against PDF_QUEUE_SIZE, shared with the single-document PDF views
+        pdfs = pdf_export.iter_pdfs(kind, start_date, end_date, pdf.QueuedPool(), workers, base_url)
+        response = StreamingHttpResponse(
+            pdf_export.zip_stream(pdfs, total=total, progress=pdf_export.log_progress),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+        return response
+
+class CatalogImportView(StaffRequiredMixin, FormView):
+    """Imports products, suppliers or categories from an uploaded CSV and shows the per-row results."""
+    template_name = 'inventory/catalog_import.html'
+    form_class = CatalogImportForm
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_title'] = 'Catalog Import'
+        return context
+
+    def form_valid(self, form):
+        csv_file = io.TextIOWrapper(form.cleaned_data['csv_file'].file, encoding='utf-8-sig', newline='')
+        try:
+            result = importer.import_csv(
+                form.cleaned_data['kind'], csv_file, user=self.request.user, dry_run=form.cleaned_data['dry_run'],
+            )
+        except (forms.ValidationError, UnicodeDecodeError, csv.Error) as e:
+            form.add_error('csv_file', e.messages if isinstance(e, forms.ValidationError) else f"Could not read the file: {e}")
+            return self.form_invalid(form)
+        # Show the counts and the skipped rows under the form
+        return self.render_to_response(self.get_context_data(form=form, result=result, errors=result['errors'][:200]))
+
+class DataExportView(StaffRequiredMixin, FormView):
+    """
+    Streams the ledger, invoices, receipts or their lines as CSV or NDJSON. The form is
+    submitted with GET, so an export URL can be bookmarked or fetched by a script.
+    """
+    template_name = 'inventory/data_export.html'
+    form_class = DataExportForm
+
+    def get(self, request, *args, **kwargs):
+        if 'dataset' in request.GET:
+            form = self.get_form_class()(request.GET)
+            return self.form_valid(form) if form.is_valid() else self.form_invalid(form)
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_title'] = 'Data Export'
+        return context
+
+    def form_valid(self, form):
+        dataset, file_format = form.cleaned_data['dataset'], form.cleaned_data['file_format']
+        product = form.cleaned_data['product']
+        chunks = data_export.stream(
+            dataset, file_format, start_date=form.cleaned_data['start_date'],
+            end_date=form.cleaned_data['end_date'], product_id=product.pk if product else None,
+        )
+        encoding = data_export.negotiate_encoding(self.request.headers.get('Accept-Encoding'))
+        content_type, extension = data_export.FORMATS[file_format]
+        response = StreamingHttpResponse(data_export.encode(chunks, encoding), content_type=f'{content_type}; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{extension}"'
+        return response
+
 @login_required
 def report_view(request):
     """Displays the comprehensive report based on dates stored in the session."""
@@ -759,20 +969,21 @@ def report_view(request):
 
     try:
         start_date = parse(start_date_str).date()
-        # Include the entire end date day by setting time to end of day
-        end_date_dt = parse(end_date_str).replace(hour=23, minute=59, second=59, microsecond=999999)
-        end_date = end_date_dt.date() # Use date part for filtering date fields
+        end_date = parse(end_date_str).date() # Use date part for filtering date fields
     except ValueError:
         messages.error(request, "Invalid date format stored.")
         return redirect('report-list')
 
     # --- Gather Report Data ---
+    # Half-open [start, end) range on the raw timestamp so the timestamp index is used
+    range_start, range_end = day_range(start_date, end_date)
     transactions = Transaction.objects.filter(
-        timestamp__date__gte=start_date, timestamp__date__lte=end_date
+        timestamp__gte=range_start, timestamp__lt=range_end
     ).select_related('product', 'user').order_by('timestamp')
 
+    # Voided documents are left out; (status, date) indexes serve these filters
     sales_summary = Invoice.objects.filter(
-        sale_date__gte=start_date, sale_date__lte=end_date
+        status='posted', sale_date__gte=start_date, sale_date__lte=end_date
     ).aggregate(
         total_sales=Sum('total_amount'), total_sub_total=Sum('sub_total'),
         total_tax=Sum('tax_amount'), total_discount=Sum('discount_amount'),
@@ -780,19 +991,19 @@ def report_view(request):
     )
 
     purchase_summary = Receipt.objects.filter(
-        purchase_date__gte=start_date, purchase_date__lte=end_date
+        status='posted', purchase_date__gte=start_date, purchase_date__lte=end_date
     ).aggregate(
         total_purchases=Sum('total_amount'), receipt_count=Count('id')
     )
 
     top_selling_products = InvoiceItem.objects.filter(
-        invoice__sale_date__gte=start_date, invoice__sale_date__lte=end_date
+        invoice__status='posted', invoice__sale_date__gte=start_date, invoice__sale_date__lte=end_date
     ).values('product__name').annotate(
         total_quantity_sold=Sum('quantity'),
         total_revenue=Sum(F('quantity') * F('unit_price'))
     ).order_by('-total_quantity_sold')[:10]
 
-    low_stock_products = Product.objects.filter(quantity__lte=F('reorder_level')).order_by('quantity')
+    low_stock_products = Product.objects.filter(is_low_stock=True).order_by('quantity')
 
     context = {
         'start_date': start_date,
@@ -826,48 +1037,138 @@ class DailySalesReportSelectView(LoginRequiredMixin, FormView):
         return HttpResponseRedirect(pdf_url)
 
 # --- PDF Generation Views ---
-@login_required
-def receipt_pdf_view(request, pk):
-    """Generates and serves a PDF for a specific receipt."""
-    if HTML is None:
-        messages.error(request, "PDF generation library (WeasyPrint) is not installed.")
-        return redirect('receipt-detail', pk=pk) # Redirect back to detail view
-
-    receipt = get_object_or_404(Receipt.objects.prefetch_related('items__product'), pk=pk)
-    context = {'receipt': receipt, 'request': request}
-    html_string = render_to_string('inventory/receipt_pdf.html', context)
-
+def render_pdf(request, html_string, filename, fallback_url, on_ready=None):
+    """
+    Queues `html_string` on the PDF worker pool. Serves the PDF if it is ready within
+    PDF_WAIT_SECONDS, otherwise redirects to the job's poll page.
+    """
     try:
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        pdf_file = html.write_pdf()
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="receipt_{receipt.receipt_number}.pdf"' # Show inline or attachment
-        return response
+        job_id, future = pdf.submit(
+            html_string, request.build_absolute_uri('/'), filename,
+            user_id=request.user.pk, fallback_url=fallback_url, on_ready=on_ready,
+        )
+    except pdf.PdfQueueFull:
+        messages.error(request, "Too many PDFs are being generated right now. Please try again in a moment.")
+        return redirect(fallback_url)
+    try:
+        future.result(timeout=pdf.wait_seconds())
+    except FutureTimeout:
+        return redirect('pdf-job', job_id=job_id)
     except Exception as e:
         # Catch potential WeasyPrint errors (e.g., missing system deps)
         messages.error(request, f"Error generating PDF: {e}")
-        return redirect('receipt-detail', pk=pk)
+        return redirect(fallback_url)
+    return FileResponse(open(pdf.pdf_path(job_id), 'rb'), content_type='application/pdf', filename=filename)
+
+@login_required
+def pdf_job_view(request, job_id):
+    """Serves a queued PDF once rendered; until then shows a page that refreshes itself."""
+    state, meta = pdf.job_status(job_id)
+    if state is None:
+        raise Http404("Unknown or expired PDF job.")
+    if meta['user_id'] != request.user.pk and not request.user.is_staff:
+        return HttpResponseForbidden("This PDF was requested by another user.")
+    if state == 'ready':
+        return FileResponse(open(pdf.pdf_path(job_id), 'rb'), content_type='application/pdf', filename=meta['filename'])
+    if state == 'failed':
+        messages.error(request, f"Error generating PDF: {meta['error']}")
+        return redirect(meta['fallback_url'])
+    context = {'filename': meta['filename'], 'fallback_url': meta['fallback_url'], 'page_title': 'Generating PDF'}
+    return render(request, 'inventory/pdf_pending.html', context, status=202)
 
 @login_required
+def pdf_metrics_view(request):
+    """Queue depth and render-time counters of the PDF workers (staff only)."""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(pdf.metrics())
+
+def _pdf_version(request, kind, pk):
+    """
+    Returns {'key', 'updated_at', 'number'} for a document's cached PDF, or None if it does not
+    exist. Read with one small query and remembered on the request, so the conditional-GET
+    checks and the view share it.
+    """
+    cache = request.__dict__.setdefault('_pdf_versions', {})
+    if (kind, pk) not in cache:
+        model, number_field = (Invoice, 'invoice_number') if kind == 'invoice' else (Receipt, 'receipt_number')
+        row = model.objects.filter(pk=pk).values('updated_at', number_field).first()
+        cache[(kind, pk)] = row and {
+            'key': pdf_cache.cache_key(kind, pk, row['updated_at']),
+            'updated_at': row['updated_at'],
+            'number': row[number_field],
+        }
+    return cache[(kind, pk)]
+
+def _pdf_etag(kind):
+    return lambda request, pk: (_pdf_version(request, kind, pk) or {}).get('key')
+
+def _pdf_last_modified(kind):
+    return lambda request, pk: (_pdf_version(request, kind, pk) or {}).get('updated_at')
+
+def _pdf_conditional(kind):
+    """
+    @condition for a document PDF view. Only a served PDF carries the ETag / Last-Modified
+    validators: a redirect (queued render, missing WeasyPrint, failure) must not let the
+    browser revalidate to a 304 for a PDF it never received.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=_pdf_etag(kind), last_modified_func=_pdf_last_modified(kind))(view)
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                del response['ETag']
+                del response['Last-Modified']
+            return response
+        return wrapped
+    return decorator
+
+def cached_document_pdf(request, kind, pk, build_html):
+    """
+    Serves a receipt or invoice PDF from the PDF cache, rendering it on a miss.
+    `build_html()` is only called (and the items only loaded) when the PDF must be rendered.
+    """
+    version = _pdf_version(request, kind, pk)
+    if version is None:
+        raise Http404(f"No {kind} found.")
+    filename = f"{kind}_{version['number']}.pdf"
+    fallback_url = reverse(f'{kind}-detail', kwargs={'pk': pk})
+    cached_path = pdf_cache.get(kind, pk, version['key'])
+    if cached_path:
+        response = FileResponse(open(cached_path, 'rb'), content_type='application/pdf', filename=filename)
+    else:
+        if HTML is None:
+            messages.error(request, "PDF generation library (WeasyPrint) is not installed.")
+            return redirect(fallback_url) # Redirect back to detail view
+        response = render_pdf(request, build_html(), filename, fallback_url,
+                              on_ready=partial(pdf_cache.store, kind, pk, version['key']))
+    # Browsers keep the PDF but revalidate it (If-None-Match / If-Modified-Since) on every view
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+@_pdf_conditional('receipt')
+def receipt_pdf_view(request, pk):
+    """Generates and serves a PDF for a specific receipt."""
+    def build_html():
+        receipt = get_object_or_404(Receipt.objects.prefetch_related('items__product').select_related('supplier', 'created_by'), pk=pk)
+        # No request in the context: the cached PDF is the same for every viewer
+        return render_to_string('inventory/receipt_pdf.html', {'receipt': receipt})
+
+    return cached_document_pdf(request, 'receipt', pk, build_html)
+
+@login_required
+@_pdf_conditional('invoice')
 def invoice_pdf_view(request, pk):
     """Generates and serves a PDF for a specific invoice."""
-    if HTML is None:
-        messages.error(request, "PDF generation library (WeasyPrint) is not installed.")
-        return redirect('invoice-detail', pk=pk)
+    def build_html():
+        invoice = get_object_or_404(Invoice.objects.prefetch_related('items__product').select_related('created_by'), pk=pk)
+        # No request in the context: the cached PDF is the same for every viewer
+        return render_to_string('inventory/invoice_pdf.html', {'invoice': invoice})
 
-    invoice = get_object_or_404(Invoice.objects.prefetch_related('items__product'), pk=pk)
-    context = {'invoice': invoice, 'request': request}
-    html_string = render_to_string('inventory/invoice_pdf.html', context)
-
-    try:
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        pdf_file = html.write_pdf()
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="invoice_{invoice.invoice_number}.pdf"' # Show inline or attachment
-        return response
-    except Exception as e:
-        messages.error(request, f"Error generating PDF: {e}")
-        return redirect('invoice-detail', pk=pk)
+    return cached_document_pdf(request, 'invoice', pk, build_html)
 
 @login_required
 def daily_sales_report_pdf_view(request, date_str):
@@ -882,30 +1183,20 @@ def daily_sales_report_pdf_view(request, date_str):
         messages.error(request, "Invalid date format.")
         return redirect('daily-sales-report-select')
 
-    invoices_for_day = Invoice.objects.filter(sale_date=report_date).order_by('invoice_number')
-    sales_summary = invoices_for_day.aggregate(
-        total_sales=Sum('total_amount'), invoice_count=Count('id')
-    )
+    invoices_for_day = Invoice.objects.filter(status='posted', sale_date=report_date).order_by('invoice_number')
+    sales_summary = DailySummary.for_date(report_date)
 
     context = {
         'report_date': report_date,
         'invoices': invoices_for_day,
-        'total_sales': sales_summary.get('total_sales') or 0.00,
-        'invoice_count': sales_summary.get('invoice_count') or 0,
+        'total_sales': sales_summary.sales_total,
+        'invoice_count': sales_summary.invoice_count,
         'request': request,
     }
 
     html_string = render_to_string('inventory/daily_sales_report_pdf.html', context)
 
-    try:
-        html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-        pdf_file = html.write_pdf()
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="daily_sales_{date_str}.pdf"' # Show inline or attachment
-        return response
-    except Exception as e:
-        messages.error(request, f"Error generating PDF: {e}")
-        return redirect('daily-sales-report-select')
+    return render_pdf(request, html_string, f"daily_sales_{date_str}.pdf", reverse('daily-sales-report-select'))
     
 
 
@@ -932,31 +1223,24 @@ class DailyActivityView(LoginRequiredMixin, TemplateView):
 
         # Get today's receipts (Purchases)
         todays_receipts = Receipt.objects.filter(
-            purchase_date=today
+            status='posted', purchase_date=today
         ).select_related('supplier', 'created_by').order_by('created_at')
 
         # Get today's invoices (Sales)
         todays_invoices = Invoice.objects.filter(
-            sale_date=today
+            status='posted', sale_date=today
         ).select_related('created_by').order_by('created_at')
 
-        # Calculate totals
-        purchase_totals = todays_receipts.aggregate(
-            total_purchase_amount=Sum('total_amount'),
-            receipt_count=Count('id')
-        )
-        sales_totals = todays_invoices.aggregate(
-            total_sales_amount=Sum('total_amount'),
-            invoice_count=Count('id')
-        )
+        # Totals from the daily rollup
+        summary = DailySummary.for_date(today)
 
         context['today_date'] = today
         context['todays_receipts'] = todays_receipts
         context['todays_invoices'] = todays_invoices
-        context['total_purchase_amount'] = purchase_totals.get('total_purchase_amount') or 0.00
-        context['receipt_count_today'] = purchase_totals.get('receipt_count') or 0
-        context['total_sales_amount'] = sales_totals.get('total_sales_amount') or 0.00
-        context['invoice_count_today'] = sales_totals.get('invoice_count') or 0
+        context['total_purchase_amount'] = summary.purchase_total
+        context['receipt_count_today'] = summary.receipt_count
+        context['total_sales_amount'] = summary.sales_total
+        context['invoice_count_today'] = summary.invoice_count
         context['page_title'] = f'Activity for Today ({today.strftime("%Y-%m-%d")})'
 
         return context    
@@ -1019,6 +1303,8 @@ class ProfitReportView(StaffRequiredMixin, TemplateView):
     Uses GET parameters for filtering.
     """
     template_name = 'inventory/profit_report.html'
+    lines_per_page = 50
+    top_products = 25
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1033,7 +1319,7 @@ class ProfitReportView(StaffRequiredMixin, TemplateView):
         context['total_revenue'] = Decimal('0.00')
         context['total_cogs'] = Decimal('0.00')
         context['total_profit'] = Decimal('0.00')
-        context['items_sold'] = [] # Optional: list items contributing to profit
+        context['items_sold'] = [] # Current page of invoice lines contributing to profit
 
         # Process form if submitted via GET and valid
         if form.is_valid():
@@ -1042,49 +1328,55 @@ class ProfitReportView(StaffRequiredMixin, TemplateView):
             context['start_date'] = start_date
             context['end_date'] = end_date
 
-            # Query InvoiceItems within the date range that have a product linked
-            # Select related product and invoice for efficiency
+            # All figures are aggregated in the database (GROUP BY), so memory use does not
+            # depend on how many invoice lines fall in the range.
             items_sold = InvoiceItem.objects.filter(
+                invoice__status='posted', # Voided sales made no profit
                 invoice__sale_date__gte=start_date,
                 invoice__sale_date__lte=end_date,
                 product__isnull=False # Important: Exclude items where product might be deleted
-            ).select_related('product', 'invoice')
-
-            total_revenue = Decimal('0.00')
-            total_cogs = Decimal('0.00')
-
-            # Calculate totals by iterating (alternative to aggregate for clarity here)
-            # Or use aggregate (more efficient for large datasets)
-            # items_sold_agg = items_sold.aggregate(
-            #    total_revenue=Sum(F('quantity') * F('unit_price'), output_field=DecimalField()),
-            #    total_cogs=Sum(F('quantity') * F('product__unit_price'), output_field=DecimalField())
-            # )
-            # total_revenue = items_sold_agg.get('total_revenue') or Decimal('0.00')
-            # total_cogs = items_sold_agg.get('total_cogs') or Decimal('0.00')
-
-            # Iteration method (can be slower but shows individual item calc if needed)
-            processed_items = []
-            for item in items_sold:
-                line_revenue = item.quantity * item.unit_price
-                line_cogs = item.quantity * item.product.unit_price # Assumes product.unit_price is cost
-                line_profit = line_revenue - line_cogs
-                total_revenue += line_revenue
-                total_cogs += line_cogs
-                processed_items.append({
-                    'item': item,
-                    'line_revenue': line_revenue,
-                    'line_cogs': line_cogs,
-                    'line_profit': line_profit
-                })
-
-
+            )
+            money = DecimalField(max_digits=14, decimal_places=2)
+            line_revenue = ExpressionWrapper(F('quantity') * F('unit_price'), output_field=money)
+            # Realized FIFO cost stored at posting time; lines posted before cost tracking
+            # fall back to the product's current unit_price
+            line_cogs = Coalesce('cogs', ExpressionWrapper(F('quantity') * F('product__unit_price'), output_field=money), output_field=money)
+            revenue = Sum(line_revenue)
+            cogs = Sum(line_cogs)
+
+            def grouped(*fields):
+                return items_sold.values(*fields).annotate(
+                    quantity_sold=Sum('quantity'), revenue=revenue, cogs=cogs,
+                ).annotate(profit=F('revenue') - F('cogs'))
+
+            totals = items_sold.aggregate(total_revenue=revenue, total_cogs=cogs)
+            total_revenue = totals['total_revenue'] or Decimal('0.00')
+            total_cogs = totals['total_cogs'] or Decimal('0.00')
             total_profit = total_revenue - total_cogs
 
+            # Breakdowns: top products, every category, every day in the range
+            context['profit_by_product'] = grouped('product_id', 'product__name', 'product__sku').order_by('-profit')[:self.top_products]
+            context['profit_by_category'] = grouped('product__category__name').order_by('-profit')
+            context['profit_by_day'] = grouped('invoice__sale_date').order_by('invoice__sale_date')
+
+            # Line-level detail is paginated; only one page of lines is loaded
+            lines = items_sold.select_related('product', 'invoice').annotate(
+                line_revenue=line_revenue, line_cogs=line_cogs,
+            ).annotate(
+                line_profit=F('line_revenue') - F('line_cogs'),
+                line_unit_cost=Cast('line_cogs', FloatField()) / F('quantity'), # Display only
+            ).order_by('invoice__sale_date', 'invoice_id', 'id')
+            paginator = Paginator(lines, self.lines_per_page)
+            page_obj = paginator.get_page(self.request.GET.get('page'))
+
             # Update context with calculated results
             context['total_revenue'] = total_revenue
             context['total_cogs'] = total_cogs
             context['total_profit'] = total_profit
-            context['items_sold'] = processed_items # Pass processed items if showing table
+            context['items_sold'] = page_obj.object_list
+            context['paginator'] = paginator
+            context['page_obj'] = page_obj
+            context['is_paginated'] = page_obj.has_other_pages()
             context['results_available'] = True # Flag to show results section
 
         return context
\ No newline at end of file
@@ -79,9 +79,43 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent checkouts queue
+            # (up to `timeout` seconds) instead of failing with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file, not the default in-memory database, so tests can open several connections
+        # (ConcurrentCheckoutTests runs checkouts from parallel threads)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Cost stored on sale lines (InvoiceItem.cogs) and used by the profit report:
+# 'fifo' (cost layers) or 'average' (moving weighted-average cost kept on Product).
+INVENTORY_COST_METHOD = 'fifo'
+
+# PDF rendering runs in a pool of pre-warmed worker processes (see inventory/pdf.py).
+# PDF_WORKERS = 0 renders inside the request instead (useful for development and tests).
+PDF_WORKERS = 2
+PDF_QUEUE_SIZE = 20 # Jobs waiting or rendering per web process before new requests are turned away
+PDF_WAIT_SECONDS = 5 # How long a PDF view waits before redirecting to the job's poll page
+PDF_JOB_DIR = os.path.join(BASE_DIR, 'pdf_jobs')
+PDF_JOB_TTL = 600 # Seconds a finished job's PDF is kept for polling
+
+# Rendered invoice/receipt PDFs are cached on disk, keyed by document, updated_at and template
+# version (see inventory/pdf_cache.py). Bump PDF_TEMPLATE_VERSION to drop them all.
+PDF_CACHE_DIR = os.path.join(BASE_DIR, 'pdf_cache')
+PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Least recently used PDFs are evicted beyond this
+PDF_TEMPLATE_VERSION = 1
+
+# Dashboard figures are cached (see inventory/dashboard_cache.py) in the default cache, which
+# is per-process local memory unless CACHES is configured. Writes invalidate the local cache
+# immediately; other processes see them within DASHBOARD_CACHE_TTL seconds (use a shared
+# backend such as Redis or Memcached to invalidate across processes).
+DASHBOARD_CACHE_TTL = 60
+DASHBOARD_CACHE_STALE = 10 # Seconds a stale value may be served while one request recomputes it
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators